@@ -3,3 +3,13 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from django.contrib.auth import get_user_model
+        from django.db.models.signals import post_delete, post_save
+
+        from .authentication import user_changed
+
+        # Drop cached users for CachedJWTAuthentication when they change
+        post_save.connect(user_changed, sender=get_user_model(), dispatch_uid='api.user_changed.save')
+        post_delete.connect(user_changed, sender=get_user_model(), dispatch_uid='api.user_changed.delete')
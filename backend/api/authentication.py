@@ -0,0 +1,99 @@
+"""
+JWT authentication that resolves users through a short-lived in-process cache.
+
+simplejwt's JWTAuthentication loads the User row on every request. Here
+the row is cached per process for AUTH_USER_CACHE_TTL seconds (default 60).
+Saving or deleting a user drops the entry in the process that made the
+change (ApiConfig.ready connects the signals), which sees it from the next
+request. Other worker processes keep their copy until it expires, so a
+deactivation can take up to AUTH_USER_CACHE_TTL seconds to reach every
+worker; so can changes made with queryset.update().
+
+is_active and, when SIMPLE_JWT's CHECK_REVOKE_TOKEN is enabled, the
+token's password hash are checked against the cached row on every request.
+"""
+
+import copy
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .result_cache import ResultCache
+
+DEFAULT_USER_CACHE_TTL = 60
+DEFAULT_USER_CACHE_SIZE = 10000
+
+_user_cache = ResultCache(
+    max_entries=getattr(settings, 'AUTH_USER_CACHE_SIZE', DEFAULT_USER_CACHE_SIZE),
+    ttl=DEFAULT_USER_CACHE_TTL,
+)
+
+
+def cache_key(user_id):
+    return f"user:{user_id}"
+
+
+def invalidate_user(user_id):
+    _user_cache.delete(cache_key(user_id))
+
+
+def user_changed(sender, instance, **kwargs):
+    """post_save/post_delete receiver; waits for commit so a concurrent request cannot re-cache the old row"""
+    user_id = instance.pk
+    transaction.on_commit(lambda: invalidate_user(user_id))
+
+
+def cache_stats():
+    return _user_cache.stats()
+
+
+def clear_cache():
+    _user_cache.clear()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication whose user lookup is served from the per-process cache"""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        key = cache_key(user_id)
+        user = _user_cache.get(key)
+        if user is None:
+            try:
+                user = self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist as e:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+            _user_cache.set(key, user, ttl=getattr(settings, 'AUTH_USER_CACHE_TTL', DEFAULT_USER_CACHE_TTL))
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return self.user_for(user, validated_token)
+
+    def user_for(self, user, validated_token):
+        # A copy, so a view changing request.user cannot alter the cached row
+        return copy.copy(user)
+
+
+class CachedTokenUserAuthentication(CachedJWTAuthentication):
+    """
+    The same checks, but request.user is a TokenUser built from the token.
+
+    For read-only views that need nothing from the user but its id.
+    """
+
+    def user_for(self, user, validated_token):
+        return api_settings.TOKEN_USER_CLASS(validated_token)
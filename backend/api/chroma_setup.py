@@ -1,13 +1,82 @@
 import chromadb
+import fcntl
 import json
-from datetime import datetime
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
 import numpy as np
 
+# Process-wide client and collection handles, built lazily on first use
+_client = None
+_collections = None
+_similarity_index = None
+_lock = threading.Lock()
+
+def get_setting(name, default):
+    """Read a setting from Django settings, or from the environment when running standalone"""
+    from django.conf import settings
+    if settings.configured:
+        return getattr(settings, name, default)
+    return os.getenv(name, default)
+
+def get_chroma_path():
+    """Storage path from Django settings, or CHROMA_DB_PATH when running standalone"""
+    return str(get_setting('CHROMA_DB_PATH', './chroma_db'))
+
 def get_chroma_client():
     """Initialize ChromaDB client with persistent storage"""
-    client = chromadb.PersistentClient(path="./chroma_db")
+    client = chromadb.PersistentClient(path=get_chroma_path())
     return client
 
+def get_collections():
+    """Return the shared collection handles, connecting on first use"""
+    global _client, _collections
+    collections = _collections
+    if collections is not None:
+        return collections
+
+    with _lock:
+        if _collections is None:
+            client = get_chroma_client()
+            _collections = create_collections(client)
+            _client = client
+        return _collections
+
+def reset_collections():
+    """Drop the shared handles so the next get_collections() reconnects"""
+    global _client, _collections
+    with _lock:
+        _client = None
+        _collections = None
+
+def get_similarity_index():
+    """
+    Return the local NumPy similarity index when SIMILARITY_BACKEND is 'numpy'.
+
+    Returns None with the default 'chroma' backend.
+    """
+    global _similarity_index
+    if get_setting('SIMILARITY_BACKEND', 'chroma') != 'numpy':
+        return None
+
+    with _lock:
+        if _similarity_index is None:
+            from .similarity import NumpySimilarityIndex
+            _similarity_index = NumpySimilarityIndex(
+                get_setting('SIMILARITY_INDEX_PATH', './similarity_index'),
+                dim=EMBEDDING_DIM,
+                metric=get_setting('SIMILARITY_METRIC', 'cosine'),
+            )
+        return _similarity_index
+
+def get_similarity_collection():
+    """The collection-like object find_similar_workouts should query for the configured backend"""
+    index = get_similarity_index()
+    if index is not None:
+        return index
+    return get_collections()['workouts']
+
 def create_collections(client):
     """Create all necessary ChromaDB collections for fitness intelligence"""
     collections = {}
@@ -32,6 +101,11 @@ def create_collections(client):
 
     return collections
 
+# Categorical encodings shared by the scalar and batch embedding builders
+ACTIVITY_CODES = {'run': 0, 'cycle': 1, 'walk': 2, 'swim': 3, 'other': 4}
+INTENSITY_CODES = {'low': 0, 'moderate': 1, 'high': 2}
+EMBEDDING_DIM = 10
+
 def create_workout_embedding(workout_data):
     """Create a vector embedding from workout data for ChromaDB storage"""
     # Extract key features for vectorization
@@ -40,8 +114,8 @@ def create_workout_embedding(workout_data):
         workout_data.get('distance', 0),       # Distance in km
         workout_data.get('heart_rate_avg', 0) / 200,  # Normalized HR
         workout_data.get('heart_rate_max', 0) / 200,  # Normalized max HR
-        {'run': 0, 'cycle': 1, 'walk': 2, 'swim': 3, 'other': 4}.get(workout_data.get('activity_type', 'other'), 4) / 4,
-        {'low': 0, 'moderate': 1, 'high': 2}.get(workout_data.get('intensity', 'moderate'), 1) / 2,
+        ACTIVITY_CODES.get(workout_data.get('activity_type', 'other'), 4) / 4,
+        INTENSITY_CODES.get(workout_data.get('intensity', 'moderate'), 1) / 2,
     ]
 
     # Add VO2 max estimate if available (normalized)
@@ -61,19 +135,76 @@ def create_workout_embedding(workout_data):
 
     return embedding.tolist()
 
-def store_workout_in_chroma(collection, workout_data, user_id):
-    """Store a workout in ChromaDB with vector embedding"""
+def workout_embedding_matrix(duration, distance, heart_rate_avg, heart_rate_max,
+                             activity_type, intensity, vo2max_estimate):
+    """
+    Build an (N, 10) float32 embedding matrix from columnar workout data.
+
+    Produces the same features, in the same order and normalization, as
+    create_workout_embedding applied to each row.
+    """
+    base = np.column_stack([
+        np.asarray(duration, dtype=np.float64) / 60,
+        np.asarray(distance, dtype=np.float64),
+        np.asarray(heart_rate_avg, dtype=np.float64) / 200,
+        np.asarray(heart_rate_max, dtype=np.float64) / 200,
+        np.array([ACTIVITY_CODES.get(a, 4) for a in activity_type], dtype=np.float64) / 4,
+        np.array([INTENSITY_CODES.get(i, 1) for i in intensity], dtype=np.float64) / 2,
+        np.asarray(vo2max_estimate, dtype=np.float64) / 80,
+    ]).astype(np.float32).reshape(-1, 7)
+
+    embeddings = np.empty((base.shape[0], EMBEDDING_DIM), dtype=np.float32)
+    embeddings[:, :7] = base
+    embeddings[:, 7] = base[:, 0] * base[:, 1]  # Duration × Distance (volume proxy)
+    embeddings[:, 8] = base[:, 2] * base[:, 0]  # Avg HR × Duration (cardio stress)
+    embeddings[:, 9] = base[:, 1] / np.maximum(base[:, 0], np.float32(0.1))  # Speed proxy
+    return embeddings
+
+def create_workout_embeddings(workouts_data):
+    """Create embeddings for many workout dicts at once, as an (N, 10) float32 array"""
+    def column(key, default):
+        values = [workout.get(key, default) for workout in workouts_data]
+        return [default if value is None else value for value in values]
+
+    return workout_embedding_matrix(
+        column('duration', 0),
+        column('distance', 0),
+        column('heart_rate_avg', 0),
+        column('heart_rate_max', 0),
+        column('activity_type', 'other'),
+        column('intensity', 'moderate'),
+        column('vo2max_estimate', 35),
+    )
+
+def workout_timestamp(date_value):
+    """Seconds since the epoch for a workout date (ISO string or datetime); naive dates are taken as UTC"""
+    if isinstance(date_value, str):
+        try:
+            date_value = datetime.fromisoformat(date_value.replace('Z', '+00:00'))
+        except ValueError:
+            date_value = None
+    if not isinstance(date_value, datetime):
+        date_value = datetime.now(timezone.utc)
+    if date_value.tzinfo is None:
+        date_value = date_value.replace(tzinfo=timezone.utc)
+    return date_value.timestamp()
+
+def build_workout_record(workout_data, user_id, embedding=None):
+    """Build the (id, embedding, metadata, document) tuple stored in ChromaDB for a workout"""
     workout_id = f"{user_id}_{workout_data.get('id', datetime.now().isoformat())}"
 
     # Create embedding from workout data
-    embedding = create_workout_embedding(workout_data)
+    if embedding is None:
+        embedding = create_workout_embedding(workout_data)
 
-    # Prepare metadata
+    # Prepare metadata; the numeric timestamp lets date ranges be filtered in the store
+    date = workout_data.get('date', datetime.now().isoformat())
     metadata = {
         'user_id': user_id,
         'activity_type': workout_data.get('activity_type', 'unknown'),
         'intensity': workout_data.get('intensity', 'moderate'),
-        'date': workout_data.get('date', datetime.now().isoformat()),
+        'date': date,
+        'timestamp': workout_timestamp(date),
         'duration': workout_data.get('duration', 0),
         'distance': workout_data.get('distance', 0),
         'heart_rate_avg': workout_data.get('heart_rate_avg', 0),
@@ -89,18 +220,93 @@ def store_workout_in_chroma(collection, workout_data, user_id):
     Estimated VO2 Max: {workout_data.get('vo2max_estimate', 0)} mL/kg/min.
     """
 
-    # Store in ChromaDB
-    collection.add(
-        ids=[workout_id],
-        embeddings=[embedding],
-        metadatas=[metadata],
-        documents=[document]
+    return workout_id, embedding, metadata, document
+
+def store_workout_in_chroma(collection, workout_data, user_id):
+    """Store a workout in ChromaDB with vector embedding"""
+    return store_workouts_in_chroma(collection, [workout_data], user_id)[0]
+
+def store_workouts_in_chroma(collection, workouts_data, user_id, upsert=False, patterns_collection=None,
+                             similarity_index=None):
+    """
+    Store many workouts of one user in ChromaDB with a single add (or upsert) call.
+
+    When patterns_collection is given, the user's pattern snapshot is updated
+    with the workouts that were not already stored. When similarity_index is
+    given, the embeddings are also appended to the local similarity index.
+    """
+    return store_user_workouts_in_chroma(
+        collection, [(user_id, workout_data) for workout_data in workouts_data], upsert=upsert,
+        patterns_collection=patterns_collection, similarity_index=similarity_index,
     )
 
-    return workout_id
+def store_user_workouts_in_chroma(collection, items, upsert=False, patterns_collection=None, similarity_index=None):
+    """
+    Store (user_id, workout_data) pairs for any number of users with a single add (or upsert) call.
+
+    Pattern snapshots of all affected users are read and written in one
+    call each. Returns the stored ids in input order.
+    """
+    if not items:
+        return []
+
+    embeddings = create_workout_embeddings([workout_data for _, workout_data in items]).tolist()
+    records = [
+        build_workout_record(workout_data, user_id, embedding)
+        for (user_id, workout_data), embedding in zip(items, embeddings)
+    ]
+    ids, embeddings, metadatas, documents = (list(column) for column in zip(*records))
+
+    write = collection.upsert if upsert else collection.add
+    if patterns_collection is None:
+        write(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
+    else:
+        # Checking for stored ids, writing and updating the snapshots happen
+        # under one lock, so concurrent writers cannot lose or double-count
+        with snapshot_lock():
+            # Retried or repeated stores must not be counted twice in the snapshot
+            existing = set(collection.get(ids=ids, include=[])['ids'])
+            write(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
+
+            new_by_user = {}
+            for i, workout_id in enumerate(ids):
+                if workout_id not in existing:
+                    user_metadatas, user_embeddings = new_by_user.setdefault(items[i][0], ([], []))
+                    user_metadatas.append(metadatas[i])
+                    user_embeddings.append(embeddings[i])
+                elif upsert:
+                    # An updated workout adds nothing, but the snapshot is still
+                    # rewritten so its revision (the cache version) changes
+                    new_by_user.setdefault(items[i][0], ([], []))
+            if new_by_user:
+                update_pattern_snapshots(patterns_collection, collection, new_by_user)
+
+    if similarity_index is not None:
+        similarity_index.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas)
+
+    return ids
+
+def get_workouts_by_user(collection, user_ids, include=('metadatas',)):
+    """Fetch the stored workouts of many users with one $in query, grouped by user id"""
+    grouped = {user_id: {key: [] for key in include} for user_id in user_ids}
+    if not grouped:
+        return grouped
+
+    result = collection.get(where={"user_id": {"$in": list(grouped)}}, include=list(include))
+    for i, metadata in enumerate(result['metadatas']):
+        user = grouped.get(metadata['user_id'])
+        if user is not None:
+            for key in include:
+                user[key].append(result[key][i])
+    return grouped
 
 def find_similar_workouts(collection, workout_embedding, user_id, n_results=5):
-    """Find similar workouts using vector similarity search"""
+    """
+    Find similar workouts using vector similarity search.
+
+    collection is the ChromaDB workouts collection or a NumpySimilarityIndex;
+    get_similarity_collection() returns the configured one.
+    """
     results = collection.query(
         query_embeddings=[workout_embedding],
         n_results=n_results + 10,  # Get more to filter
@@ -130,23 +336,314 @@ def find_similar_workouts(collection, workout_embedding, user_id, n_results=5):
 
     return similar_workouts
 
-def analyze_user_patterns(collection, user_id, recent_workouts):
-    """Analyze user workout patterns and generate insights"""
+# Number of most recent VO2 max estimates kept in a pattern snapshot
+PATTERN_VO2_WINDOW = 5
+
+_snapshot_lock = threading.RLock()
+_snapshot_lock_file = None
+
+@contextmanager
+def snapshot_lock():
+    """
+    Serialize pattern snapshot writes across threads and processes.
+
+    The outbox workers and the MCP store tools all update snapshots, so
+    the read-modify-write holds an exclusive flock on a file next to the
+    ChromaDB store. Re-entering from the holding thread is a no-op.
+    """
+    global _snapshot_lock_file
+    with _snapshot_lock:
+        if _snapshot_lock_file is not None:
+            yield
+            return
+        path = get_chroma_path()
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'pattern_snapshots.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            _snapshot_lock_file = f
+            try:
+                yield
+            finally:
+                _snapshot_lock_file = None
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def empty_pattern_summary():
+    """Running summary of a user's stored workouts, as kept in user_performance_patterns"""
+    return {
+        'total_workouts': 0,
+        'activity_counts': {},
+        'intensity_sum': 0.0,
+        'vo2_count': 0,
+        'vo2_recent': [],
+        'embedding_sum': [0.0] * EMBEDDING_DIM,
+        'activity_embedding_sums': {},
+    }
+
+def update_pattern_summary(summary, metadatas, embeddings=None):
+    """Fold newly stored workouts (metadata and embeddings) into a pattern summary"""
+    for metadata in metadatas:
+        summary['total_workouts'] += 1
+
+        activity_type = metadata.get('activity_type', 'unknown')
+        summary['activity_counts'][activity_type] = summary['activity_counts'].get(activity_type, 0) + 1
+
+        summary['intensity_sum'] += INTENSITY_CODES.get(metadata.get('intensity', 'moderate'), 1)
+
+        vo2 = metadata.get('vo2max_estimate', 0) or 0
+        if vo2 > 0:
+            summary['vo2_count'] += 1
+            summary['vo2_recent'] = (summary['vo2_recent'] + [vo2])[-PATTERN_VO2_WINDOW:]
+
+    if embeddings is not None and len(embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float64)
+        total = np.asarray(summary['embedding_sum'], dtype=np.float64)
+        total += embeddings.sum(axis=0)
+        summary['embedding_sum'] = total.tolist()
+
+        # Per-activity sums give each user one profile vector per activity type
+        activity_sums = summary.setdefault('activity_embedding_sums', {})
+        activities = np.array([metadata.get('activity_type', 'unknown') for metadata in metadatas])
+        for activity_type in np.unique(activities).tolist():
+            activity_total = np.asarray(activity_sums.get(activity_type, [0.0] * EMBEDDING_DIM), dtype=np.float64)
+            activity_total += embeddings[activities == activity_type].sum(axis=0)
+            activity_sums[activity_type] = activity_total.tolist()
+
+    return summary
+
+def pattern_snapshot_id(user_id):
+    return f"patterns_{user_id}"
+
+def activity_profile_id(user_id, activity_type):
+    return f"patterns_{user_id}_{activity_type}"
+
+def load_pattern_summary(patterns_collection, user_id):
+    """Fetch a user's pattern snapshot by id, or None if it has not been built yet"""
+    return load_pattern_summaries(patterns_collection, [user_id]).get(user_id)
+
+def load_pattern_summaries(patterns_collection, user_ids):
+    """
+    Fetch the pattern snapshots of many users in one call.
+
+    Users without one are left out, as are snapshots written before
+    activity profiles existed, so they get rebuilt from the full history.
+    """
+    result = patterns_collection.get(ids=[pattern_snapshot_id(user_id) for user_id in user_ids],
+                                     include=['metadatas'])
+    summaries = {}
+    for metadata in result['metadatas']:
+        summary = json.loads(metadata['summary'])
+        if 'activity_embedding_sums' in summary:
+            summaries[metadata['user_id']] = summary
+    return summaries
+
+def user_data_version(patterns_collection, user_id):
+    """
+    Version of a user's stored workouts: their snapshot's revision.
+
+    Every write of the snapshot bumps the revision, including stores that
+    only update existing workouts. Every process that stores workouts
+    writes the snapshot, so unlike an in-process counter this changes for
+    readers in other processes too.
+    """
+    result = patterns_collection.get(ids=[pattern_snapshot_id(str(user_id))], include=['metadatas'])
+    return result['metadatas'][0].get('revision', 0) if result['ids'] else 0
+
+def pattern_snapshot_record(user_id, summary, revision=1):
+    """Build the (id, embedding, metadata, document) of a snapshot; its vector is the mean workout embedding"""
+    total = summary['total_workouts']
+    centroid = np.asarray(summary['embedding_sum'], dtype=np.float64) / max(total, 1)
+    metadata = {
+        'user_id': user_id,
+        'kind': 'pattern_summary',
+        'total_workouts': total,
+        'revision': revision,
+        'summary': json.dumps(summary),
+    }
+    document = f"Workout pattern summary for user {user_id} ({total} workouts)"
+    return pattern_snapshot_id(user_id), centroid.astype(np.float32).tolist(), metadata, document
+
+def save_pattern_summary(patterns_collection, user_id, summary):
+    """Write a pattern snapshot"""
+    save_pattern_summaries(patterns_collection, {user_id: summary})
+
+def activity_profile_records(user_id, summary):
+    """One (id, embedding, metadata, document) per activity type: the user's mean embedding for that activity"""
+    records = []
+    for activity_type, embedding_sum in summary.get('activity_embedding_sums', {}).items():
+        count = summary['activity_counts'].get(activity_type, 0)
+        centroid = np.asarray(embedding_sum, dtype=np.float64) / max(count, 1)
+        metadata = {
+            'user_id': user_id,
+            'kind': 'activity_profile',
+            'activity_type': activity_type,
+            'total_workouts': count,
+        }
+        document = f"{activity_type} profile for user {user_id} ({count} workouts)"
+        records.append((activity_profile_id(user_id, activity_type), centroid.astype(np.float32).tolist(),
+                        metadata, document))
+    return records
+
+def save_pattern_summaries(patterns_collection, summaries):
+    """
+    Write the snapshots and activity profiles of many users ({user_id: summary}) with one upsert.
+
+    Each snapshot's revision is one more than the stored one, read under
+    snapshot_lock() so no two writers use the same revision.
+    """
+    if not summaries:
+        return
+    with snapshot_lock():
+        stored = patterns_collection.get(ids=[pattern_snapshot_id(user_id) for user_id in summaries],
+                                         include=['metadatas'])
+        revisions = {metadata['user_id']: metadata.get('revision', 0) for metadata in stored['metadatas']}
+        records = []
+        for user_id, summary in summaries.items():
+            records.append(pattern_snapshot_record(user_id, summary, revisions.get(user_id, 0) + 1))
+            records.extend(activity_profile_records(user_id, summary))
+        ids, embeddings, metadatas, documents = (list(column) for column in zip(*records))
+        patterns_collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
+
+def rebuild_pattern_summary(patterns_collection, workouts_collection, user_id):
+    """Rebuild a user's snapshot from a full scan of their stored workouts"""
+    return rebuild_pattern_summaries(patterns_collection, workouts_collection, [user_id])[user_id]
+
+def rebuild_pattern_summaries(patterns_collection, workouts_collection, user_ids):
+    """Rebuild the snapshots of many users from one scan of their stored workouts"""
+    # Locked so no writer adds workouts between the scan and the save
+    with snapshot_lock():
+        grouped = get_workouts_by_user(workouts_collection, user_ids, include=('metadatas', 'embeddings'))
+        summaries = {}
+        for user_id, workouts in grouped.items():
+            summary = empty_pattern_summary()
+            if workouts['metadatas']:
+                summaries[user_id] = update_pattern_summary(summary, workouts['metadatas'], workouts['embeddings'])
+        save_pattern_summaries(patterns_collection, summaries)
+    return {user_id: summaries.get(user_id, empty_pattern_summary()) for user_id in grouped}
+
+def get_user_pattern_summary(patterns_collection, workouts_collection, user_id):
+    """Load a user's pattern snapshot, building it once from their history if missing"""
+    return get_user_pattern_summaries(patterns_collection, workouts_collection, [user_id])[user_id]
+
+def get_user_pattern_summaries(patterns_collection, workouts_collection, user_ids):
+    """Load the snapshots of many users, building any missing ones from their history"""
+    summaries = load_pattern_summaries(patterns_collection, user_ids)
+    missing = [user_id for user_id in user_ids if user_id not in summaries]
+    if missing:
+        summaries.update(rebuild_pattern_summaries(patterns_collection, workouts_collection, missing))
+    return summaries
+
+def update_user_pattern_snapshot(patterns_collection, workouts_collection, user_id, metadatas, embeddings):
+    """Add newly stored workouts to a user's pattern snapshot"""
+    return update_pattern_snapshots(patterns_collection, workouts_collection,
+                                    {user_id: (metadatas, embeddings)})[user_id]
+
+def update_pattern_snapshots(patterns_collection, workouts_collection, new_by_user):
+    """
+    Add newly stored workouts ({user_id: (metadatas, embeddings)}) to the users' pattern snapshots.
+
+    The read-modify-write holds snapshot_lock(). Users without
+    a snapshot get one rebuilt from the workouts collection, which already
+    contains the new workouts.
+    """
+    with snapshot_lock():
+        summaries = load_pattern_summaries(patterns_collection, list(new_by_user))
+        for user_id, summary in summaries.items():
+            update_pattern_summary(summary, *new_by_user[user_id])
+        save_pattern_summaries(patterns_collection, summaries)
+
+        missing = [user_id for user_id in new_by_user if user_id not in summaries]
+        if missing:
+            summaries.update(rebuild_pattern_summaries(patterns_collection, workouts_collection, missing))
+        return summaries
+
+def find_similar_athletes(patterns_collection, user_id, n_results=10, activity_type=None):
+    """
+    Find the users whose profile vectors are closest to this user's.
+
+    Each user has one vector (the mean of their workout embeddings) plus
+    one per activity type, so a query costs O(users), not O(workouts).
+    With activity_type only users with that activity are compared, using
+    the activity's profile vectors. Returns None if the user has no
+    profile yet.
+    """
+    if activity_type:
+        profile_id = activity_profile_id(user_id, activity_type)
+        where = {'$and': [{'kind': 'activity_profile'}, {'activity_type': activity_type},
+                          {'user_id': {'$ne': user_id}}]}
+    else:
+        profile_id = pattern_snapshot_id(user_id)
+        where = {'$and': [{'kind': 'pattern_summary'}, {'user_id': {'$ne': user_id}}]}
+
+    profile = patterns_collection.get(ids=[profile_id], include=['embeddings'])
+    if not profile['ids']:
+        return None
+
+    results = patterns_collection.query(
+        query_embeddings=[profile['embeddings'][0]],
+        n_results=n_results,
+        where=where,
+        include=['metadatas', 'distances'],
+    )
+
+    return [
+        {
+            'user_id': metadata['user_id'],
+            'similarity_score': 1 / (1 + distance),  # Distances are unbounded, so map them into (0, 1]
+            'total_workouts': metadata.get('total_workouts', 0),
+        }
+        for metadata, distance in zip(results['metadatas'][0], results['distances'][0])
+    ]
+
+def analyze_user_patterns(collection, user_id, recent_workouts, patterns_collection=None):
+    """
+    Analyze user workout patterns and generate insights.
+
+    With patterns_collection the analysis reads the user's incremental
+    snapshot instead of scanning every stored workout.
+    """
+    empty_stats = {"total_workouts": 0, "activity_types": [], "avg_intensity": 1, "vo2_progression": []}
     if not recent_workouts:
-        return {"insights": [], "recommendations": []}
+        return {"insights": [], "recommendations": [], "stats": empty_stats}
+
+    # Get user's workout summary from ChromaDB
+    if patterns_collection is not None:
+        summary = get_user_pattern_summary(patterns_collection, collection, user_id)
+    else:
+        user_workouts = collection.get(where={"user_id": user_id}, include=['metadatas'])
+        summary = update_pattern_summary(empty_pattern_summary(), user_workouts['metadatas'])
 
-    # Get user's workout history from ChromaDB
-    user_workouts = collection.get(where={"user_id": user_id})
+    return analyze_pattern_summary(summary)
 
-    if not user_workouts['ids']:
-        return {"insights": ["Welcome! Start logging workouts to unlock AI insights."], "recommendations": []}
+def analyze_users_patterns(collection, user_ids, patterns_collection=None):
+    """
+    Analyze the stored workouts of many users at once; returns {user_id: analysis}.
+
+    Snapshots are read with one call (plus one rebuild for users without a
+    snapshot); without patterns_collection one $in query reads every user's
+    workouts, grouped in memory.
+    """
+    if patterns_collection is not None:
+        summaries = get_user_pattern_summaries(patterns_collection, collection, user_ids)
+    else:
+        grouped = get_workouts_by_user(collection, user_ids)
+        summaries = {
+            user_id: update_pattern_summary(empty_pattern_summary(), workouts['metadatas'])
+            for user_id, workouts in grouped.items()
+        }
+    return {user_id: analyze_pattern_summary(summaries[user_id]) for user_id in user_ids}
+
+def analyze_pattern_summary(summary):
+    """Turn a user's pattern summary into insights, recommendations and stats"""
+    if not summary['total_workouts']:
+        return {"insights": ["Welcome! Start logging workouts to unlock AI insights."], "recommendations": [],
+                "stats": {"total_workouts": 0, "activity_types": [], "avg_intensity": 1, "vo2_progression": []}}
 
     # Analyze patterns
     insights = []
     recommendations = []
 
     # Analyze workout frequency
-    workout_count = len(user_workouts['ids'])
+    workout_count = summary['total_workouts']
     if workout_count < 3:
         insights.append("Keep logging workouts! AI insights improve with more data.")
     elif workout_count < 10:
@@ -155,9 +652,7 @@ def analyze_user_patterns(collection, user_id, recent_workouts):
         insights.append("Excellent consistency! Your workout data is revealing meaningful patterns.")
 
     # Analyze activity diversity
-    activity_types = set()
-    for metadata in user_workouts['metadatas']:
-        activity_types.add(metadata.get('activity_type', 'unknown'))
+    activity_types = set(summary['activity_counts'])
 
     if len(activity_types) == 1:
         recommendations.append("Try cross-training! Adding variety can improve overall fitness and reduce injury risk.")
@@ -165,12 +660,7 @@ def analyze_user_patterns(collection, user_id, recent_workouts):
         insights.append("Great variety in your training! Cross-training supports well-rounded fitness.")
 
     # Analyze intensity patterns
-    intensities = []
-    for metadata in user_workouts['metadatas']:
-        intensity = metadata.get('intensity', 'moderate')
-        intensities.append({'low': 0, 'moderate': 1, 'high': 2}.get(intensity, 1))
-
-    avg_intensity = sum(intensities) / len(intensities) if intensities else 1
+    avg_intensity = summary['intensity_sum'] / workout_count
 
     if avg_intensity < 0.8:
         recommendations.append("Consider increasing workout intensity gradually to maximize cardiovascular benefits.")
@@ -178,19 +668,16 @@ def analyze_user_patterns(collection, user_id, recent_workouts):
         recommendations.append("High-intensity training is great! Ensure adequate recovery between intense sessions.")
 
     # VO2 max progression analysis
-    vo2_estimates = []
-    for metadata in user_workouts['metadatas']:
-        vo2 = metadata.get('vo2max_estimate', 0)
-        if vo2 > 0:
-            vo2_estimates.append(vo2)
+    vo2_estimates = summary['vo2_recent']
+    vo2_count = summary['vo2_count']
 
-    if len(vo2_estimates) >= 2:
-        recent_avg = sum(vo2_estimates[-3:]) / min(3, len(vo2_estimates))
+    if vo2_count >= 2:
+        recent_avg = sum(vo2_estimates[-3:]) / min(3, vo2_count)
         if recent_avg > 40:
             insights.append("Excellent aerobic fitness! You're in the top percentile for cardiovascular health.")
         elif recent_avg > 35:
             insights.append("Good aerobic capacity! Consistent training is yielding results.")
-        elif recent_avg < 30 and len(vo2_estimates) > 5:
+        elif recent_avg < 30 and vo2_count > 5:
             recommendations.append("Focus on aerobic training to improve VO2 max. Longer, moderate-intensity workouts can help.")
 
     return {
@@ -200,7 +687,7 @@ def analyze_user_patterns(collection, user_id, recent_workouts):
             "total_workouts": workout_count,
             "activity_types": list(activity_types),
             "avg_intensity": avg_intensity,
-            "vo2_progression": vo2_estimates[-5:] if len(vo2_estimates) >= 5 else vo2_estimates
+            "vo2_progression": vo2_estimates
         }
     }
 
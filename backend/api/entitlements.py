@@ -0,0 +1,132 @@
+"""
+Subscription entitlements, cached so plan checks do not read the database.
+
+Lookups go through a per-process LRU, then the Django cache named by
+ENTITLEMENT_CACHE (when set, e.g. a Redis cache shared by all workers),
+then the Subscription table. Entries expire at the subscription's
+current_period_end, so a renewal is picked up on the first request after
+it, and are invalidated when a webhook handler or the cancel endpoint
+changes the subscription. The per-process entry also expires after
+ENTITLEMENT_LOCAL_TTL seconds, which bounds how long another process's
+invalidation can go unseen.
+"""
+
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Subscription
+from .result_cache import ResultCache
+
+PLAN_RANKS = {'free': 0, 'premium': 1, 'pro': 2}
+FREE_ENTITLEMENT = {'plan': 'free', 'status': 'active', 'current_period_end': None, 'cancel_at_period_end': False}
+
+DEFAULT_LOCAL_TTL = 30
+DEFAULT_LOCAL_SIZE = 10000
+# Shared-cache lifetime for subscriptions without a period end (e.g. free)
+DEFAULT_SHARED_TTL = 24 * 3600
+
+_local_cache = ResultCache(
+    max_entries=getattr(settings, 'ENTITLEMENT_CACHE_SIZE', DEFAULT_LOCAL_SIZE),
+    ttl=DEFAULT_LOCAL_TTL,
+)
+
+
+def cache_key(user_id):
+    return f"entitlement:{user_id}"
+
+
+def entitlement_for(subscription):
+    """The cached form of a Subscription row (None means the free plan)"""
+    if subscription is None:
+        return dict(FREE_ENTITLEMENT)
+    end = subscription.current_period_end
+    return {
+        'plan': subscription.plan,
+        'status': subscription.status,
+        'current_period_end': end.timestamp() if end else None,
+        'cancel_at_period_end': subscription.cancel_at_period_end,
+    }
+
+
+def has_plan(entitlement, plan, now=None):
+    """Whether an entitlement grants `plan` (or a higher one) right now"""
+    required = PLAN_RANKS.get(plan, 0)
+    if required == 0:
+        return True
+    if entitlement['status'] != 'active':
+        return False
+    end = entitlement['current_period_end']
+    if end is not None and end <= (time.time() if now is None else now):
+        return False
+    return PLAN_RANKS.get(entitlement['plan'], 0) >= required
+
+
+def get_entitlement(user_id, now=None):
+    """A user's entitlement, from the caches when possible"""
+    key = cache_key(user_id)
+    entitlement = _local_cache.get(key)
+    if entitlement is not None:
+        return entitlement
+
+    shared = _shared_cache()
+    if shared is not None:
+        entitlement = shared.get(key)
+        if entitlement is not None:
+            _local_cache.set(key, entitlement, ttl=_ttl(entitlement, _local_ttl(), now))
+            return entitlement
+
+    subscription = (
+        Subscription.objects.filter(user_id=user_id)
+        .only('plan', 'status', 'current_period_end', 'cancel_at_period_end')
+        .first()
+    )
+    entitlement = entitlement_for(subscription)
+    _local_cache.set(key, entitlement, ttl=_ttl(entitlement, _local_ttl(), now))
+    if shared is not None:
+        shared.set(key, entitlement, timeout=_ttl(entitlement, DEFAULT_SHARED_TTL, now))
+    return entitlement
+
+
+def invalidate(user_id):
+    """Drop a user's cached entitlement after their subscription changed"""
+    _local_cache.delete(cache_key(user_id))
+    shared = _shared_cache()
+    if shared is not None:
+        shared.delete(cache_key(user_id))
+
+
+def invalidate_on_commit(user_id):
+    """Invalidate once the surrounding transaction commits, so a concurrent read cannot re-cache the old row"""
+    transaction.on_commit(lambda: invalidate(user_id))
+
+
+def cache_stats():
+    return _local_cache.stats()
+
+
+def clear_cache():
+    """Empty this process's cache (the shared cache is left alone)"""
+    _local_cache.clear()
+
+
+def _ttl(entitlement, maximum, now=None):
+    # Expire at current_period_end; a lapsed period is re-read after the local TTL
+    end = entitlement['current_period_end']
+    if end is None:
+        return maximum
+    remaining = end - (time.time() if now is None else now)
+    return min(maximum, remaining) if remaining > 0 else _local_ttl()
+
+
+def _local_ttl():
+    return getattr(settings, 'ENTITLEMENT_LOCAL_TTL', DEFAULT_LOCAL_TTL)
+
+
+def _shared_cache():
+    alias = getattr(settings, 'ENTITLEMENT_CACHE', None)
+    if not alias:
+        return None
+    from django.core.cache import caches
+    return caches[alias]
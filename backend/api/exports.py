@@ -0,0 +1,82 @@
+import csv
+import io
+import json
+import zlib
+
+EXPORT_FIELDS = [
+    'id', 'activity_type', 'duration', 'distance', 'heart_rate_avg',
+    'heart_rate_max', 'intensity', 'date', 'vo2max_estimate',
+]
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def workout_row(workout):
+    """Flatten a Workout into the exported field order"""
+    return {
+        'id': workout.id,
+        'activity_type': workout.activity_type,
+        'duration': workout.duration,
+        'distance': workout.distance,
+        'heart_rate_avg': workout.avg_heart_rate,
+        'heart_rate_max': workout.max_heart_rate,
+        'intensity': workout.intensity,
+        'date': workout.date.isoformat(),
+        'vo2max_estimate': workout.vo2max_estimate,
+    }
+
+
+def iter_chunks(queryset, chunk_size=1000):
+    """
+    Yield lists of export rows, chunk_size at a time.
+
+    The queryset is read through iterator() so only one chunk of rows (and
+    their decrypted heart rate fields) is held in memory at once.
+    """
+    chunk = []
+    for workout in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(workout_row(workout))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_ndjson(queryset, chunk_size=1000):
+    for chunk in iter_chunks(queryset, chunk_size):
+        yield ''.join(json.dumps(row) + '\n' for row in chunk)
+
+
+def iter_csv(queryset, chunk_size=1000):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    yield buffer.getvalue()
+
+    for chunk in iter_chunks(queryset, chunk_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+
+
+def gzip_stream(parts):
+    """Gzip-compress an iterable of text parts incrementally"""
+    compressor = zlib.compressobj(wbits=31)  # 16 + MAX_WBITS -> gzip container
+    for part in parts:
+        data = compressor.compress(part.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_workouts(queryset, output='ndjson', compress=False, chunk_size=1000):
+    """Return an iterator over the encoded export of a workout queryset"""
+    parts = iter_csv(queryset, chunk_size) if output == 'csv' else iter_ndjson(queryset, chunk_size)
+    if compress:
+        return gzip_stream(parts)
+    return (part.encode() for part in parts)
@@ -0,0 +1,224 @@
+"""
+Fake Stripe webhook events and API server for local load tests and replays.
+
+Events follow the shape of Stripe's API objects closely enough for the
+webhook handlers, and are signed the way Stripe signs webhooks, so they
+pass stripe.Webhook.construct_event with the configured secret. The API
+server answers the calls api/payments.py makes (customers, payment
+intents, subscription updates, event listing) with canned objects,
+optionally after a simulated network delay.
+"""
+
+import hashlib
+import hmac
+import itertools
+import json
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+def sign_payload(payload, secret, timestamp=None):
+    """Build a Stripe-Signature header value for a raw payload"""
+    if isinstance(payload, str):
+        payload = payload.encode()
+    timestamp = int(time.time() if timestamp is None else timestamp)
+    signed = f"{timestamp}.".encode() + payload
+    signature = hmac.new(secret.encode(), signed, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def make_event(event_type, obj, created, event_id):
+    """Wrap an API object in a Stripe event envelope"""
+    return {
+        'id': event_id,
+        'object': 'event',
+        'type': event_type,
+        'created': int(created),
+        'livemode': False,
+        'data': {'object': obj},
+    }
+
+
+def subscription_object(subscription_id, user_id, status, period_start, plan='premium', cancel_at_period_end=False):
+    return {
+        'id': subscription_id,
+        'object': 'subscription',
+        'customer': f"cus_{user_id}",
+        'status': status,
+        'metadata': {'user_id': str(user_id), 'plan': plan},
+        'current_period_start': int(period_start),
+        'current_period_end': int(period_start) + 30 * 24 * 3600,
+        'cancel_at_period_end': cancel_at_period_end,
+    }
+
+
+def payment_intent_object(payment_intent_id, amount):
+    return {
+        'id': payment_intent_id,
+        'object': 'payment_intent',
+        'amount': amount,
+        'currency': 'usd',
+        'status': 'succeeded',
+        'charges': {'data': [{
+            'id': payment_intent_id.replace('pi_', 'ch_'),
+            'receipt_url': f"https://pay.stripe.com/receipts/{payment_intent_id}",
+        }]},
+    }
+
+
+def generate_events(user_ids, seed=0, start=None, duplicate_rate=0.0):
+    """
+    Yield events for a subscription lifecycle per user, in creation order.
+
+    Each user gets created and renewal updates, a payment per period and,
+    for some users, a cancellation. With duplicate_rate, that share of
+    events is sent again the way Stripe retries a slow delivery.
+    """
+    rng = random.Random(seed)
+    now = time.time() if start is None else start
+    counter = 0
+
+    def next_id(prefix):
+        nonlocal counter
+        counter += 1
+        return f"{prefix}_fake{seed}_{counter:08d}"
+
+    events = []
+    for user_id in user_ids:
+        subscription_id = next_id('sub')
+        created = now + rng.uniform(0, 3600)
+        plan = rng.choice(['premium', 'pro'])
+        events.append(make_event('customer.subscription.created',
+                                 subscription_object(subscription_id, user_id, 'active', created, plan),
+                                 created, next_id('evt')))
+        for period in range(rng.randint(0, 3)):
+            renewed = created + (period + 1) * 30 * 24 * 3600
+            events.append(make_event('payment_intent.succeeded',
+                                     payment_intent_object(next_id('pi'), 999 if plan == 'premium' else 1999),
+                                     renewed - 60, next_id('evt')))
+            events.append(make_event('customer.subscription.updated',
+                                     subscription_object(subscription_id, user_id, 'active', renewed, plan),
+                                     renewed, next_id('evt')))
+        if rng.random() < 0.2:
+            ended = created + 100 * 24 * 3600
+            events.append(make_event('customer.subscription.deleted',
+                                     subscription_object(subscription_id, user_id, 'canceled', ended, plan),
+                                     ended, next_id('evt')))
+
+    events.sort(key=lambda event: event['created'])
+    for event in events:
+        yield event
+        if duplicate_rate and rng.random() < duplicate_rate:
+            yield event
+
+
+def signed_request(event, secret, timestamp=None):
+    """Return (body bytes, Stripe-Signature header) for posting an event to the webhook"""
+    body = json.dumps(event).encode()
+    return body, sign_payload(body, secret, timestamp)
+
+
+def decode_form(body):
+    """Decode Stripe's form encoding (`metadata[user_id]=1`) into nested dicts"""
+    params = {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        parts = re.findall(r'[^\[\]]+', key)
+        target = params
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return params
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so pooled clients reuse connections as they would with Stripe
+    protocol_version = 'HTTP/1.1'
+    ids = itertools.count(1)
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        path, _, query = self.path.partition('?')
+        params = decode_form(query)
+
+        if path.rstrip('/') == '/v1/events':
+            self.respond(200, self.list_events(params))
+        else:
+            self.respond(404, {'error': {'type': 'invalid_request_error',
+                                         'message': f"Unrecognized request URL (GET: {path})"}})
+
+    def list_events(self, params):
+        """A page of server.events, newest first, filtered and paged the way Stripe does"""
+        events = sorted(self.server.events, key=lambda event: event['created'], reverse=True)
+        created_gte = params.get('created', {}).get('gte')
+        if created_gte:
+            events = [event for event in events if event['created'] >= int(created_gte)]
+        types = params.get('types')
+        if types:
+            types = set(types.values())
+            events = [event for event in events if event['type'] in types]
+        if params.get('starting_after'):
+            ids = [event['id'] for event in events]
+            events = events[ids.index(params['starting_after']) + 1:]
+        limit = int(params.get('limit', 10))
+        return {'object': 'list', 'url': '/v1/events', 'data': events[:limit], 'has_more': len(events) > limit}
+
+    def do_POST(self):
+        time.sleep(self.server.latency)
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+        params = decode_form(body)
+        path = self.path.split('?')[0].rstrip('/')
+
+        if path == '/v1/customers':
+            self.respond(200, {
+                'id': self.next_id('cus'), 'object': 'customer',
+                'email': params.get('email'), 'name': params.get('name'),
+                'metadata': params.get('metadata', {}),
+            })
+        elif path == '/v1/payment_intents':
+            intent_id = self.next_id('pi')
+            self.respond(200, {
+                'id': intent_id, 'object': 'payment_intent',
+                'amount': int(params.get('amount', 0)), 'currency': params.get('currency', 'usd'),
+                'customer': params.get('customer'), 'description': params.get('description'),
+                'metadata': params.get('metadata', {}), 'status': 'requires_payment_method',
+                'client_secret': f"{intent_id}_secret_fake",
+            })
+        elif path.startswith('/v1/subscriptions/'):
+            subscription = subscription_object(path.rsplit('/', 1)[1], '', 'active', time.time(),
+                                               cancel_at_period_end=params.get('cancel_at_period_end') == 'true')
+            subscription['metadata'] = params.get('metadata', {})
+            self.respond(200, subscription)
+        else:
+            self.respond(404, {'error': {'type': 'invalid_request_error',
+                                         'message': f"Unrecognized request URL (POST: {path})"}})
+
+    def next_id(self, prefix):
+        return f"{prefix}_fake{next(self.ids):010d}"
+
+    def respond(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Request-Id', f"req_fake{next(self.ids)}")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host='127.0.0.1', port=12111, latency=0.0, events=()):
+    """
+    A threaded fake Stripe API server; port 0 picks a free port (see server.server_address).
+
+    events are served by GET /v1/events.
+    """
+    server = ThreadingHTTPServer((host, port), FakeStripeHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.events = list(events)
+    return server
@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from api.models import UserProfile, Workout
+
+
+class Command(BaseCommand):
+    help = "Store VO2 max estimates for workouts that were saved before the column existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute every user, not only users with workouts missing an estimate')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        workouts = Workout.objects.all()
+        if not options['all']:
+            workouts = workouts.filter(vo2max_estimate__isnull=True)
+        user_ids = workouts.values_list('user_id', flat=True).distinct()
+
+        total = 0
+        for user in User.objects.filter(id__in=user_ids).iterator():
+            try:
+                profile = UserProfile.objects.get(user=user)
+            except UserProfile.DoesNotExist:
+                # Same defaults the workout views use for users without a profile
+                profile = UserProfile(user=user, gender='other', age=25, weight='70', height='170')
+            total += profile.recompute_vo2max_estimates(batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f"Stored VO2 max estimates for {total} workouts"))
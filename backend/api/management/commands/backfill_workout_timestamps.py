@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.chroma_setup import get_collections, workout_timestamp
+
+
+class Command(BaseCommand):
+    help = "Add the numeric 'timestamp' metadata to workouts stored in ChromaDB before it existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        collection = get_collections()['workouts']
+
+        offset = 0
+        updated = 0
+        while True:
+            page = collection.get(limit=options['batch_size'], offset=offset, include=['metadatas'])
+            if not page['ids']:
+                break
+            ids = []
+            metadatas = []
+            for workout_id, metadata in zip(page['ids'], page['metadatas']):
+                if 'timestamp' not in metadata:
+                    ids.append(workout_id)
+                    metadatas.append({**metadata, 'timestamp': workout_timestamp(metadata.get('date'))})
+            if ids:
+                collection.update(ids=ids, metadatas=metadatas)
+                updated += len(ids)
+            offset += len(page['ids'])
+
+        self.stdout.write(self.style.SUCCESS(f"Added timestamps to {updated} workouts"))
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.chroma_setup import EMBEDDING_DIM, get_collections
+from api.similarity import NumpySimilarityIndex
+
+
+class Command(BaseCommand):
+    help = "Copy workout embeddings from ChromaDB into the local NumPy similarity index"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--path', default=None,
+                            help='Index directory (defaults to SIMILARITY_INDEX_PATH)')
+        parser.add_argument('--compact', action='store_true',
+                            help='Rewrite the index so each user occupies one contiguous row range')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        index = NumpySimilarityIndex(
+            options['path'] or settings.SIMILARITY_INDEX_PATH,
+            dim=EMBEDDING_DIM,
+            metric=settings.SIMILARITY_METRIC,
+        )
+        collection = get_collections()['workouts']
+
+        offset = 0
+        before = len(index)
+        while True:
+            page = collection.get(
+                limit=options['batch_size'],
+                offset=offset,
+                include=['embeddings', 'metadatas'],
+            )
+            if not page['ids']:
+                break
+            index.upsert(ids=page['ids'], embeddings=page['embeddings'], metadatas=page['metadatas'])
+            offset += len(page['ids'])
+
+        if options['compact']:
+            index.compact()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {len(index) - before} new workouts ({len(index)} total)"
+        ))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.outbox import MAX_ATTEMPTS, drain_outbox
+
+
+class Command(BaseCommand):
+    help = "Write queued workouts from the outbox to the ChromaDB vector store"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS)
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling for new entries instead of exiting when the outbox is empty')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds to sleep between polls when idle (with --loop)')
+
+    def handle(self, *args, **options):
+        total_stored = total_failed = 0
+        while True:
+            stored, failed = drain_outbox(options['batch_size'], options['max_attempts'])
+            total_stored += stored
+            total_failed += failed
+
+            if stored or failed:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored {total_stored} workouts in ChromaDB ({total_failed} failed attempts)"
+        ))
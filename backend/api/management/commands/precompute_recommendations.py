@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api.chroma_setup import get_collections
+from api.recommendations import precompute_recommendations
+
+
+class Command(BaseCommand):
+    help = "Precompute recommendation sets for every user into the workout_recommendations collection"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help='Users read and written per ChromaDB round trip')
+        parser.add_argument('--force', action='store_true',
+                            help='Recompute sets that are still fresh')
+        parser.add_argument('--max-age', type=float, default=None,
+                            help='Seconds after which a set is stale (defaults to RECOMMENDATION_MAX_AGE)')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        collections = get_collections()
+        user_ids = User.objects.order_by('id').values_list('id', flat=True)
+
+        written = 0
+        chunk = []
+        for user_id in user_ids.iterator(chunk_size=chunk_size):
+            chunk.append(user_id)
+            if len(chunk) >= chunk_size:
+                written += precompute_recommendations(collections, chunk, options['force'], options['max_age'])
+                chunk = []
+        if chunk:
+            written += precompute_recommendations(collections, chunk, options['force'], options['max_age'])
+
+        self.stdout.write(self.style.SUCCESS(f"Precomputed recommendations for {written} users"))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.stripe_events import MAX_ATTEMPTS, process_events
+
+class Command(BaseCommand):
+    help = "Apply stored Stripe webhook events to subscriptions and payments, oldest first"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS)
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling for new events instead of exiting when none are due')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to sleep between polls when idle (with --loop)')
+
+    def handle(self, *args, **options):
+        total_processed = total_failed = 0
+        while True:
+            processed, failed = process_events(options['batch_size'], options['max_attempts'])
+            total_processed += processed
+            total_failed += failed
+
+            if processed or failed:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {total_processed} Stripe events ({total_failed} failed attempts)"
+        ))
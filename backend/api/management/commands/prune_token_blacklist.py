@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.refresh_tokens import prune_expired
+
+class Command(BaseCommand):
+    help = "Delete expired outstanding and blacklisted JWT refresh tokens in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        outstanding, blacklisted = prune_expired(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {outstanding} expired outstanding tokens ({blacklisted} blacklisted)"
+        ))
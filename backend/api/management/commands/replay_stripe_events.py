@@ -0,0 +1,62 @@
+import json
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import StripeEvent
+from api.payments import get_client
+from api.stripe_events import record_events, requeue_events
+
+
+class Command(BaseCommand):
+    help = "Backfill Stripe events into the event table, or queue stored events to be applied again"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help='NDJSON file of Stripe events to store (e.g. from benchmarks.stripe_webhooks)')
+        parser.add_argument('--from-stripe', action='store_true',
+                            help='List events from the Stripe API and store the ones not seen yet')
+        parser.add_argument('--since', help='With --from-stripe: only events created on or after this date (YYYY-MM-DD)')
+        parser.add_argument('--type', action='append', dest='types', default=[],
+                            help='With --from-stripe: event type to fetch (repeatable)')
+        parser.add_argument('--event-id', action='append', dest='event_ids', default=[],
+                            help='Queue this stored event to be applied again (repeatable)')
+        parser.add_argument('--failed', action='store_true',
+                            help='Queue every event that exhausted its retries to be applied again')
+
+    def handle(self, *args, **options):
+        if not any([options['file'], options['from_stripe'], options['event_ids'], options['failed']]):
+            raise CommandError('Pass --file, --from-stripe, --event-id or --failed')
+
+        if options['file']:
+            with open(options['file']) as f:
+                stored = record_events(json.loads(line) for line in f if line.strip())
+            self.stdout.write(f"Stored {stored} new events from {options['file']}")
+
+        if options['from_stripe']:
+            stored = record_events(self.list_stripe_events(options['since'], options['types']))
+            self.stdout.write(f"Stored {stored} new events from Stripe")
+
+        if options['event_ids']:
+            requeued = requeue_events(StripeEvent.objects.filter(event_id__in=options['event_ids']))
+            self.stdout.write(f"Queued {requeued} events by id")
+
+        if options['failed']:
+            requeued = requeue_events(StripeEvent.objects.filter(status='failed'))
+            self.stdout.write(f"Queued {requeued} failed events")
+
+        self.stdout.write(self.style.SUCCESS("Run process_stripe_events to apply them"))
+
+    def list_stripe_events(self, since, types):
+        params = {'limit': 100}
+        if since:
+            try:
+                start = datetime.strptime(since, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+            except ValueError:
+                raise CommandError('--since must be YYYY-MM-DD')
+            params['created'] = {'gte': int(start.timestamp())}
+        if types:
+            params['types'] = types
+
+        for event in get_client().list_events(**params).auto_paging_iter():
+            # The same payload shape the webhook view stores
+            yield event.to_dict()
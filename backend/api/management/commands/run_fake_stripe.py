@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from api.fake_stripe import make_server
+
+class Command(BaseCommand):
+    help = "Serve a fake Stripe API for offline load tests (point STRIPE_API_BASE at it)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=12111)
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help='Seconds to wait before answering each call, to simulate the network')
+
+    def handle(self, *args, **options):
+        server = make_server(options['host'], options['port'], options['latency'])
+        host, port = server.server_address[:2]
+        self.stdout.write(self.style.SUCCESS(f"Fake Stripe API on http://{host}:{port}"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -7,8 +7,11 @@ Provides AI agents with access to ChromaDB-powered fitness insights
 import asyncio
 import json
 import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Optional, Sequence
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 from mcp import Tool
 from mcp.server import Server
@@ -19,27 +22,82 @@ from mcp.types import (
     LoggingLevel
 )
 
-# Import our ChromaDB fitness intelligence functions
-from .chroma_setup import (
-    get_chroma_client,
-    create_collections,
-    create_workout_embedding,
-    store_workout_in_chroma,
-    find_similar_workouts,
-    analyze_user_patterns
-)
+from .result_cache import tool_cache
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("airwave-mcp")
 
-# Initialize ChromaDB client and collections
-chroma_client = get_chroma_client()
-collections = create_collections(chroma_client)
-workouts_collection = collections['workouts']
+# ChromaDB is imported and connected on first tool use (or by the background
+# warm-up), so importing this module and answering list_tools stay cheap
+WARMUP_ON_START = os.getenv("MCP_WARMUP", "true").lower() == "true"
 
 app = Server("airwave-fitness-mcp")
 
+# Tool execution limits
+MAX_CONCURRENT_TOOLS = int(os.getenv("MCP_MAX_CONCURRENT_TOOLS", "8"))
+DEFAULT_TOOL_TIMEOUT = float(os.getenv("MCP_TOOL_TIMEOUT", "30"))
+TOOL_TIMEOUTS = {
+    "store_workout_for_analysis": float(os.getenv("MCP_STORE_TIMEOUT", "10")),
+}
+# Seconds the HTTP server waits for connections to drain, then again for running tools
+SHUTDOWN_TIMEOUT = float(os.getenv("MCP_SHUTDOWN_TIMEOUT", "30"))
+
+# Batch tool limits (items per call)
+MAX_BATCH_WORKOUTS = int(os.getenv("MCP_MAX_BATCH_WORKOUTS", "1000"))
+MAX_BATCH_USERS = int(os.getenv("MCP_MAX_BATCH_USERS", "500"))
+
+_tool_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_TOOLS, thread_name_prefix="airwave-tool")
+_tool_semaphore = None
+
+# Responses are markdown by default; format="json" returns compact payloads
+FORMAT_PROPERTY = {
+    "type": "string",
+    "enum": ["markdown", "json"],
+    "default": "markdown",
+    "description": "markdown for people, json for a compact machine-readable payload"
+}
+OFFSET_PROPERTY = {
+    "type": "integer",
+    "description": "Index of the first item to return; pass next_offset from the previous page",
+    "default": 0,
+    "minimum": 0
+}
+DEFAULT_SERIES_PAGE = 50
+MAX_SERIES_PAGE = 500
+# Deepest similar-workout result that can be paged to
+MAX_SIMILAR_RESULTS = 200
+
+def to_json(payload: Dict[str, Any]) -> str:
+    """Serialize a tool payload as compact JSON"""
+    return json.dumps(payload, separators=(",", ":"), default=str)
+
+def page(items: Sequence[Any], offset: int, limit: int) -> Dict[str, Any]:
+    """One page of a result list with the offset of the next page (None on the last page)"""
+    items = list(items[offset:offset + limit + 1])
+    return {
+        "items": items[:limit],
+        "offset": offset,
+        "next_offset": offset + limit if len(items) > limit else None,
+    }
+
+def _get_tool_semaphore() -> asyncio.Semaphore:
+    # Created lazily so it binds to the running event loop
+    global _tool_semaphore
+    if _tool_semaphore is None:
+        _tool_semaphore = asyncio.Semaphore(MAX_CONCURRENT_TOOLS)
+    return _tool_semaphore
+
+def _release_tool_slot(semaphore: asyncio.Semaphore, future: asyncio.Future) -> None:
+    semaphore.release()
+    if not future.cancelled() and future.exception() is not None:
+        # A call that failed after timing out has no awaiter to retrieve its error
+        logger.debug(f"Abandoned tool call failed: {future.exception()}")
+
+def tool_timeout(name: str) -> float:
+    """Timeout in seconds for one call of the given tool"""
+    return TOOL_TIMEOUTS.get(name, DEFAULT_TOOL_TIMEOUT)
+
 @app.list_tools()
 async def list_tools() -> List[Tool]:
     """List available MCP tools for fitness intelligence"""
@@ -50,6 +108,7 @@ async def list_tools() -> List[Tool]:
             inputSchema={
                 "type": "object",
                 "properties": {
+                    "format": FORMAT_PROPERTY,
                     "user_id": {
                         "type": "string",
                         "description": "The user's unique identifier"
@@ -82,6 +141,7 @@ async def list_tools() -> List[Tool]:
             inputSchema={
                 "type": "object",
                 "properties": {
+                    "format": FORMAT_PROPERTY,
                     "user_id": {
                         "type": "string",
                         "description": "The user's unique identifier"
@@ -105,17 +165,45 @@ async def list_tools() -> List[Tool]:
                         "default": 5,
                         "minimum": 1,
                         "maximum": 20
-                    }
+                    },
+                    "offset": OFFSET_PROPERTY
                 },
                 "required": ["user_id", "workout_data"]
             }
         ),
+        Tool(
+            name="find_similar_athletes",
+            description="Find other athletes whose training profile is most similar to a user's, optionally for one activity type",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "format": FORMAT_PROPERTY,
+                    "user_id": {
+                        "type": "string",
+                        "description": "The user's unique identifier"
+                    },
+                    "activity_type": {
+                        "type": "string",
+                        "description": "Only compare profiles for this activity (e.g., 'run', 'cycle')"
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "Maximum number of athletes to return",
+                        "default": 10,
+                        "minimum": 1,
+                        "maximum": 50
+                    }
+                },
+                "required": ["user_id"]
+            }
+        ),
         Tool(
             name="generate_workout_recommendations",
             description="Generate personalized workout recommendations based on user's fitness profile and history",
             inputSchema={
                 "type": "object",
                 "properties": {
+                    "format": FORMAT_PROPERTY,
                     "user_id": {
                         "type": "string",
                         "description": "The user's unique identifier"
@@ -151,10 +239,11 @@ async def list_tools() -> List[Tool]:
         ),
         Tool(
             name="predict_performance_trends",
-            description="Analyze historical data to predict future performance trends and plateaus",
+            description="Fit date-ordered performance trends over the last timeframe_weeks of workouts to predict progress and plateaus",
             inputSchema={
                 "type": "object",
                 "properties": {
+                    "format": FORMAT_PROPERTY,
                     "user_id": {
                         "type": "string",
                         "description": "The user's unique identifier"
@@ -170,7 +259,15 @@ async def list_tools() -> List[Tool]:
                         "default": 12,
                         "minimum": 4,
                         "maximum": 52
-                    }
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "Maximum number of series points per page (json format)",
+                        "default": DEFAULT_SERIES_PAGE,
+                        "minimum": 1,
+                        "maximum": MAX_SERIES_PAGE
+                    },
+                    "offset": OFFSET_PROPERTY
                 },
                 "required": ["user_id", "metric"]
             }
@@ -181,6 +278,7 @@ async def list_tools() -> List[Tool]:
             inputSchema={
                 "type": "object",
                 "properties": {
+                    "format": FORMAT_PROPERTY,
                     "user_id": {
                         "type": "string",
                         "description": "The user's unique identifier"
@@ -204,22 +302,122 @@ async def list_tools() -> List[Tool]:
                 },
                 "required": ["user_id", "workout_data"]
             }
+        ),
+        Tool(
+            name="store_workouts_batch",
+            description="Store completed workouts of any number of users in the vector database with one write",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "format": FORMAT_PROPERTY,
+                    "workouts": {
+                        "type": "array",
+                        "description": "Workouts to store, each with its user's identifier",
+                        "maxItems": MAX_BATCH_WORKOUTS,
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "user_id": {"type": "string"},
+                                "workout_data": {
+                                    "type": "object",
+                                    "description": "Complete workout data, as for store_workout_for_analysis",
+                                    "required": ["id", "activity_type", "duration"]
+                                }
+                            },
+                            "required": ["user_id", "workout_data"]
+                        }
+                    }
+                },
+                "required": ["workouts"]
+            }
+        ),
+        Tool(
+            name="analyze_users_batch",
+            description="Analyze the stored workout patterns of many users at once and return per-user insights and stats",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "format": FORMAT_PROPERTY,
+                    "user_ids": {
+                        "type": "array",
+                        "description": "Identifiers of the users to analyze",
+                        "items": {"type": "string"},
+                        "maxItems": MAX_BATCH_USERS
+                    }
+                },
+                "required": ["user_ids"]
+            }
         )
     ]
 
-@app.call_tool()
-async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
-    """Execute MCP tool calls for fitness intelligence"""
+# Read-only tools whose responses are cached per user data version
+CACHED_TOOLS = {
+    "analyze_workout_patterns",
+    "generate_workout_recommendations",
+    "predict_performance_trends",
+}
 
+def warm_up() -> None:
+    """Import ChromaDB and open the shared collections ahead of the first tool call"""
+    started = time.perf_counter()
     try:
-        if name == "analyze_workout_patterns":
-            user_id = arguments["user_id"]
-            recent_workouts = arguments.get("recent_workouts", [])
-
-            # Analyze patterns using ChromaDB
-            analysis = analyze_user_patterns(workouts_collection, user_id, recent_workouts)
-
-            response = f"""## 🧠 AI Fitness Analysis for User {user_id}
+        from .chroma_setup import get_collections, get_similarity_index
+        get_collections()
+        get_similarity_index()
+        logger.info(f"ChromaDB warm-up finished in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        # Tools retry the connection on first use
+        logger.warning(f"ChromaDB warm-up failed: {e}")
+
+def run_tool(name: str, arguments: Dict[str, Any]) -> str:
+    """Run a tool synchronously and return its markdown response (blocking ChromaDB calls)"""
+    if name not in CACHED_TOOLS:
+        return compute_tool(name, arguments)
+
+    from .chroma_setup import get_collections, user_data_version
+
+    # Read the version before computing: a write that lands meanwhile (from
+    # any process) changes it, so this result is never served for newer data
+    version = user_data_version(get_collections()['user_patterns'], arguments["user_id"])
+    key = tool_cache.make_key(name, arguments, version)
+    response = tool_cache.get(key)
+    if response is None:
+        response = compute_tool(name, arguments)
+        tool_cache.set(key, response)
+    return response
+
+def compute_tool(name: str, arguments: Dict[str, Any]) -> str:
+    """Compute a tool's response without the result cache"""
+    from .chroma_setup import (
+        get_collections,
+        get_similarity_collection,
+        get_similarity_index,
+        create_workout_embedding,
+        store_workouts_in_chroma,
+        store_user_workouts_in_chroma,
+        find_similar_workouts,
+        find_similar_athletes,
+        analyze_user_patterns,
+        analyze_users_patterns
+    )
+    from .trends import TREND_METRICS, predict_trend
+    from .recommendations import get_recommendations
+
+    collections = get_collections()
+    workouts_collection = collections['workouts']
+    patterns_collection = collections['user_patterns']
+    as_json = arguments.get("format") == "json"
+
+    if name == "analyze_workout_patterns":
+        user_id = arguments["user_id"]
+        recent_workouts = arguments.get("recent_workouts", [])
+
+        # Analyze patterns using ChromaDB
+        analysis = analyze_user_patterns(workouts_collection, user_id, recent_workouts, patterns_collection)
+        if as_json:
+            return to_json({"user_id": user_id, **analysis})
+
+        response = f"""## 🧠 AI Fitness Analysis for User {user_id}
 
 ### 💡 Key Insights:
 {chr(10).join(f"• {insight}" for insight in analysis['insights'])}
@@ -234,25 +432,36 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
 • **VO2 Max Progression**: {analysis['stats']['vo2_progression'][-3:] if analysis['stats']['vo2_progression'] else 'Not enough data yet'}
 """
 
-        elif name == "find_similar_workouts":
-            user_id = arguments["user_id"]
-            workout_data = arguments["workout_data"]
-            limit = arguments.get("limit", 5)
-
-            # Create embedding for the workout
-            embedding = create_workout_embedding(workout_data)
-
-            # Find similar workouts
-            similar_workouts = find_similar_workouts(workouts_collection, embedding, user_id, limit)
+    elif name == "find_similar_workouts":
+        user_id = arguments["user_id"]
+        workout_data = arguments["workout_data"]
+        limit = min(20, max(1, int(arguments.get("limit", 5))))
+        offset = max(0, int(arguments.get("offset", 0)))
+        if offset + limit > MAX_SIMILAR_RESULTS:
+            raise ValueError(f"offset + limit must not exceed {MAX_SIMILAR_RESULTS}")
+
+        # Create embedding for the workout
+        embedding = create_workout_embedding(workout_data)
+
+        # Find similar workouts; one extra tells whether another page exists
+        results = page(
+            find_similar_workouts(get_similarity_collection(), embedding, user_id, offset + limit + 1),
+            offset, limit,
+        )
+        similar_workouts = results["items"]
+        if as_json:
+            for workout in similar_workouts:
+                workout["similarity_score"] = round(workout["similarity_score"], 4)
+            return to_json({"user_id": user_id, "results": results})
 
-            response = f"""## 🔍 Similar Workouts Analysis
+        response = f"""## 🔍 Similar Workouts Analysis
 
 Found {len(similar_workouts)} similar workouts in your history:
 
 """
 
-            for i, workout in enumerate(similar_workouts, 1):
-                response += f"""### #{i} - {workout['activity_type'].title()} Workout
+        for i, workout in enumerate(similar_workouts, 1):
+            response += f"""### #{i} - {workout['activity_type'].title()} Workout
 • **Date**: {workout['date']}
 • **Duration**: {workout['duration']} minutes
 • **Distance**: {workout['distance']} km
@@ -263,52 +472,64 @@ Found {len(similar_workouts)} similar workouts in your history:
 
 """
 
-        elif name == "generate_workout_recommendations":
-            user_id = arguments["user_id"]
-            fitness_goals = arguments.get("fitness_goals", [])
-            current_fitness = arguments.get("current_fitness_level", {})
-            constraints = arguments.get("constraints", {})
-
-            # Get user's workout history for context
-            user_analysis = analyze_user_patterns(workouts_collection, user_id, [])
-
-            # Generate AI-powered recommendations
-            recommendations = []
-
-            # Base recommendations on goals
-            if "improve_vo2max" in fitness_goals:
-                vo2_current = current_fitness.get("vo2max_estimate", 35)
-                if vo2_current < 35:
-                    recommendations.append("**VO2 Max Focus**: Incorporate 2-3 sessions of 20-30 minute continuous running at moderate intensity (70-80% max HR) weekly.")
-                else:
-                    recommendations.append("**VO2 Max Maintenance**: Continue with interval training mixing high-intensity efforts with recovery periods.")
-
-            if "build_endurance" in fitness_goals:
-                avg_weekly = current_fitness.get("avg_weekly_distance", 0)
-                if avg_weekly < 20:
-                    recommendations.append("**Endurance Building**: Gradually increase weekly distance by 10% per week. Focus on long, slow distance sessions.")
-                else:
-                    recommendations.append("**Endurance Maintenance**: Include one long workout (2-3x normal distance) weekly to maintain aerobic base.")
-
-            if "lose_weight" in fitness_goals:
-                recommendations.append("**Weight Management**: Combine moderate-intensity cardio (45-60 min) with strength training 3-4x weekly for optimal calorie burn.")
-
-            # Add personalized insights based on history
-            if user_analysis['stats']['total_workouts'] > 0:
-                if len(user_analysis['stats']['activity_types']) == 1:
-                    recommendations.append("**Cross-Training**: Add variety to prevent overuse injuries and improve overall fitness.")
-                if user_analysis['stats']['avg_intensity'] < 0.8:
-                    recommendations.append("**Progressive Overload**: Gradually increase workout intensity every 1-2 weeks to continue improving.")
-
-            response = f"""## 🎯 AI Workout Recommendations for User {user_id}
+    elif name == "find_similar_athletes":
+        user_id = arguments["user_id"]
+        activity_type = arguments.get("activity_type") or None
+        limit = min(50, max(1, int(arguments.get("limit", 10))))
+
+        athletes = find_similar_athletes(patterns_collection, user_id, limit, activity_type)
+        if as_json:
+            return to_json({"user_id": user_id, "activity_type": activity_type, "results": athletes})
+
+        scope = f"{activity_type} " if activity_type else ""
+        if athletes is None:
+            response = f"""## 👥 Similar Athletes for User {user_id}
+
+❌ **No {scope}profile yet**: Store some {scope}workouts to compare with other athletes."""
+        else:
+            response = f"""## 👥 Similar Athletes for User {user_id}
+
+Found {len(athletes)} athletes with a similar {scope}training profile:
+
+"""
+            for i, athlete in enumerate(athletes, 1):
+                response += f"""### #{i} - User {athlete['user_id']}
+• **Similarity Score**: {athlete['similarity_score']:.2%}
+• **Workouts Logged**: {athlete['total_workouts']}
+
+"""
+
+    elif name == "generate_workout_recommendations":
+        user_id = arguments["user_id"]
+        fitness_goals = arguments.get("fitness_goals", [])
+        current_fitness = arguments.get("current_fitness_level", {})
+        constraints = arguments.get("constraints", {})
+
+        # Served from the precomputed sets unless the user's data has changed since
+        result = get_recommendations(collections, user_id, fitness_goals, current_fitness)
+        recommendations = result['recommendations']
+        fitness = result['fitness']
+
+        if as_json:
+            return to_json({
+                "user_id": user_id,
+                "goals": fitness_goals,
+                "recommendations": recommendations,
+                "fitness": fitness,
+                "history": result['stats'],
+                "data_version": result['data_version'],
+                "source": result['source'],
+            })
+
+        response = f"""## 🎯 AI Workout Recommendations for User {user_id}
 
 ### 🏆 Based on Your Goals: {', '.join(fitness_goals) if fitness_goals else 'General Fitness'}
 
 {chr(10).join(f"### {i+1}. {rec}" for i, rec in enumerate(recommendations))}
 
 ### 📊 Your Current Profile:
-• **VO2 Max Estimate**: {current_fitness.get('vo2max_estimate', 'Unknown')} mL/kg/min
-• **Weekly Distance**: {current_fitness.get('avg_weekly_distance', 'Unknown')} km
+• **VO2 Max Estimate**: {fitness['vo2max_estimate'] if fitness.get('vo2max_estimate') is not None else 'Unknown'} mL/kg/min
+• **Weekly Distance**: {fitness['avg_weekly_distance'] if fitness.get('avg_weekly_distance') is not None else 'Unknown'} km
 • **Experience Level**: {current_fitness.get('experience_level', 'Unknown')}
 • **Preferred Activities**: {', '.join(current_fitness.get('preferred_activities', ['None specified']))}
 
@@ -319,63 +540,89 @@ Found {len(similar_workouts)} similar workouts in your history:
 
 Remember to listen to your body and consult with a healthcare professional before starting any new exercise program!"""
 
-        elif name == "predict_performance_trends":
-            user_id = arguments["user_id"]
-            metric = arguments["metric"]
-            timeframe_weeks = arguments.get("timeframe_weeks", 12)
-
-            # Get user's historical data
-            user_workouts = workouts_collection.get(where={"user_id": user_id})
-
-            if not user_workouts['ids']:
-                response = f"## 📈 Performance Trend Analysis for User {user_id}
-
-❌ **Insufficient Data**: No workout history found for trend analysis.
-
-**Recommendation**: Log at least 4-6 weeks of consistent workouts to enable performance trend analysis."
-            else:
-                # Analyze trends based on available data
-                vo2_trend = []
-                for metadata in user_workouts['metadatas']:
-                    if metadata.get('vo2max_estimate', 0) > 0:
-                        vo2_trend.append(metadata['vo2max_estimate'])
-
-                if len(vo2_trend) >= 3:
-                    trend_direction = "improving" if vo2_trend[-1] > vo2_trend[0] else "plateauing"
-                    avg_improvement = (vo2_trend[-1] - vo2_trend[0]) / len(vo2_trend)
-
-                    response = f"""## 📈 Performance Trend Analysis for User {user_id}
-
-### 📊 {metric.upper()} Trend Analysis ({timeframe_weeks} weeks):
-
-• **Current Trend**: {'📈 Improving' if trend_direction == 'improving' else '📊 Plateauing/Maintaining'}
-• **Average Weekly Change**: {avg_improvement:.2f} units
-• **Data Points**: {len(vo2_trend)} measurements
-• **Current Level**: {vo2_trend[-1]:.1f}
+    elif name == "predict_performance_trends":
+        user_id = arguments["user_id"]
+        metric = arguments["metric"]
+        if metric not in TREND_METRICS:
+            raise ValueError(f"Unknown metric '{metric}'; expected one of {', '.join(TREND_METRICS)}")
+        timeframe_weeks = min(52, max(4, int(arguments.get("timeframe_weeks", 12))))
+
+        # Only the requested window is read; it is filtered inside ChromaDB
+        trend = predict_trend(workouts_collection, user_id, metric, timeframe_weeks)
+        info = TREND_METRICS[metric]
+
+        if as_json:
+            timestamps, values = trend.pop('series')
+            limit = min(MAX_SERIES_PAGE, max(1, int(arguments.get("limit", DEFAULT_SERIES_PAGE))))
+            offset = max(0, int(arguments.get("offset", 0)))
+            series = page(list(zip(timestamps.tolist(), values.tolist())), offset, limit)
+            series["items"] = [
+                [datetime.fromtimestamp(ts, timezone.utc).isoformat(), round(value, 3)]
+                for ts, value in series["items"]
+            ]
+            return to_json({
+                "user_id": user_id,
+                "metric": metric,
+                "unit": info['unit'],
+                "timeframe_weeks": timeframe_weeks,
+                **trend,
+                "series": series,
+            })
+
+        if not trend['workouts']:
+            response = f"""## 📈 Performance Trend Analysis for User {user_id}
+
+❌ **Insufficient Data**: No workout history found in the last {timeframe_weeks} weeks for trend analysis.
+
+**Recommendation**: Log at least 4-6 weeks of consistent workouts to enable performance trend analysis."""
+        elif trend['points'] >= 3:
+            level = trend['level']
+            slope = trend['slope_per_week']
+            direction_label = {
+                'improving': '📈 Improving',
+                'declining': '📉 Declining',
+                'plateauing': '📊 Plateauing/Maintaining',
+            }[trend['direction']]
+
+            response = f"""## 📈 Performance Trend Analysis for User {user_id}
+
+### 📊 {info['label']} Trend Analysis ({timeframe_weeks} weeks):
+
+• **Current Trend**: {direction_label}
+• **Average Weekly Change**: {slope:+.2f} {info['unit']}
+• **Data Points**: {trend['points']} measurements over {trend['span_weeks']:.1f} weeks
+• **Current Level**: {level:.1f} {info['unit']} (recency-weighted)
 
 ### 🎯 Recommendations:
 • **If Improving**: Continue current training approach - it's working!
 • **If Plateauing**: Consider periodization, cross-training, or increased training volume
-• **Next Milestone**: Aim for {vo2_trend[-1] + 2:.1f} in the next 4-6 weeks
+• **If Declining**: Check recovery, sleep and training load before adding volume
+• **Next Milestone**: {level + slope * 6 if slope > 0 else level * 1.05:.1f} {info['unit']} in the next 4-6 weeks
 
 **Keep tracking workouts to see how interventions affect your performance trends!**"""
-                else:
-                    response = f"""## 📈 Performance Trend Analysis for User {user_id}
+        else:
+            response = f"""## 📈 Performance Trend Analysis for User {user_id}
 
-⚠️ **Limited Data**: Only {len(vo2_trend)} data points available for trend analysis.
+⚠️ **Limited Data**: Only {trend['points']} data points available for trend analysis.
 
 **Need**: At least 3 data points for meaningful trend analysis.
 
 **Keep logging workouts consistently to unlock detailed performance trend insights!**"""
 
-        elif name == "store_workout_for_analysis":
-            user_id = arguments["user_id"]
-            workout_data = arguments["workout_data"]
+    elif name == "store_workout_for_analysis":
+        user_id = arguments["user_id"]
+        workout_data = arguments["workout_data"]
 
-            # Store workout in ChromaDB for future AI analysis
-            workout_id = store_workout_in_chroma(workouts_collection, workout_data, user_id)
+        # Store workout in ChromaDB for future AI analysis
+        workout_id = store_workouts_in_chroma(
+            workouts_collection, [workout_data], user_id,
+            patterns_collection=patterns_collection,
+            similarity_index=get_similarity_index(),
+        )[0]
+        if as_json:
+            return to_json({"user_id": user_id, "workout_id": workout_id, "stored": True})
 
-            response = f"""## 💾 Workout Stored for AI Analysis
+        response = f"""## 💾 Workout Stored for AI Analysis
 
 ✅ **Successfully stored workout** `{workout_id}` for user `{user_id}`
 
@@ -393,31 +640,225 @@ Remember to listen to your body and consult with a healthcare professional befor
 
 **This workout is now part of your AI-powered fitness intelligence system!** 🧠💪"""
 
-        else:
-            response = f"Unknown tool: {name}"
+    elif name == "store_workouts_batch":
+        items = arguments["workouts"]
+        if len(items) > MAX_BATCH_WORKOUTS:
+            raise ValueError(f"At most {MAX_BATCH_WORKOUTS} workouts per batch")
+
+        # Invalid items are reported and skipped; the rest go in one write
+        valid = []
+        errors = []
+        seen = set()
+        for index, item in enumerate(items):
+            user_id = str(item.get("user_id") or "")
+            workout_data = item.get("workout_data") or {}
+            missing = [field for field in ("id", "activity_type", "duration") if workout_data.get(field) in (None, "")]
+            if not user_id:
+                errors.append((index, "missing user_id"))
+            elif missing:
+                errors.append((index, f"missing {', '.join(missing)}"))
+            elif (user_id, str(workout_data["id"])) in seen:
+                errors.append((index, f"duplicate workout id {workout_data['id']}"))
+            else:
+                seen.add((user_id, str(workout_data["id"])))
+                valid.append((user_id, workout_data))
 
+        stored_ids = store_user_workouts_in_chroma(
+            workouts_collection, valid,
+            patterns_collection=patterns_collection,
+            similarity_index=get_similarity_index(),
+        )
+        per_user = {}
+        for user_id, _ in valid:
+            per_user[user_id] = per_user.get(user_id, 0) + 1
+        if as_json:
+            return to_json({
+                "stored": len(stored_ids),
+                "per_user": per_user,
+                "errors": [{"index": index, "error": error} for index, error in errors],
+            })
+
+        response = f"""## 💾 Batch Stored for AI Analysis
+
+✅ **Stored {len(stored_ids)} workouts** for {len(per_user)} users in one write
+
+### 👥 Per User:
+{chr(10).join(f"• `{user_id}`: {count} workouts" for user_id, count in per_user.items()) or "• None"}
+"""
+        if errors:
+            response += f"""
+### ⚠️ Skipped {len(errors)} invalid items:
+{chr(10).join(f"• Item {index}: {error}" for index, error in errors)}
+"""
+
+    elif name == "analyze_users_batch":
+        user_ids = [str(user_id) for user_id in dict.fromkeys(arguments["user_ids"])]
+        if len(user_ids) > MAX_BATCH_USERS:
+            raise ValueError(f"At most {MAX_BATCH_USERS} users per batch")
+
+        analyses = analyze_users_patterns(workouts_collection, user_ids, patterns_collection)
+        if as_json:
+            return to_json({"users": analyses})
+
+        response = f"""## 🧠 AI Fitness Analysis for {len(user_ids)} Users
+"""
+        for user_id in user_ids:
+            analysis = analyses[user_id]
+            stats = analysis['stats']
+            response += f"""
+### 👤 User {user_id}
+• **Total Workouts Logged**: {stats['total_workouts']}
+• **Activity Variety**: {', '.join(stats['activity_types']) or 'None yet'}
+• **Average Intensity**: {'Low' if stats['avg_intensity'] < 0.8 else 'High' if stats['avg_intensity'] > 1.5 else 'Moderate'}
+• **VO2 Max Progression**: {stats['vo2_progression'][-3:] if stats['vo2_progression'] else 'Not enough data yet'}
+"""
+            notes = [f"• 💡 {insight}" for insight in analysis['insights']]
+            notes += [f"• 🎯 {rec}" for rec in analysis['recommendations']]
+            if notes:
+                response += chr(10).join(notes) + chr(10)
+
+    else:
+        if as_json:
+            return to_json({"error": f"Unknown tool: {name}"})
+        response = f"Unknown tool: {name}"
+
+    return response
+
+@app.call_tool()
+async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
+    """Execute MCP tool calls for fitness intelligence"""
+
+    try:
+        # ChromaDB calls block, so tools run on a bounded thread pool and one
+        # slow call does not stall every other request on the event loop
+        semaphore = _get_tool_semaphore()
+        await semaphore.acquire()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(_tool_executor, run_tool, name, arguments)
+        except BaseException:
+            semaphore.release()
+            raise
+        # A timed-out call keeps its thread until run_tool returns, so the slot is
+        # only freed then; shield() stops wait_for from cancelling the future early
+        future.add_done_callback(lambda f: _release_tool_slot(semaphore, f))
+        response = await asyncio.wait_for(asyncio.shield(future), timeout=tool_timeout(name))
         return [TextContent(type="text", text=response)]
 
+    except asyncio.TimeoutError:
+        logger.error(f"Tool {name} timed out after {tool_timeout(name)}s")
+        if arguments.get("format") == "json":
+            return [TextContent(type="text", text=to_json({"error": f"timed out after {tool_timeout(name)} seconds"}))]
+        return [TextContent(
+            type="text",
+            text=f"❌ **Error executing {name}**: timed out after {tool_timeout(name)} seconds.\n\nPlease try again."
+        )]
+
     except Exception as e:
         logger.error(f"Error executing tool {name}: {e}")
+        if arguments.get("format") == "json":
+            return [TextContent(type="text", text=to_json({"error": str(e)}))]
         return [TextContent(
             type="text",
             text=f"❌ **Error executing {name}**: {str(e)}\n\nPlease check your input parameters and try again."
         )]
 
-async def main():
+def create_http_app(json_response: bool = False):
+    """
+    Starlette app serving this MCP server to many clients from one warm process.
+
+    Streamable HTTP is served at /mcp and the legacy SSE transport at /sse
+    (with client messages posted to /messages/). Every client gets its own
+    MCP session; the ChromaDB handles, tool thread pool and result cache are
+    shared. Result cache hit/miss counters are served at /cache-stats.
+    """
+    import contextlib
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, Response
+    from starlette.routing import Mount, Route
+    from mcp.server.sse import SseServerTransport
+    from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+
+    session_manager = StreamableHTTPSessionManager(app=app, json_response=json_response)
+    sse = SseServerTransport("/messages/")
+
+    async def handle_streamable_http(scope, receive, send):
+        await session_manager.handle_request(scope, receive, send)
+
+    async def handle_sse(request):
+        async with sse.connect_sse(request.scope, request.receive, request._send) as (read_stream, write_stream):
+            await app.run(read_stream, write_stream, app.create_initialization_options())
+        return Response()
+
+    async def handle_cache_stats(request):
+        return JSONResponse(tool_cache.stats())
+
+    @contextlib.asynccontextmanager
+    async def lifespan(starlette_app):
+        async with session_manager.run():
+            if WARMUP_ON_START:
+                asyncio.get_running_loop().run_in_executor(_tool_executor, warm_up)
+            try:
+                yield
+            finally:
+                # Open sessions are closed by session_manager; let running tools
+                # finish, off the event loop and for at most SHUTDOWN_TIMEOUT
+                logger.info("Shutting down: waiting for in-flight tool calls...")
+                try:
+                    await asyncio.wait_for(
+                        asyncio.to_thread(_tool_executor.shutdown, wait=True, cancel_futures=True),
+                        timeout=SHUTDOWN_TIMEOUT,
+                    )
+                except asyncio.TimeoutError:
+                    logger.warning(f"Tool calls still running after {SHUTDOWN_TIMEOUT}s; no longer waiting for them")
+
+    return Starlette(
+        routes=[
+            Mount("/mcp", app=handle_streamable_http),
+            Route("/sse", endpoint=handle_sse, methods=["GET"]),
+            Mount("/messages/", app=sse.handle_post_message),
+            Route("/cache-stats", endpoint=handle_cache_stats, methods=["GET"]),
+        ],
+        lifespan=lifespan,
+    )
+
+async def main(transport: str = "stdio", host: str = "127.0.0.1", port: int = 8765):
     """Main MCP server entry point"""
-    logger.info("Starting Airwave Fitness Intelligence MCP Server...")
+    logger.info(f"Starting Airwave Fitness Intelligence MCP Server ({transport})...")
+
+    if transport == "http":
+        import uvicorn
+
+        # uvicorn handles SIGINT/SIGTERM: it stops accepting connections and
+        # runs the app's lifespan shutdown before exiting
+        config = uvicorn.Config(create_http_app(), host=host, port=port, log_level="info",
+                                timeout_graceful_shutdown=int(SHUTDOWN_TIMEOUT))
+        await uvicorn.Server(config).serve()
+        return
 
     # Import here to avoid issues if mcp package isn't available
     from mcp.server.stdio import stdio_server
 
     async with stdio_server() as (read_stream, write_stream):
+        if WARMUP_ON_START:
+            # Connect to ChromaDB in the background while the client initializes
+            asyncio.get_running_loop().run_in_executor(_tool_executor, warm_up)
+
         await app.run(
             read_stream,
             write_stream,
             app.create_initialization_options()
         )
 
+    logger.info(f"Result cache: {tool_cache.stats()}")
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Airwave Fitness Intelligence MCP Server")
+    parser.add_argument("--transport", choices=["stdio", "http"], default=os.getenv("MCP_TRANSPORT", "stdio"),
+                        help="stdio for one agent per process, http to share one server (streamable HTTP + SSE)")
+    parser.add_argument("--host", default=os.getenv("MCP_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MCP_PORT", "8765")))
+    args = parser.parse_args()
+
+    asyncio.run(main(args.transport, args.host, args.port))
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 04:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_alter_userprofile_age_alter_userprofile_height_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workout',
+            name='vo2max_estimate',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
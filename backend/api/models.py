@@ -3,6 +3,7 @@ from django.contrib.auth.models import User
 from encrypted_model_fields.fields import EncryptedCharField, EncryptedIntegerField, EncryptedTextField
 import stripe
 from django.conf import settings
+from django.utils import timezone
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -19,6 +20,47 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username} Profile"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the stored VO2 max estimates were computed from
+        if 'age' in instance.__dict__ and 'gender' in instance.__dict__:
+            instance._estimate_inputs = (instance.age, instance.gender)
+        return instance
+
+    def save(self, *args, **kwargs):
+        previous = getattr(self, '_estimate_inputs', None)
+        super().save(*args, **kwargs)
+        current = (self.age, self.gender)
+        self._estimate_inputs = current
+        if previous is not None and previous != current:
+            self.recompute_vo2max_estimates()
+
+    def recompute_vo2max_estimates(self, batch_size=500):
+        """Re-estimate and store VO2 max for every workout of this user"""
+        workouts = Workout.objects.filter(user_id=self.user_id).only(
+            'id', 'activity_type', 'duration', 'distance', 'heart_rate_max'
+        )
+        batch = []
+        updated = 0
+        for workout in workouts.iterator(chunk_size=batch_size):
+            batch.append(workout)
+            if len(batch) >= batch_size:
+                updated += self._store_estimates(batch)
+                batch = []
+        if batch:
+            updated += self._store_estimates(batch)
+        return updated
+
+    def _store_estimates(self, workouts):
+        from .vo2max_utils import estimate_vo2max_for_workouts
+
+        estimates = estimate_vo2max_for_workouts(workouts, self).round(1)
+        for workout, estimate in zip(workouts, estimates.tolist()):
+            workout.vo2max_estimate = estimate
+        Workout.objects.bulk_update(workouts, ['vo2max_estimate'])
+        return len(workouts)
+
     @property
     def weight_kg(self):
         """Get weight as float for calculations"""
@@ -49,6 +91,14 @@ class Workout(models.Model):
         ('high', 'High'),
     ], default='moderate')
     date = models.DateTimeField(auto_now_add=True)
+    vo2max_estimate = models.FloatField(null=True, blank=True)  # mL/kg/min, computed at write time
+
+    class Meta:
+        indexes = [
+            # Per-user history, newest first (id breaks ties for keyset pagination)
+            models.Index(fields=['user', '-date', '-id'], name='workout_user_date_idx'),
+            models.Index(fields=['user', 'activity_type', '-date'], name='workout_user_activity_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.activity_type} on {self.date}"
@@ -69,6 +119,54 @@ class Workout(models.Model):
         except (ValueError, TypeError):
             return None
 
+class ChromaOutbox(models.Model):
+    """Workouts waiting to be written to the ChromaDB vector store"""
+    workout = models.ForeignKey(Workout, on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=[
+        ('pending', 'Pending'),
+        ('failed', 'Failed'),
+    ], default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_next_idx'),
+        ]
+
+    def __str__(self):
+        return f"Outbox {self.workout_id} ({self.status}, {self.attempts} attempts)"
+
+class StripeEvent(models.Model):
+    """Verified Stripe webhook events, stored on receipt and processed by process_stripe_events"""
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    # Subscription or payment intent the event is about; events for one object are applied in order
+    object_id = models.CharField(max_length=255, blank=True)
+    payload = models.JSONField()
+    stripe_created = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=[
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ], default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='stripe_event_status_next_idx'),
+            models.Index(fields=['object_id', 'stripe_created'], name='stripe_event_object_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_id} {self.type} ({self.status})"
+
 class Subscription(models.Model):
     """User subscription model for premium features"""
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -101,11 +199,18 @@ class Subscription(models.Model):
 
     @property
     def is_premium(self):
-        return self.plan in ['premium', 'pro'] and self.status == 'active'
+        return self.plan in ['premium', 'pro'] and self.is_current
 
     @property
     def is_pro(self):
-        return self.plan == 'pro' and self.status == 'active'
+        return self.plan == 'pro' and self.is_current
+
+    @property
+    def is_current(self):
+        """Active and, when Stripe gave a period end, not past it"""
+        if self.status != 'active':
+            return False
+        return self.current_period_end is None or self.current_period_end > timezone.now()
 
 class Payment(models.Model):
     """Payment transaction records"""
@@ -128,6 +233,12 @@ class Payment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='payment_user_created_idx'),
+            models.Index(fields=['status'], name='payment_status_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - ${self.amount/100:.2f} ({self.status})"
 
@@ -0,0 +1,111 @@
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ChromaOutbox
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 8
+BASE_BACKOFF_SECONDS = 5
+MAX_BACKOFF_SECONDS = 3600
+
+
+def workout_to_ai_data(workout):
+    """Build the ChromaDB payload for a stored Workout row"""
+    return {
+        'id': str(workout.id),
+        'activity_type': workout.activity_type,
+        'duration': workout.duration,
+        'distance': workout.distance or 0,
+        'heart_rate_avg': workout.avg_heart_rate or 0,
+        'heart_rate_max': workout.max_heart_rate or 0,
+        'intensity': workout.intensity,
+        'date': workout.date.isoformat(),
+        'vo2max_estimate': workout.vo2max_estimate or 0,
+    }
+
+
+def enqueue_workouts(workouts):
+    """
+    Queue workouts for the vector store.
+
+    Call inside the transaction that saves the workouts so the outbox rows
+    commit (or roll back) together with them.
+    """
+    return ChromaOutbox.objects.bulk_create([ChromaOutbox(workout=workout) for workout in workouts])
+
+
+def backoff_delay(attempts):
+    """Exponential backoff for the given number of failed attempts"""
+    return timedelta(seconds=min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** (attempts - 1)))
+
+
+def drain_outbox(batch_size=100, max_attempts=MAX_ATTEMPTS):
+    """
+    Write one batch of due outbox entries to ChromaDB.
+
+    Entries are grouped per user and stored with one upsert per user, so a
+    retried entry never creates a duplicate. Stored entries are deleted;
+    failed ones are rescheduled with exponential backoff and marked
+    'failed' after max_attempts. Returns (stored, failed) counts.
+    """
+    from .chroma_setup import (
+        get_collections, get_similarity_index, reset_collections, store_workouts_in_chroma
+    )
+
+    now = timezone.now()
+    stored = failed = 0
+
+    with transaction.atomic():
+        # skip_locked lets several workers drain concurrently on Postgres
+        entries = list(
+            ChromaOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .select_related('workout')
+            .order_by('id')[:batch_size]
+        )
+        if not entries:
+            return stored, failed
+
+        by_user = defaultdict(list)
+        for entry in entries:
+            by_user[entry.workout.user_id].append(entry)
+
+        done = []
+        retry = []
+        for user_id, user_entries in by_user.items():
+            try:
+                collections = get_collections()
+                store_workouts_in_chroma(
+                    collections['workouts'],
+                    [workout_to_ai_data(entry.workout) for entry in user_entries],
+                    str(user_id),
+                    upsert=True,
+                    patterns_collection=collections['user_patterns'],
+                    similarity_index=get_similarity_index(),
+                )
+                done.extend(user_entries)
+            except Exception as e:
+                logger.warning("Failed to store %d workouts for user %s in ChromaDB: %s",
+                               len(user_entries), user_id, e)
+                reset_collections()
+                for entry in user_entries:
+                    entry.attempts += 1
+                    entry.last_error = str(e)
+                    entry.next_attempt_at = now + backoff_delay(entry.attempts)
+                    if entry.attempts >= max_attempts:
+                        entry.status = 'failed'
+                retry.extend(user_entries)
+
+        if done:
+            ChromaOutbox.objects.filter(id__in=[entry.id for entry in done]).delete()
+        if retry:
+            ChromaOutbox.objects.bulk_update(retry, ['attempts', 'last_error', 'next_attempt_at', 'status'])
+
+        stored, failed = len(done), len(retry)
+
+    return stored, failed
@@ -0,0 +1,64 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_PAGE_LIMIT = 20
+MAX_PAGE_LIMIT = 100
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue"""
+
+
+def encode_cursor(date, pk):
+    """Encode a (date, id) position as an opaque URL-safe token"""
+    raw = json.dumps([date.isoformat(), pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a token produced by encode_cursor back into (date, id)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        date_str, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        date = parse_datetime(date_str)
+        if date is None or not isinstance(pk, int):
+            raise ValueError(cursor)
+        return date, pk
+    except (ValueError, TypeError, UnicodeDecodeError) as e:
+        raise InvalidCursor(str(e))
+
+
+def parse_limit(value, default=DEFAULT_PAGE_LIMIT, maximum=MAX_PAGE_LIMIT):
+    """Parse the ?limit= query parameter, clamped to [1, maximum]"""
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except (ValueError, TypeError):
+        return default
+    return max(1, min(maximum, limit))
+
+
+def keyset_page(queryset, cursor=None, limit=DEFAULT_PAGE_LIMIT):
+    """
+    Return one page of a queryset ordered newest first by (date, id).
+
+    Rows strictly after the cursor position are read, plus one extra row
+    to tell whether another page exists, so the cost of a request does not
+    depend on how deep into the history the client is.
+    """
+    queryset = queryset.order_by('-date', '-id')
+    if cursor:
+        date, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(date__lt=date) | Q(date=date, id__lt=pk))
+
+    rows = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].date, rows[-1].id)
+
+    return rows, next_cursor
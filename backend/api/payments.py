@@ -0,0 +1,151 @@
+"""
+Stripe API client shared by the payment views.
+
+One StripeClient per process, backed by a pooled requests session so
+calls reuse connections instead of the stripe module's per-thread
+defaults. Connect/read timeouts and network retries come from settings
+(retried POSTs carry an idempotency key, so a retry cannot double-charge),
+and every call's latency is recorded per operation. STRIPE_API_BASE points
+the client at another server, e.g. `manage.py run_fake_stripe` for offline
+load tests.
+"""
+
+import logging
+import statistics
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_SAMPLES = 1000
+
+
+class CallMetrics:
+    """Call counts, errors and recent latencies per Stripe operation"""
+
+    def __init__(self, samples=LATENCY_SAMPLES):
+        self.samples = samples
+        self._lock = threading.Lock()
+        self._operations = {}
+
+    def record(self, operation, seconds, error=False):
+        with self._lock:
+            entry = self._operations.get(operation)
+            if entry is None:
+                entry = self._operations[operation] = {
+                    'calls': 0, 'errors': 0, 'total': 0.0, 'latencies': deque(maxlen=self.samples),
+                }
+            entry['calls'] += 1
+            entry['errors'] += int(error)
+            entry['total'] += seconds
+            entry['latencies'].append(seconds)
+
+    def stats(self):
+        """Per-operation counts and latencies in milliseconds (percentiles over recent calls)"""
+        with self._lock:
+            snapshot = {op: (dict(entry), sorted(entry['latencies'])) for op, entry in self._operations.items()}
+        stats = {}
+        for operation, (entry, latencies) in snapshot.items():
+            stats[operation] = {
+                'calls': entry['calls'],
+                'errors': entry['errors'],
+                'mean_ms': round(entry['total'] / entry['calls'] * 1000, 2),
+                'p50_ms': round(statistics.median(latencies) * 1000, 2),
+                'p95_ms': round(latencies[max(int(len(latencies) * 0.95) - 1, 0)] * 1000, 2),
+                'max_ms': round(latencies[-1] * 1000, 2),
+            }
+        return stats
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+
+
+class PaymentsClient:
+    """The Stripe calls the app makes, over one pooled, instrumented client"""
+
+    def __init__(self, api_key, api_base=None, connect_timeout=5.0, read_timeout=30.0,
+                 max_retries=2, pool_size=10, metrics=None):
+        import requests
+        import stripe
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        # Retries are left to the Stripe client, which adds idempotency keys
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.metrics = metrics if metrics is not None else CallMetrics()
+        self.stripe = stripe.StripeClient(
+            api_key,
+            base_addresses={'api': api_base} if api_base else None,
+            max_network_retries=max_retries,
+            http_client=stripe.RequestsClient(timeout=(connect_timeout, read_timeout), session=self.session),
+        )
+
+    def call(self, operation, method, *args):
+        """Run one Stripe call, recording its latency under `operation`"""
+        started = time.perf_counter()
+        error = True
+        try:
+            result = method(*args)
+            error = False
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            self.metrics.record(operation, elapsed, error)
+            logger.debug("Stripe %s took %.1f ms%s", operation, elapsed * 1000, ' (failed)' if error else '')
+
+    def create_customer(self, **params):
+        return self.call('customers.create', self.stripe.v1.customers.create, params)
+
+    def create_payment_intent(self, **params):
+        return self.call('payment_intents.create', self.stripe.v1.payment_intents.create, params)
+
+    def modify_subscription(self, subscription_id, **params):
+        return self.call('subscriptions.update', self.stripe.v1.subscriptions.update, subscription_id, params)
+
+    def list_events(self, **params):
+        """The first page of events; its auto_paging_iter() fetches the rest through this client"""
+        return self.call('events.list', self.stripe.v1.events.list, params)
+
+    def close(self):
+        self.session.close()
+
+
+# Shared by every client this process builds, so stats survive reset_client
+metrics = CallMetrics()
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """This process's PaymentsClient, built from settings on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PaymentsClient(
+                    settings.STRIPE_SECRET_KEY,
+                    api_base=settings.STRIPE_API_BASE,
+                    connect_timeout=settings.STRIPE_CONNECT_TIMEOUT,
+                    read_timeout=settings.STRIPE_READ_TIMEOUT,
+                    max_retries=settings.STRIPE_MAX_RETRIES,
+                    pool_size=settings.STRIPE_POOL_SIZE,
+                    metrics=metrics,
+                )
+    return _client
+
+
+def reset_client():
+    """Close the shared client so the next call rebuilds it (e.g. after settings change)"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
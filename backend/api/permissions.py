@@ -0,0 +1,32 @@
+from functools import lru_cache
+
+from rest_framework.permissions import BasePermission
+
+from .entitlements import get_entitlement, has_plan
+
+
+class PlanPermission(BasePermission):
+    """
+    Allow authenticated users whose subscription includes `plan`.
+
+    'pro' subscribers also pass a 'premium' check. The check reads the
+    cached entitlement, not the Subscription table. Build subclasses with
+    HasPlan.
+    """
+
+    plan = None
+
+    def has_permission(self, request, view):
+        user = request.user
+        if not user or not user.is_authenticated:
+            return False
+        return has_plan(get_entitlement(user.id), self.plan)
+
+
+@lru_cache(maxsize=None)
+def HasPlan(plan):
+    """The permission class for a plan, e.g. permission_classes = [IsAuthenticated, HasPlan('premium')]"""
+    return type(f"Has{plan.title()}Plan", (PlanPermission,), {
+        'plan': plan,
+        'message': f"A {plan} subscription is required",
+    })
@@ -0,0 +1,229 @@
+"""
+Rule-based workout recommendations, precomputed into the
+workout_recommendations collection.
+
+Each user has one stored set per goal plus one 'history' set built from
+their pattern snapshot. A set records the data version it was built from:
+the number of workouts in the user's snapshot, which grows with every
+stored workout. Sets built from an older version, or older than
+RECOMMENDATION_MAX_AGE seconds, are recomputed live.
+"""
+
+import json
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from .chroma_setup import (
+    EMBEDDING_DIM,
+    analyze_pattern_summary,
+    get_setting,
+    get_user_pattern_summaries,
+    load_pattern_summaries,
+)
+from .trends import SECONDS_PER_WEEK
+
+RECOMMENDATION_GOALS = ('improve_vo2max', 'build_endurance', 'lose_weight')
+HISTORY_SET = 'history'
+# Weekly distance is averaged over this many recent weeks
+FITNESS_WINDOW_WEEKS = 4
+DEFAULT_MAX_AGE_SECONDS = 24 * 3600
+# Used when neither the caller nor the user's history gives a value
+DEFAULT_FITNESS = {'vo2max_estimate': 35, 'avg_weekly_distance': 0}
+
+
+def goal_recommendations(goal, fitness):
+    """Recommendations for one fitness goal"""
+    if goal == 'improve_vo2max':
+        if fitness['vo2max_estimate'] < 35:
+            return ["**VO2 Max Focus**: Incorporate 2-3 sessions of 20-30 minute continuous running at moderate intensity (70-80% max HR) weekly."]
+        return ["**VO2 Max Maintenance**: Continue with interval training mixing high-intensity efforts with recovery periods."]
+
+    if goal == 'build_endurance':
+        if fitness['avg_weekly_distance'] < 20:
+            return ["**Endurance Building**: Gradually increase weekly distance by 10% per week. Focus on long, slow distance sessions."]
+        return ["**Endurance Maintenance**: Include one long workout (2-3x normal distance) weekly to maintain aerobic base."]
+
+    if goal == 'lose_weight':
+        return ["**Weight Management**: Combine moderate-intensity cardio (45-60 min) with strength training 3-4x weekly for optimal calorie burn."]
+
+    return []
+
+
+def history_recommendations(stats):
+    """Recommendations from the user's training history"""
+    recommendations = []
+    if stats['total_workouts'] > 0:
+        if len(stats['activity_types']) == 1:
+            recommendations.append("**Cross-Training**: Add variety to prevent overuse injuries and improve overall fitness.")
+        if stats['avg_intensity'] < 0.8:
+            recommendations.append("**Progressive Overload**: Gradually increase workout intensity every 1-2 weeks to continue improving.")
+    return recommendations
+
+
+def recent_distances(workouts_collection, user_ids, weeks=FITNESS_WINDOW_WEEKS, now=None):
+    """Total distance per user over the last `weeks` weeks, with one query for all users"""
+    since = (time.time() if now is None else now) - weeks * SECONDS_PER_WEEK
+    result = workouts_collection.get(
+        where={'$and': [{'user_id': {'$in': list(user_ids)}}, {'timestamp': {'$gte': since}}]},
+        include=['metadatas'],
+    )
+    totals = defaultdict(float)
+    for metadata in result['metadatas']:
+        totals[metadata['user_id']] += metadata.get('distance') or 0
+    return totals
+
+
+def derive_fitness(summary, recent_distance, weeks=FITNESS_WINDOW_WEEKS):
+    """Current fitness from the user's own data: recent VO2 max and weekly distance"""
+    vo2_recent = summary['vo2_recent'][-3:]
+    return {
+        'vo2max_estimate': round(float(np.mean(vo2_recent)), 1) if vo2_recent else None,
+        'avg_weekly_distance': round(recent_distance / weeks, 1),
+    }
+
+
+def build_recommendation_sets(summary, fitness):
+    """Every goal's set and the history set for one user"""
+    rule_inputs = {key: DEFAULT_FITNESS[key] if fitness.get(key) is None else fitness[key] for key in DEFAULT_FITNESS}
+    sets = {goal: goal_recommendations(goal, rule_inputs) for goal in RECOMMENDATION_GOALS}
+    sets[HISTORY_SET] = history_recommendations(analyze_pattern_summary(summary)['stats'])
+    return sets
+
+
+def recommendation_set_id(user_id, name):
+    return f"recs_{user_id}_{name}"
+
+
+def save_recommendation_sets(recommendations_collection, built, now=None):
+    """Store {user_id: (summary, fitness, sets)} with one upsert"""
+    if not built:
+        return
+    now = time.time() if now is None else now
+    ids, embeddings, metadatas, documents = [], [], [], []
+    for user_id, (summary, fitness, sets) in built.items():
+        # Sets are found by id; the user's mean workout embedding keeps them searchable
+        centroid = np.asarray(summary.get('embedding_sum', [0.0] * EMBEDDING_DIM), dtype=np.float64)
+        centroid = (centroid / max(summary['total_workouts'], 1)).astype(np.float32).tolist()
+        for name, recommendations in sets.items():
+            ids.append(recommendation_set_id(user_id, name))
+            embeddings.append(centroid)
+            metadatas.append({
+                'user_id': user_id,
+                'set': name,
+                'data_version': summary['total_workouts'],
+                'computed_at': now,
+                'fitness': json.dumps(fitness),
+                'recommendations': json.dumps(recommendations),
+            })
+            documents.append(f"{name} recommendations for user {user_id}: " + ' '.join(recommendations))
+    recommendations_collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
+
+
+def precompute_recommendations(collections, user_ids, force=False, max_age=None, now=None):
+    """
+    Build and store recommendation sets for a chunk of users.
+
+    Users without stored workouts are skipped, as are users whose sets are
+    still fresh unless force is set. Costs one read of the snapshots, one
+    of the stored sets, one windowed workout query and one upsert for the
+    whole chunk. Returns the number of users written.
+    """
+    now = time.time() if now is None else now
+    user_ids = [str(user_id) for user_id in user_ids]
+    summaries = load_pattern_summaries(collections['user_patterns'], user_ids)
+    summaries = {user_id: summary for user_id, summary in summaries.items() if summary['total_workouts']}
+    if not force:
+        stored = _load_sets(collections['recommendations'], list(summaries), [HISTORY_SET, *RECOMMENDATION_GOALS])
+        summaries = {
+            user_id: summary for user_id, summary in summaries.items()
+            if not _is_fresh(stored.get(user_id, {}), [HISTORY_SET, *RECOMMENDATION_GOALS],
+                             summary['total_workouts'], max_age, now)
+        }
+    if not summaries:
+        return 0
+
+    distances = recent_distances(collections['workouts'], list(summaries), now=now)
+    built = {}
+    for user_id, summary in summaries.items():
+        fitness = derive_fitness(summary, distances.get(user_id, 0.0))
+        built[user_id] = (summary, fitness, build_recommendation_sets(summary, fitness))
+    save_recommendation_sets(collections['recommendations'], built, now)
+    return len(built)
+
+
+def get_recommendations(collections, user_id, goals, current_fitness=None, max_age=None, now=None):
+    """
+    Recommendations for a user and goals, from the stored sets when they are fresh.
+
+    Falls back to live computation (and stores the result) when a set is
+    missing, built from an older data version or too old. Fitness values
+    passed by the caller override the ones derived from the user's data;
+    if they differ from what the stored sets were built with, the result
+    is computed live and not stored.
+
+    Returns a dict with recommendations, the fitness used, the history
+    stats, the data version and source ('precomputed' or 'live').
+    """
+    now = time.time() if now is None else now
+    user_id = str(user_id)
+    current_fitness = current_fitness or {}
+    overrides = {key: current_fitness[key] for key in DEFAULT_FITNESS if current_fitness.get(key) is not None}
+    names = [goal for goal in RECOMMENDATION_GOALS if goal in goals] + [HISTORY_SET]
+
+    summary = get_user_pattern_summaries(collections['user_patterns'], collections['workouts'], [user_id])[user_id]
+    version = summary['total_workouts']
+    stats = analyze_pattern_summary(summary)['stats']
+
+    stored = _load_sets(collections['recommendations'], [user_id], names).get(user_id, {})
+    if _is_fresh(stored, names, version, max_age, now):
+        fitness = json.loads(stored[HISTORY_SET]['fitness'])
+        if all(fitness.get(key) == value for key, value in overrides.items()):
+            return {
+                'recommendations': [rec for name in names for rec in json.loads(stored[name]['recommendations'])],
+                'fitness': fitness,
+                'stats': stats,
+                'data_version': version,
+                'source': 'precomputed',
+            }
+
+    distance = recent_distances(collections['workouts'], [user_id], now=now).get(user_id, 0.0)
+    derived = derive_fitness(summary, distance)
+    fitness = {**derived, **overrides}
+    sets = build_recommendation_sets(summary, fitness)
+    if version and fitness == derived:
+        save_recommendation_sets(collections['recommendations'], {user_id: (summary, fitness, sets)}, now)
+
+    return {
+        'recommendations': [rec for name in names for rec in sets[name]],
+        'fitness': fitness,
+        'stats': stats,
+        'data_version': version,
+        'source': 'live',
+    }
+
+
+def _load_sets(recommendations_collection, user_ids, names):
+    """Stored set metadata as {user_id: {name: metadata}}"""
+    if not user_ids:
+        return {}
+    result = recommendations_collection.get(
+        ids=[recommendation_set_id(user_id, name) for user_id in user_ids for name in names],
+        include=['metadatas'],
+    )
+    stored = defaultdict(dict)
+    for metadata in result['metadatas']:
+        stored[metadata['user_id']][metadata['set']] = metadata
+    return stored
+
+
+def _is_fresh(sets, names, version, max_age, now):
+    if max_age is None:
+        max_age = float(get_setting('RECOMMENDATION_MAX_AGE', DEFAULT_MAX_AGE_SECONDS))
+    return all(
+        name in sets
+        and sets[name]['data_version'] == version
+        and now - sets[name]['computed_at'] < max_age
+        for name in names
+    )
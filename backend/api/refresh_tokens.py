@@ -0,0 +1,143 @@
+"""
+Refresh-token rotation with an in-process blacklist filter.
+
+With ROTATE_REFRESH_TOKENS and BLACKLIST_AFTER_ROTATION, simplejwt looks
+every presented refresh token up in the blacklist table before rotating
+it. Here a per-process set of blacklisted jtis answers that check
+instead. The set is loaded from the table on first use and extended as
+this process blacklists tokens.
+
+A token the set does not know may still have been blacklisted by another
+process. Rotation blacklists the presented token with get_or_create, so
+finding it already blacklisted rejects the refresh. A replayed token is
+refused without the separate lookup.
+
+prune_expired() (manage.py prune_token_blacklist) keeps both tables
+bounded to tokens that have not expired yet.
+"""
+
+import threading
+import time
+
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+MIN_PURGE_SIZE = 1024
+
+
+class BlacklistFilter:
+    """The jtis of unexpired blacklisted tokens, with their expiry times"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._expiry = None
+        self._next_purge = MIN_PURGE_SIZE
+
+    def load(self, now=None):
+        """Rebuild from the blacklist table"""
+        from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+        rows = (
+            BlacklistedToken.objects.filter(token__expires_at__gt=now or timezone.now())
+            .values_list('token__jti', 'token__expires_at')
+        )
+        expiry = {jti: expires_at.timestamp() for jti, expires_at in rows.iterator()}
+        with self._lock:
+            self._expiry = expiry
+            self._next_purge = max(2 * len(expiry), MIN_PURGE_SIZE)
+
+    def contains(self, jti):
+        if self._expiry is None:
+            self.load()
+        return jti in self._expiry
+
+    def add(self, jti, exp):
+        if self._expiry is None:
+            self.load()
+        with self._lock:
+            self._expiry[jti] = exp
+            if len(self._expiry) >= self._next_purge:
+                self._discard_expired(time.time())
+
+    def discard_expired(self, now=None):
+        with self._lock:
+            if self._expiry is not None:
+                self._discard_expired(time.time() if now is None else now)
+
+    def _discard_expired(self, now):
+        self._expiry = {jti: exp for jti, exp in self._expiry.items() if exp > now}
+        self._next_purge = max(2 * len(self._expiry), MIN_PURGE_SIZE)
+
+    def clear(self):
+        """Forget everything; the next check reloads from the table"""
+        with self._lock:
+            self._expiry = None
+
+    def __len__(self):
+        return len(self._expiry or ())
+
+
+blacklist_filter = BlacklistFilter()
+
+
+def rotation_blacklists():
+    return api_settings.ROTATE_REFRESH_TOKENS and api_settings.BLACKLIST_AFTER_ROTATION
+
+
+class FilteredRefreshToken(RefreshToken):
+    """
+    A refresh token checked against blacklist_filter.
+
+    Only safe where the token is then rotated with blacklisting, as
+    RefreshTokenSerializer does; other uses get simplejwt's table lookup.
+    """
+
+    def check_blacklist(self):
+        if not rotation_blacklists():
+            return super().check_blacklist()
+        if blacklist_filter.contains(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        blacklisted, created = super().blacklist()
+        blacklist_filter.add(self.payload[api_settings.JTI_CLAIM], self.payload['exp'])
+        if not created:
+            # Blacklisted elsewhere since the filter was loaded: a replay
+            raise TokenError(_("Token is blacklisted"))
+        return blacklisted, created
+
+
+class RefreshTokenSerializer(TokenRefreshSerializer):
+    """TokenRefreshSerializer using the blacklist filter (SIMPLE_JWT TOKEN_REFRESH_SERIALIZER)"""
+
+    token_class = FilteredRefreshToken
+
+
+def prune_expired(batch_size=1000, now=None):
+    """
+    Delete expired outstanding and blacklisted tokens in batches.
+
+    Small batches keep each delete's locks short on a busy database.
+    Returns (outstanding, blacklisted) counts deleted.
+    """
+    from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+    now = now or timezone.now()
+    outstanding = blacklisted = 0
+    while True:
+        ids = list(
+            OutstandingToken.objects.filter(expires_at__lte=now)
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        blacklisted += BlacklistedToken.objects.filter(token_id__in=ids).delete()[0]
+        outstanding += OutstandingToken.objects.filter(id__in=ids).delete()[0]
+
+    blacklist_filter.discard_expired(now.timestamp())
+    return outstanding, blacklisted
@@ -5,3 +5,12 @@ class WorkoutSerializer(serializers.ModelSerializer):
     class Meta:
         model = Workout
         fields = '__all__'
+
+class WorkoutInputSerializer(serializers.Serializer):
+    """Validates one submitted workout, with the same defaults as WorkoutView"""
+    activity_type = serializers.CharField(max_length=50, default='run')
+    duration = serializers.FloatField(min_value=0, default=30)
+    distance = serializers.FloatField(min_value=0, required=False, allow_null=True, default=None)
+    heart_rate_avg = serializers.FloatField(min_value=0, required=False, allow_null=True, default=None)
+    heart_rate_max = serializers.FloatField(min_value=0, required=False, allow_null=True, default=None)
+    intensity = serializers.ChoiceField(choices=['low', 'moderate', 'high'], default='moderate')
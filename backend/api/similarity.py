@@ -0,0 +1,260 @@
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+
+class NumpySimilarityIndex:
+    """
+    Append-only, memory-mapped float32 embedding store with exact per-user search.
+
+    Embeddings live in a raw float32 file (one row per workout) that is
+    memory-mapped for reads; row metadata lives in a JSON-lines file next to
+    it. Each user's rows are tracked as a list of [start, stop) ranges, so a
+    query only reads that user's slices of the matrix. compact() rewrites
+    the files so every user occupies a single contiguous range.
+
+    Several processes can share one path: appends and compaction hold an
+    exclusive flock on index.lock, row numbers are line numbers in the
+    records file, and reads first pick up rows other processes added.
+
+    query/add/upsert follow the ChromaDB collection call signatures used by
+    find_similar_workouts and store_workouts_in_chroma, so either backend can
+    be passed to them.
+    """
+
+    def __init__(self, path, dim, metric='cosine'):
+        if metric not in ('cosine', 'l2'):
+            raise ValueError(f"Unsupported similarity metric: {metric}")
+        self.path = Path(path)
+        self.dim = dim
+        self.metric = metric
+        self.vectors_path = self.path / 'embeddings.f32'
+        self.records_path = self.path / 'records.jsonl'
+        self.lock_path = self.path / 'index.lock'
+        self._row_bytes = dim * np.dtype(np.float32).itemsize
+        self._lock = threading.RLock()
+        self._load()
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._records)
+
+    @contextmanager
+    def _file_lock(self, exclusive):
+        # Serializes writers across processes (the outbox worker, MCP store
+        # tools); readers take it shared while catching up with the files
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _reset(self):
+        self._records = []
+        self._rows = {}
+        self._user_ranges = {}
+        self._matrix = None
+        self._records_offset = 0
+        self._records_stat = None
+
+    def _load(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        with self._lock, self._file_lock(exclusive=True):
+            self._reset()
+            self._read_new_records()
+            self._trim()
+
+    def _files_changed(self):
+        try:
+            stat = os.stat(self.records_path)
+        except FileNotFoundError:
+            return self._records_stat is not None
+        return self._records_stat != (stat.st_ino, stat.st_size)
+
+    def _refresh(self):
+        """Pick up rows appended (or a compaction done) by other processes"""
+        if self._files_changed():
+            with self._file_lock(exclusive=False):
+                self._read_new_records()
+
+    def _read_new_records(self):
+        # Call with the file lock held. Row numbers are line numbers in
+        # records.jsonl, which every writer appends to under the lock.
+        try:
+            stat = os.stat(self.records_path)
+        except FileNotFoundError:
+            if self._records_stat is not None:
+                self._reset()
+            return
+        if self._records_stat is not None and (
+                self._records_stat[0] != stat.st_ino or stat.st_size < self._records_offset):
+            self._reset()  # Replaced by compact()
+
+        if stat.st_size > self._records_offset:
+            with open(self.records_path, 'rb') as f:
+                f.seek(self._records_offset)
+                data = f.read(stat.st_size - self._records_offset)
+            start = len(self._records)
+            for line in data.splitlines(keepends=True):
+                if not line.endswith(b'\n'):
+                    break  # Torn write at the end of the file
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                self._records.append(record)
+                self._records_offset += len(line)
+            for row in range(start, len(self._records)):
+                self._index_row(row, self._records[row])
+
+        self._records_stat = (stat.st_ino, stat.st_size)
+        self._remap()
+
+    def _remap(self):
+        # Mapped while the file lock is held, so records and vectors agree
+        count = len(self._records)
+        if count == 0:
+            self._matrix = np.empty((0, self.dim), dtype=np.float32)
+        elif self._matrix is None or self._matrix.shape[0] != count:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(count, self.dim))
+
+    def _trim(self):
+        """Drop the tail of an interrupted append (call with the exclusive lock)"""
+        stored_rows = self.vectors_path.stat().st_size // self._row_bytes if self.vectors_path.exists() else 0
+        if stored_rows < len(self._records):
+            # Metadata without its vector: rewrite the records that have one
+            self._write_records(self._records[:stored_rows])
+            self._reset()
+            self._read_new_records()
+        if self.records_path.exists() and self.records_path.stat().st_size > self._records_offset:
+            with open(self.records_path, 'ab') as f:
+                f.truncate(self._records_offset)
+            self._records_stat = (self._records_stat[0], self._records_offset)
+        # Rows without metadata are dropped
+        if self.vectors_path.exists() and self.vectors_path.stat().st_size != len(self._records) * self._row_bytes:
+            self._matrix = None
+            with open(self.vectors_path, 'ab') as f:
+                f.truncate(len(self._records) * self._row_bytes)
+            self._remap()
+
+    def _write_records(self, records):
+        tmp = self.records_path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        os.replace(tmp, self.records_path)
+
+    def _index_row(self, row, record):
+        self._rows[record['id']] = row
+        ranges = self._user_ranges.setdefault(str(record.get('user_id')), [])
+        if ranges and ranges[-1][1] == row:
+            ranges[-1][1] = row + 1
+        else:
+            ranges.append([row, row + 1])
+
+    def _vectors(self):
+        self._refresh()
+        return self._matrix
+
+    def upsert(self, ids, embeddings, metadatas=None, documents=None):
+        """Append rows for ids not indexed yet; stored rows are immutable"""
+        metadatas = metadatas or [{} for _ in ids]
+        with self._lock, self._file_lock(exclusive=True):
+            # Catch up first, so ids other processes stored are skipped and
+            # the new rows are numbered after theirs
+            self._read_new_records()
+            new = []
+            seen = set()
+            for i, workout_id in enumerate(ids):
+                if workout_id not in self._rows and workout_id not in seen:
+                    seen.add(workout_id)
+                    new.append(i)
+            if not new:
+                return
+
+            vectors = np.asarray([embeddings[i] for i in new], dtype=np.float32).reshape(len(new), self.dim)
+            records = [dict(metadatas[i], id=ids[i]) for i in new]
+
+            self._trim()
+            # Vectors first: a row only counts once its metadata line is written
+            with open(self.vectors_path, 'ab') as f:
+                f.write(vectors.tobytes())
+            with open(self.records_path, 'a') as f:
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+            self._read_new_records()
+
+    add = upsert
+
+    def user_rows(self, user_id):
+        """Row numbers of a user's embeddings, in insertion order"""
+        with self._lock:
+            self._refresh()
+        ranges = self._user_ranges.get(str(user_id), [])
+        if not ranges:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(start, stop) for start, stop in ranges])
+
+    def query(self, query_embeddings, n_results=10, where=None):
+        """Exact top-k search, optionally restricted to where={'user_id': ...}"""
+        with self._lock:
+            vectors = self._vectors()
+            user_id = (where or {}).get('user_id')
+            if user_id is None:
+                rows = np.arange(vectors.shape[0])
+                candidates = np.asarray(vectors)
+            else:
+                ranges = self._user_ranges.get(str(user_id), [])
+                rows = self.user_rows(user_id)
+                candidates = (np.concatenate([vectors[start:stop] for start, stop in ranges])
+                              if ranges else np.empty((0, self.dim), dtype=np.float32))
+            records = self._records
+
+        result = {'ids': [], 'metadatas': [], 'distances': []}
+        for query in np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.dim):
+            distances = self._distances(candidates, query)
+            # Ties are broken by row number so results are deterministic
+            order = np.lexsort((rows, distances))[:n_results]
+            result['ids'].append([records[rows[i]]['id'] for i in order])
+            result['metadatas'].append([
+                {k: v for k, v in records[rows[i]].items() if k != 'id'} for i in order
+            ])
+            result['distances'].append(distances[order].astype(float).tolist())
+        return result
+
+    def _distances(self, candidates, query):
+        if self.metric == 'l2':
+            # Squared L2, matching ChromaDB's default space
+            diff = candidates - query
+            return np.einsum('ij,ij->i', diff, diff)
+
+        norms = np.linalg.norm(candidates, axis=1) * np.linalg.norm(query)
+        dots = candidates @ query
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cosine = np.where(norms > 0, dots / norms, 0.0)
+        return 1.0 - cosine
+
+    def compact(self):
+        """Rewrite the store so each user's rows form one contiguous range"""
+        with self._lock, self._file_lock(exclusive=True):
+            self._read_new_records()
+            vectors = np.array(self._matrix)
+            order = sorted(range(len(self._records)),
+                           key=lambda row: (str(self._records[row].get('user_id')), row))
+            records = [self._records[row] for row in order]
+
+            tmp = self.vectors_path.with_suffix('.tmp')
+            with open(tmp, 'wb') as f:
+                f.write(vectors[order].astype(np.float32).tobytes() if order else b'')
+            self._matrix = None
+            os.replace(tmp, self.vectors_path)
+            self._write_records(records)
+            self._reset()
+            self._read_new_records()
@@ -0,0 +1,225 @@
+import logging
+from datetime import datetime, timezone as dt_timezone
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .entitlements import invalidate_on_commit
+from .models import Payment, StripeEvent, Subscription
+from .outbox import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 8
+
+
+def build_event(payload):
+    """Build an unsaved StripeEvent from the decoded event JSON"""
+    obj = payload.get('data', {}).get('object', {})
+    return StripeEvent(
+        event_id=payload['id'],
+        type=payload['type'],
+        object_id=obj.get('id') or '',
+        payload=payload,
+        stripe_created=from_timestamp(payload.get('created')) or timezone.now(),
+    )
+
+
+def record_event(payload):
+    """
+    Store a verified Stripe event (the decoded webhook JSON) for processing.
+
+    Returns False if an event with the same id was already stored, so
+    Stripe's retries are acknowledged without being processed twice.
+    """
+    try:
+        with transaction.atomic():
+            build_event(payload).save()
+    except IntegrityError:
+        return False
+    return True
+
+
+def record_events(payloads, batch_size=500):
+    """Store many events (e.g. for a backfill), skipping ids already stored; returns how many were new"""
+    stored = 0
+    batch = []
+    for payload in payloads:
+        batch.append(payload)
+        if len(batch) >= batch_size:
+            stored += _record_batch(batch)
+            batch = []
+    if batch:
+        stored += _record_batch(batch)
+    return stored
+
+
+def _record_batch(payloads):
+    unique = {payload['id']: payload for payload in payloads}
+    existing = set(StripeEvent.objects.filter(event_id__in=unique).values_list('event_id', flat=True))
+    new = [build_event(payload) for event_id, payload in unique.items() if event_id not in existing]
+    StripeEvent.objects.bulk_create(new, ignore_conflicts=True)
+    return len(new)
+
+
+def requeue_events(queryset):
+    """Reset stored events to pending so the worker applies them again; returns the count"""
+    return queryset.update(status='pending', attempts=0, next_attempt_at=timezone.now(),
+                           last_error='', processed_at=None)
+
+
+def from_timestamp(value):
+    """Convert a Stripe epoch timestamp to an aware datetime"""
+    if value in (None, ''):
+        return None
+    return datetime.fromtimestamp(int(value), tz=dt_timezone.utc)
+
+
+# Handlers receive the event's data.object as a plain dict
+
+def handle_subscription_created(subscription):
+    # Create or update subscription in database
+    metadata = subscription.get('metadata') or {}
+    user_id = metadata.get('user_id')
+    if user_id:
+        user = User.objects.get(id=user_id)
+        Subscription.objects.update_or_create(
+            user=user,
+            defaults={
+                'stripe_subscription_id': subscription['id'],
+                'stripe_customer_id': subscription.get('customer'),
+                'plan': metadata.get('plan', 'premium'),
+                'status': subscription['status'],
+                'current_period_start': from_timestamp(subscription.get('current_period_start')),
+                'current_period_end': from_timestamp(subscription.get('current_period_end')),
+            }
+        )
+        invalidate_on_commit(user.id)
+
+
+def handle_subscription_updated(subscription):
+    # Update subscription status
+    try:
+        sub = Subscription.objects.get(stripe_subscription_id=subscription['id'])
+        sub.status = subscription['status']
+        sub.current_period_start = from_timestamp(subscription.get('current_period_start'))
+        sub.current_period_end = from_timestamp(subscription.get('current_period_end'))
+        sub.cancel_at_period_end = subscription.get('cancel_at_period_end', False)
+        sub.save()
+        invalidate_on_commit(sub.user_id)
+    except Subscription.DoesNotExist:
+        pass
+
+
+def handle_subscription_deleted(subscription):
+    # Mark subscription as canceled
+    try:
+        sub = Subscription.objects.get(stripe_subscription_id=subscription['id'])
+        sub.status = 'canceled'
+        sub.save()
+        invalidate_on_commit(sub.user_id)
+    except Subscription.DoesNotExist:
+        pass
+
+
+def handle_payment_succeeded(payment_intent):
+    # Record successful payment
+    try:
+        payment = Payment.objects.get(stripe_payment_intent_id=payment_intent['id'])
+        charges = (payment_intent.get('charges') or {}).get('data') or []
+        charge = charges[0] if charges else None
+        payment.status = 'succeeded'
+        payment.stripe_charge_id = charge['id'] if charge else payment_intent.get('latest_charge')
+        payment.receipt_url = charge.get('receipt_url') if charge else None
+        payment.save()
+    except Payment.DoesNotExist:
+        pass
+
+
+EVENT_HANDLERS = {
+    'customer.subscription.created': handle_subscription_created,
+    'customer.subscription.updated': handle_subscription_updated,
+    'customer.subscription.deleted': handle_subscription_deleted,
+    'payment_intent.succeeded': handle_payment_succeeded,
+}
+
+
+def apply_event(stored):
+    """Run the handler for a stored event; event types without a handler are a no-op"""
+    handler = EVENT_HANDLERS.get(stored.type)
+    if handler is not None:
+        handler(stored.payload['data']['object'])
+
+
+def process_events(batch_size=100, max_attempts=MAX_ATTEMPTS):
+    """
+    Apply one batch of due events, oldest first (by Stripe's creation time).
+
+    Each event runs in its own savepoint. A failed event is rescheduled with
+    exponential backoff and marked 'failed' after max_attempts; later events
+    for the same object wait until it has been retried, so they are never
+    applied out of order. Returns (processed, failed) counts.
+    """
+    now = timezone.now()
+    processed = failed = 0
+
+    with transaction.atomic():
+        # skip_locked lets several workers process concurrently on Postgres
+        events = list(
+            StripeEvent.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('stripe_created', 'id')[:batch_size]
+        )
+        if not events:
+            return processed, failed
+
+        # Objects with an earlier event still waiting for a retry
+        blocked = {}
+        waiting = (
+            StripeEvent.objects.filter(
+                status='pending', next_attempt_at__gt=now,
+                object_id__in={event.object_id for event in events if event.object_id},
+            )
+            .order_by('stripe_created')
+            .values_list('object_id', 'stripe_created', 'next_attempt_at')
+        )
+        for object_id, created, next_attempt_at in waiting:
+            blocked.setdefault(object_id, (created, next_attempt_at))
+
+        done = []
+        retry = []
+        for event in events:
+            blocker = blocked.get(event.object_id) if event.object_id else None
+            if blocker is not None and blocker[0] <= event.stripe_created:
+                event.next_attempt_at = blocker[1]
+                retry.append(event)
+                continue
+
+            try:
+                with transaction.atomic():
+                    apply_event(event)
+                event.status = 'processed'
+                event.processed_at = timezone.now()
+                event.last_error = ''
+                done.append(event)
+            except Exception as e:
+                logger.warning("Failed to process Stripe event %s (%s): %s", event.event_id, event.type, e)
+                event.attempts += 1
+                event.last_error = str(e)
+                event.next_attempt_at = now + backoff_delay(event.attempts)
+                if event.attempts >= max_attempts:
+                    event.status = 'failed'
+                elif event.object_id:
+                    blocked.setdefault(event.object_id, (event.stripe_created, event.next_attempt_at))
+                retry.append(event)
+                failed += 1
+
+        if done:
+            StripeEvent.objects.bulk_update(done, ['status', 'processed_at', 'last_error'])
+        if retry:
+            StripeEvent.objects.bulk_update(retry, ['attempts', 'last_error', 'next_attempt_at', 'status'])
+
+        processed = len(done)
+
+    return processed, failed
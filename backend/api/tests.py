@@ -1,3 +1,1443 @@
-from django.test import TestCase
+import asyncio
+import fcntl
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest.mock import patch
 
-# Create your tests here.
+import chromadb
+import numpy as np
+
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from . import (authentication, chroma_setup, entitlements, fake_stripe, mcp_server, payments, recommendations,
+               refresh_tokens, trends)
+from .exports import EXPORT_FIELDS, iter_chunks
+from .models import ChromaOutbox, Payment, StripeEvent, Subscription, UserProfile, Workout
+from .outbox import drain_outbox, enqueue_workouts
+from .similarity import NumpySimilarityIndex
+from .stripe_events import process_events, record_event, record_events
+from .pagination import InvalidCursor, decode_cursor, encode_cursor
+from .result_cache import ResultCache
+from .vo2max_utils import estimate_vo2max_batch, estimate_vo2max_from_workout
+
+
+class ChromaTestMixin:
+    """Gives each test fresh in-memory ChromaDB collections and its own CHROMA_DB_PATH (for the lock file)"""
+
+    def setUp(self):
+        super().setUp()
+        self.chroma_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.chroma_path)
+        chroma_path = override_settings(CHROMA_DB_PATH=self.chroma_path)
+        chroma_path.enable()
+        self.addCleanup(chroma_path.disable)
+        self.chroma = chromadb.EphemeralClient()
+        self.collections = chroma_setup.create_collections(self.chroma)
+        self.addCleanup(self.drop_collections)
+        # Cached MCP tool results must not leak between tests
+        mcp_server.tool_cache.clear()
+
+    def drop_collections(self):
+        for collection in self.collections.values():
+            self.chroma.delete_collection(collection.name)
+
+    def make_workouts(self, count, start=0, **overrides):
+        activities = ['run', 'cycle', 'walk']
+        intensities = ['low', 'moderate', 'high']
+        workouts = []
+        for i in range(start, start + count):
+            workout = {
+                'id': str(i),
+                'activity_type': activities[i % 3],
+                'duration': 20 + i,
+                'distance': 3 + i % 5,
+                'heart_rate_avg': 130 + i % 20,
+                'heart_rate_max': 170 + i % 20,
+                'intensity': intensities[i % 3],
+                'date': f'2026-01-{i % 28 + 1:02d}T07:00:00',
+                'vo2max_estimate': 30 + i % 15,
+            }
+            workout.update(overrides)
+            workouts.append(workout)
+        return workouts
+
+    def date_recent(self, workouts, days_apart=1):
+        """Re-date workouts to end today, oldest first"""
+        now = timezone.now()
+        for i, workout in enumerate(workouts):
+            workout['date'] = (now - timedelta(days=(len(workouts) - 1 - i) * days_apart)).isoformat()
+        return workouts
+
+
+class WorkoutListPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='runner', password='pass12345')
+        UserProfile.objects.create(user=self.user, age=30, gender='male', weight='70', height='175')
+        for i in range(5):
+            Workout.objects.create(user=self.user, activity_type='run', duration=30, distance=5 + i)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_pages_cover_history_without_overlap(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {'limit': 2}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.client.get('/api/workouts/', params)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(w['id'] for w in response.data['results'])
+            cursor = response.data['next']
+            if not cursor:
+                break
+
+        expected = list(Workout.objects.order_by('-date', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_all_returns_legacy_list(self):
+        response = self.client.get('/api/workouts/', {'all': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 5)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/api/workouts/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_round_trip(self):
+        workout = Workout.objects.first()
+        self.assertEqual(decode_cursor(encode_cursor(workout.date, workout.id)), (workout.date, workout.id))
+        with self.assertRaises(InvalidCursor):
+            decode_cursor('e30')
+
+
+class StoredVO2MaxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='runner', password='pass12345')
+        self.profile = UserProfile.objects.create(user=self.user, age=30, gender='male', weight='70', height='175')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_submit_stores_estimate(self):
+        response = self.client.post('/api/workouts/submit/', {
+            'activity_type': 'run', 'duration': 12, 'distance': 2.8,
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        workout = Workout.objects.get(id=response.data['workout']['id'])
+        self.assertEqual(workout.vo2max_estimate, response.data['vo2max_estimate'])
+
+    def test_profile_change_recomputes_estimates(self):
+        workout = Workout.objects.create(user=self.user, activity_type='cycle', duration=40)
+        self.profile.recompute_vo2max_estimates()
+        workout.refresh_from_db()
+        before = workout.vo2max_estimate
+
+        profile = UserProfile.objects.get(user=self.user)
+        profile.age = 60
+        profile.save()
+        workout.refresh_from_db()
+        self.assertLess(workout.vo2max_estimate, before)
+
+    def test_backfill_command_fills_missing_rows(self):
+        Workout.objects.create(user=self.user, activity_type='run', duration=12, distance=3)
+        call_command('backfill_vo2max', stdout=StringIO())
+        self.assertFalse(Workout.objects.filter(vo2max_estimate__isnull=True).exists())
+
+    def test_profile_numeric_accessors(self):
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual((profile.weight_kg, profile.height_cm), (70.0, 175.0))
+        profile.weight = 'n/a'
+        profile.height = ''
+        self.assertEqual((profile.weight_kg, profile.height_cm), (None, None))
+
+
+class BatchVO2MaxEquivalenceTests(SimpleTestCase):
+    def assert_matches_scalar(self, rows):
+        expected = [
+            estimate_vo2max_from_workout(
+                SimpleNamespace(distance=d, duration=t, activity_type=a, max_heart_rate=hr),
+                SimpleNamespace(age=age, gender=g),
+            )
+            for d, t, a, hr, age, g in rows
+        ]
+        columns = list(zip(*rows))
+        actual = estimate_vo2max_batch(*columns)
+        np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-9)
+
+    def test_random_grid(self):
+        rng = np.random.default_rng(42)
+        rows = []
+        for _ in range(2000):
+            rows.append((
+                rng.choice([None, 0, float(rng.uniform(0.1, 25))]),
+                float(rng.choice([12, rng.uniform(1, 180)])),
+                str(rng.choice(['run', 'cycle', 'walk', 'swim'])),
+                rng.choice([None, float(rng.uniform(90, 210))]),
+                rng.choice([None, 0, int(rng.integers(15, 90))]),
+                str(rng.choice(['male', 'female', 'other'])),
+            ))
+        self.assert_matches_scalar(rows)
+
+    def test_edge_cases(self):
+        self.assert_matches_scalar([
+            (5.0, 0, 'run', None, 30, 'male'),        # zero duration falls back to 35
+            (0.1, 60, 'run', 180, 30, 'female'),      # clamps to the 15 floor
+            (20.0, 12, 'run', None, 30, 'male'),      # clamps to the 80 ceiling
+            (None, 30, 'run', 190, 40, 'other'),      # no distance uses heart rate
+            (5.0, 30, 'cycle', None, None, 'male'),   # no data at all
+            (3.0, 12, 'run', None, None, None),       # Cooper without a profile
+        ])
+
+    def test_scalar_profile_broadcasts(self):
+        estimates = estimate_vo2max_batch([5.0, None], [30, 40], ['run', 'walk'], [None, 180], 35, 'female')
+        self.assertEqual(estimates.shape, (2,))
+
+    def test_empty_input(self):
+        self.assertEqual(estimate_vo2max_batch([], [], [], [], 30, 'male').shape, (0,))
+
+
+class QueryPlanTests(ChromaTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = patch('api.chroma_setup.get_collections', return_value=self.collections)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Cached entitlements of earlier tests' users must not be served to this one
+        entitlements.clear_cache()
+        self.addCleanup(entitlements.clear_cache)
+        self.user = User.objects.create_user(username='runner', password='pass12345')
+        UserProfile.objects.create(user=self.user, age=30, gender='male', weight='70', height='175')
+        Subscription.objects.create(user=self.user)
+        for i in range(30):
+            Workout.objects.create(user=self.user, activity_type='run', duration=30, distance=5, vo2max_estimate=40.0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_workout_history_uses_user_date_index(self):
+        plan = Workout.objects.filter(user=self.user).order_by('-date', '-id')[:21].explain()
+        self.assertIn('workout_user_date_idx', plan)
+
+    def test_activity_history_uses_user_activity_index(self):
+        plan = Workout.objects.filter(user=self.user, activity_type='run').order_by('-date')[:20].explain()
+        self.assertIn('workout_user_activity_date_idx', plan)
+
+    def test_payment_history_uses_user_created_index(self):
+        plan = Payment.objects.filter(user=self.user).order_by('-created_at')[:20].explain()
+        self.assertIn('payment_user_created_idx', plan)
+
+    def test_workout_list_page_is_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/workouts/', {'limit': 10})
+        self.assertEqual(len(response.data['results']), 10)
+
+    def test_workout_list_query_count_does_not_grow_with_history(self):
+        with self.assertNumQueries(1):
+            self.client.get('/api/workouts/', {'all': 'true'})
+
+    def test_subscription_status_is_one_query(self):
+        with self.assertNumQueries(1):
+            self.client.get('/api/subscription/status/')
+        # Then served from the entitlement cache
+        with self.assertNumQueries(0):
+            self.client.get('/api/subscription/status/')
+
+    def test_bulk_create_query_count_does_not_grow_with_batch(self):
+        for size in (1, 50):
+            payload = [{'activity_type': 'run', 'duration': 30, 'distance': 5}] * size
+            # Profile, workout insert and outbox insert, plus the atomic block's savepoint
+            with self.assertNumQueries(5):
+                response = self.client.post('/api/workouts/bulk/', payload, format='json')
+            self.assertEqual(len(response.data['created']), size)
+
+    def test_export_query_count_does_not_grow_with_history(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/workouts/export/', {'output': 'csv'})
+            body = b''.join(response.streaming_content)
+        self.assertEqual(body.count(b'\n'), 31)
+
+    def test_similar_athletes_makes_no_queries(self):
+        chroma_setup.store_workouts_in_chroma(self.collections['workouts'], self.make_workouts(3), str(self.user.id),
+                                              patterns_collection=self.collections['user_patterns'])
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/athletes/similar/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_recommendations_make_no_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/recommendations/', {'goals': 'lose_weight'})
+        self.assertEqual(response.status_code, 200)
+
+
+class WorkoutBulkTests(ChromaTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='runner', password='pass12345')
+        UserProfile.objects.create(user=self.user, age=30, gender='male', weight='70', height='175')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_bulk_creates_valid_items_and_reports_errors(self):
+        payload = [
+            {'activity_type': 'run', 'duration': 12, 'distance': 2.8, 'heart_rate_max': 185},
+            {'activity_type': 'cycle', 'duration': 'long'},
+            {'activity_type': 'walk', 'duration': 45, 'intensity': 'low'},
+            {'intensity': 'extreme'},
+        ]
+        response = self.client.post('/api/workouts/bulk/', payload, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c['index'] for c in response.data['created']], [0, 2])
+        self.assertEqual([e['index'] for e in response.data['errors']], [1, 3])
+        self.assertTrue(response.data['ai_queued'])
+        self.assertEqual(Workout.objects.filter(user=self.user).count(), 2)
+        self.assertFalse(Workout.objects.filter(vo2max_estimate__isnull=True).exists())
+        self.assertEqual(self.collections['workouts'].count(), 0)
+
+        # The worker writes the batch and updates the user's pattern snapshot
+        with patch('api.chroma_setup.get_collections', return_value=self.collections):
+            self.assertEqual(drain_outbox(), (2, 0))
+        self.assertEqual(self.collections['workouts'].count(), 2)
+        summary = chroma_setup.load_pattern_summary(self.collections['user_patterns'], str(self.user.id))
+        self.assertEqual(summary['total_workouts'], 2)
+
+    def test_heart_rates_are_stored_like_single_submissions(self):
+        values = [(150, 180.5), ('150', '180.5'), (150.0, 0)]
+        for heart_rate_avg, heart_rate_max in values:
+            item = {'activity_type': 'run', 'duration': 30, 'distance': 5,
+                    'heart_rate_avg': heart_rate_avg, 'heart_rate_max': heart_rate_max}
+            self.client.post('/api/workouts/submit/', item, format='json')
+            self.client.post('/api/workouts/bulk/', [item], format='json')
+
+        stored = [(w.heart_rate_avg, w.heart_rate_max) for w in Workout.objects.order_by('id')]
+        self.assertEqual(stored, [('150', '180.5')] * 4 + [('150', None)] * 2)
+
+    def test_bulk_rejects_non_list(self):
+        response = self.client.post('/api/workouts/bulk/', {'workouts': 'nope'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class WorkoutExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='runner', password='pass12345')
+        for i in range(7):
+            Workout.objects.create(user=self.user, activity_type='run', duration=30, distance=5,
+                                   heart_rate_avg='150', vo2max_estimate=42.0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def read(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_ndjson_export(self):
+        response = self.client.get('/api/workouts/export/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self.read(response).decode().splitlines()]
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[0]['heart_rate_avg'], 150.0)
+
+    def test_csv_export(self):
+        response = self.client.get('/api/workouts/export/', {'output': 'csv'})
+        lines = self.read(response).decode().splitlines()
+        self.assertEqual(lines[0].split(','), EXPORT_FIELDS)
+        self.assertEqual(len(lines), 8)
+
+    def test_gzip_export(self):
+        response = self.client.get('/api/workouts/export/', {'gzip': 'true'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        lines = gzip.decompress(self.read(response)).decode().splitlines()
+        self.assertEqual(len(lines), 7)
+
+    def test_chunks_are_bounded(self):
+        chunks = list(iter_chunks(Workout.objects.order_by('id'), chunk_size=3))
+        self.assertEqual([len(c) for c in chunks], [3, 3, 1])
+
+    def test_unknown_output_is_rejected(self):
+        response = self.client.get('/api/workouts/export/', {'output': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ChromaClientRegistryTests(SimpleTestCase):
+    def setUp(self):
+        chroma_setup.reset_collections()
+        self.addCleanup(chroma_setup.reset_collections)
+
+    @patch('api.chroma_setup.chromadb.PersistentClient')
+    def test_collections_are_built_once(self, persistent_client):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        with override_settings(CHROMA_DB_PATH=tmp):
+            first = chroma_setup.get_collections()
+            second = chroma_setup.get_collections()
+
+        self.assertIs(first, second)
+        persistent_client.assert_called_once_with(path=tmp)
+
+    @patch('api.chroma_setup.chromadb.PersistentClient')
+    def test_reset_reconnects(self, persistent_client):
+        first = chroma_setup.get_collections()
+        chroma_setup.reset_collections()
+        chroma_setup.get_collections()
+
+        self.assertEqual(persistent_client.call_count, 2)
+        self.assertIsNotNone(first)
+
+
+class ChromaOutboxTests(ChromaTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='runner', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_submit_queues_workout_instead_of_writing_chroma(self):
+        with patch('api.chroma_setup.get_collections') as get_collections:
+            response = self.client.post('/api/workouts/submit/', {'activity_type': 'walk', 'duration': 30}, format='json')
+            get_collections.assert_not_called()
+
+        self.assertFalse(response.data['ai_stored'])
+        self.assertTrue(response.data['ai_queued'])
+        self.assertEqual(ChromaOutbox.objects.filter(workout_id=response.data['workout']['id']).count(), 1)
+
+    def test_drain_stores_and_clears_entries(self):
+        workout = Workout.objects.create(user=self.user, activity_type='run', duration=30, heart_rate_avg='140')
+        enqueue_workouts([workout])
+
+        with patch('api.chroma_setup.get_collections', return_value=self.collections):
+            call_command('drain_chroma_outbox', stdout=StringIO())
+
+        self.assertFalse(ChromaOutbox.objects.exists())
+        stored = self.collections['workouts'].get(ids=[f'{self.user.id}_{workout.id}'])
+        self.assertEqual(stored['metadatas'][0]['heart_rate_avg'], 140.0)
+
+    @patch('api.chroma_setup.get_collections', side_effect=RuntimeError('chroma down'))
+    def test_failed_entries_back_off_and_give_up(self, get_collections):
+        workout = Workout.objects.create(user=self.user, activity_type='run', duration=30)
+        enqueue_workouts([workout])
+
+        with self.assertLogs('api.outbox', 'WARNING'):
+            self.assertEqual(drain_outbox(), (0, 1))
+        entry = ChromaOutbox.objects.get()
+        self.assertEqual(entry.attempts, 1)
+        self.assertEqual(entry.last_error, 'chroma down')
+        self.assertGreater(entry.next_attempt_at, timezone.now())
+
+        # Not due yet, so the next drain leaves it alone
+        self.assertEqual(drain_outbox(), (0, 0))
+
+        ChromaOutbox.objects.update(next_attempt_at=timezone.now())
+        with self.assertLogs('api.outbox', 'WARNING'):
+            drain_outbox(max_attempts=2)
+        self.assertEqual(ChromaOutbox.objects.get().status, 'failed')
+
+
+class WorkoutEmbeddingBatchTests(SimpleTestCase):
+    def test_matches_scalar_embedding(self):
+        rng = np.random.default_rng(7)
+        workouts = []
+        for i in range(500):
+            workout = {
+                'duration': float(rng.uniform(0, 240)),
+                'distance': float(rng.choice([0, rng.uniform(0, 50)])),
+                'heart_rate_avg': float(rng.uniform(0, 200)),
+                'heart_rate_max': float(rng.uniform(0, 220)),
+                'activity_type': str(rng.choice(['run', 'cycle', 'walk', 'swim', 'yoga'])),
+                'intensity': str(rng.choice(['low', 'moderate', 'high', 'extreme'])),
+                'vo2max_estimate': float(rng.uniform(15, 80)),
+            }
+            if i % 10 == 0:
+                del workout['vo2max_estimate']
+            workouts.append(workout)
+
+        matrix = chroma_setup.create_workout_embeddings(workouts)
+        expected = np.array([chroma_setup.create_workout_embedding(w) for w in workouts], dtype=np.float32)
+
+        self.assertEqual(matrix.shape, (500, 10))
+        self.assertEqual(matrix.dtype, np.float32)
+        np.testing.assert_array_equal(matrix, expected)
+
+    def test_empty_batch(self):
+        self.assertEqual(chroma_setup.create_workout_embeddings([]).shape, (0, 10))
+
+
+class PatternSnapshotTests(ChromaTestMixin, SimpleTestCase):
+    def store(self, workouts, user_id='1'):
+        return chroma_setup.store_workouts_in_chroma(
+            self.collections['workouts'], workouts, user_id, upsert=True,
+            patterns_collection=self.collections['user_patterns'],
+        )
+
+    def test_snapshot_matches_full_scan(self):
+        self.store(self.make_workouts(7))
+        self.store(self.make_workouts(5, start=7))
+
+        recent = [{'id': 'x'}]
+        snapshot = chroma_setup.analyze_user_patterns(
+            self.collections['workouts'], '1', recent, self.collections['user_patterns'])
+        scan = chroma_setup.analyze_user_patterns(self.collections['workouts'], '1', recent)
+
+        self.assertEqual(snapshot['stats']['total_workouts'], 12)
+        self.assertEqual(sorted(snapshot['stats']['activity_types']), sorted(scan['stats']['activity_types']))
+        self.assertAlmostEqual(snapshot['stats']['avg_intensity'], scan['stats']['avg_intensity'])
+        self.assertEqual(snapshot['insights'], scan['insights'])
+        self.assertEqual(snapshot['recommendations'], scan['recommendations'])
+
+    def test_restoring_workouts_does_not_double_count(self):
+        workouts = self.make_workouts(3)
+        self.store(workouts)
+        self.store(workouts)
+
+        summary = chroma_setup.load_pattern_summary(self.collections['user_patterns'], '1')
+        self.assertEqual(summary['total_workouts'], 3)
+
+    def test_snapshot_writes_wait_for_other_processes(self):
+        self.store(self.make_workouts(2))
+        # Another process (a second outbox worker) holds the snapshot lock
+        with open(os.path.join(self.chroma_path, 'pattern_snapshots.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            writer = threading.Thread(target=self.store, args=(self.make_workouts(3, start=2),))
+            writer.start()
+            writer.join(0.5)
+            self.assertTrue(writer.is_alive())
+            self.assertEqual(self.collections['workouts'].count(), 2)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        writer.join()
+
+        summary = chroma_setup.load_pattern_summary(self.collections['user_patterns'], '1')
+        self.assertEqual(summary['total_workouts'], 5)
+
+    def test_missing_snapshot_is_rebuilt_from_history(self):
+        chroma_setup.store_workouts_in_chroma(self.collections['workouts'], self.make_workouts(4), '2')
+        self.assertIsNone(chroma_setup.load_pattern_summary(self.collections['user_patterns'], '2'))
+
+        summary = chroma_setup.get_user_pattern_summary(
+            self.collections['user_patterns'], self.collections['workouts'], '2')
+        self.assertEqual(summary['total_workouts'], 4)
+        self.assertIsNotNone(chroma_setup.load_pattern_summary(self.collections['user_patterns'], '2'))
+
+
+class NumpySimilarityIndexTests(ChromaTestMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.index = NumpySimilarityIndex(self.tmp, dim=chroma_setup.EMBEDDING_DIM)
+
+    def store(self, workouts, user_id):
+        chroma_setup.store_workouts_in_chroma(
+            self.collections['workouts'], workouts, user_id, similarity_index=self.index)
+
+    def test_top_k_matches_brute_force(self):
+        self.store(self.make_workouts(40), '1')
+        self.store(self.make_workouts(40, start=40), '2')
+        self.store(self.make_workouts(10, start=80), '1')
+
+        query = chroma_setup.create_workout_embedding(self.make_workouts(1, start=5)[0])
+        result = self.index.query(query_embeddings=[query], n_results=5, where={'user_id': '1'})
+
+        user_rows = self.index.user_rows('1')
+        vectors = np.fromfile(self.index.vectors_path, dtype=np.float32).reshape(-1, 10)[user_rows]
+        q = np.asarray(query, dtype=np.float32)
+        cosine = vectors @ q / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(q))
+        expected = [self.index._records[user_rows[i]]['id'] for i in np.argsort(-cosine, kind='stable')[:5]]
+
+        self.assertEqual(result['ids'][0], expected)
+        self.assertTrue(all(m['user_id'] == '1' for m in result['metadatas'][0]))
+
+    def test_find_similar_workouts_accepts_index(self):
+        workouts = self.make_workouts(12)
+        self.store(workouts, '1')
+        embedding = chroma_setup.create_workout_embedding(workouts[3])
+
+        similar = chroma_setup.find_similar_workouts(self.index, embedding, '1', n_results=3)
+
+        self.assertEqual(len(similar), 3)
+        self.assertEqual(similar[0]['workout_id'], '1_3')
+        self.assertAlmostEqual(similar[0]['similarity_score'], 1.0, places=5)
+
+    def test_reload_and_duplicate_ids(self):
+        workouts = self.make_workouts(5)
+        self.store(workouts, '1')
+        self.index.upsert(['1_0'], [[0.0] * 10], [{'user_id': '1'}])
+
+        reloaded = NumpySimilarityIndex(self.tmp, dim=chroma_setup.EMBEDDING_DIM)
+        self.assertEqual(len(reloaded), 5)
+        self.assertEqual(reloaded.user_rows('1').tolist(), [0, 1, 2, 3, 4])
+
+    def test_interrupted_append_is_dropped_on_load(self):
+        self.store(self.make_workouts(3), '1')
+        with open(self.index.vectors_path, 'ab') as f:
+            f.write(np.zeros(10, dtype=np.float32).tobytes())
+
+        reloaded = NumpySimilarityIndex(self.tmp, dim=chroma_setup.EMBEDDING_DIM)
+        self.assertEqual(len(reloaded), 3)
+        self.assertEqual(os.path.getsize(reloaded.vectors_path), 3 * 10 * 4)
+
+    def test_instances_on_one_path_share_rows(self):
+        # As the outbox worker and the MCP server do, from separate processes
+        writer = NumpySimilarityIndex(self.tmp, dim=10, metric='l2')
+        reader = NumpySimilarityIndex(self.tmp, dim=10, metric='l2')
+        writer.upsert(['1_a'], [[1.0] * 10], [{'user_id': '1'}])
+        self.assertEqual(len(reader), 1)
+
+        # 1_a is already stored, so only 1_b is appended, after writer's row
+        reader.upsert(['1_b', '1_a'], [[0.0] * 10, [5.0] * 10], [{'user_id': '1'}, {'user_id': '1'}])
+        writer.upsert(['1_c'], [[2.0] * 10], [{'user_id': '1'}])
+
+        expected = {'1_b': 0.0, '1_a': 10.0, '1_c': 40.0}
+        for index in (writer, reader):
+            result = index.query([[0.0] * 10], n_results=3, where={'user_id': '1'})
+            self.assertEqual(dict(zip(result['ids'][0], result['distances'][0])), expected)
+
+        reader.compact()
+        result = writer.query([[0.0] * 10], n_results=3)
+        self.assertEqual(dict(zip(result['ids'][0], result['distances'][0])), expected)
+
+    def test_compact_makes_user_ranges_contiguous(self):
+        self.store(self.make_workouts(2), '1')
+        self.store(self.make_workouts(2, start=2), '2')
+        self.store(self.make_workouts(2, start=4), '1')
+        self.assertEqual(len(self.index._user_ranges['1']), 2)
+
+        query = chroma_setup.create_workout_embedding(self.make_workouts(1)[0])
+        before = self.index.query([query], n_results=4, where={'user_id': '1'})
+        self.index.compact()
+
+        self.assertEqual(self.index._user_ranges['1'], [[0, 4]])
+        self.assertEqual(self.index.query([query], n_results=4, where={'user_id': '1'})['ids'], before['ids'])
+
+    def test_backend_is_selected_from_settings(self):
+        with override_settings(SIMILARITY_BACKEND='numpy', SIMILARITY_INDEX_PATH=self.tmp):
+            chroma_setup._similarity_index = None
+            self.addCleanup(setattr, chroma_setup, '_similarity_index', None)
+            self.assertIsInstance(chroma_setup.get_similarity_collection(), NumpySimilarityIndex)
+
+        with override_settings(SIMILARITY_BACKEND='chroma'):
+            self.assertIsNone(chroma_setup.get_similarity_index())
+
+
+class ToolResultCacheTests(ChromaTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = ResultCache(max_entries=2, ttl=60)
+        patcher = patch('api.mcp_server.tool_cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('api.chroma_setup.get_collections', return_value=self.collections)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_lru_eviction_and_ttl(self):
+        now = [0.0]
+        cache = ResultCache(max_entries=2, ttl=10, clock=lambda: now[0])
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+        now[0] = 11
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 2)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_analysis_is_cached_until_the_user_writes(self):
+        user_id = 'cache-user'
+        for workout in self.date_recent(self.make_workouts(3)):
+            mcp_server.run_tool('store_workout_for_analysis', {'user_id': user_id, 'workout_data': workout})
+
+        arguments = {'user_id': user_id, 'metric': 'vo2max'}
+        with patch('api.mcp_server.compute_tool', wraps=mcp_server.compute_tool) as compute:
+            first = mcp_server.run_tool('predict_performance_trends', arguments)
+            self.assertEqual(mcp_server.run_tool('predict_performance_trends', dict(arguments)), first)
+            self.assertEqual(compute.call_count, 1)
+
+            mcp_server.run_tool('store_workout_for_analysis',
+                                {'user_id': user_id, 'workout_data': self.date_recent(self.make_workouts(1, start=3))[0]})
+            self.assertIn('4 measurements', mcp_server.run_tool('predict_performance_trends', arguments))
+            self.assertEqual(compute.call_count, 3)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_writes_from_other_processes_invalidate(self):
+        user_id = 'worker-user'
+        workouts = self.date_recent(self.make_workouts(4))
+        store = lambda batch: chroma_setup.store_workouts_in_chroma(
+            self.collections['workouts'], batch, user_id, upsert=True,
+            patterns_collection=self.collections['user_patterns'])
+        # The outbox worker's write, which shares no memory with the MCP server
+        store(workouts[:3])
+        arguments = {'user_id': user_id, 'metric': 'vo2max'}
+        self.assertIn('3 measurements', mcp_server.run_tool('predict_performance_trends', arguments))
+
+        store(workouts[3:])
+        self.assertIn('4 measurements', mcp_server.run_tool('predict_performance_trends', arguments))
+        self.assertEqual(chroma_setup.user_data_version(self.collections['user_patterns'], user_id), 2)
+
+        # Re-storing an edited workout adds nothing but still changes the version
+        def latest_vo2max():
+            payload = json.loads(mcp_server.run_tool('predict_performance_trends', {**arguments, 'format': 'json'}))
+            return payload['series']['items'][-1][1]
+
+        self.assertEqual(latest_vo2max(), 33)
+        workouts[3]['vo2max_estimate'] = 99
+        store(workouts[3:])
+        self.assertEqual(chroma_setup.user_data_version(self.collections['user_patterns'], user_id), 3)
+        self.assertEqual(latest_vo2max(), 99)
+
+
+class PerformanceTrendTests(ChromaTestMixin, SimpleTestCase):
+    def store(self, workouts, user_id='1'):
+        chroma_setup.store_workouts_in_chroma(self.collections['workouts'], workouts, user_id)
+
+    def test_timestamp_metadata(self):
+        _, _, metadata, _ = chroma_setup.build_workout_record({'date': '2026-03-01T00:00:00Z'}, '1')
+        self.assertEqual(metadata['timestamp'], 1772323200.0)
+        self.assertEqual(chroma_setup.workout_timestamp('2026-03-01T00:00:00'), 1772323200.0)
+
+    def test_only_the_window_is_read(self):
+        old = self.make_workouts(3, vo2max_estimate=60, date='2020-01-01T00:00:00')
+        recent = self.date_recent(self.make_workouts(4, start=3), days_apart=7)
+        self.store(old + recent)
+
+        metadatas = trends.fetch_trend_window(self.collections['workouts'], '1', weeks=12)
+        self.assertEqual(sorted(m['date'] for m in metadatas), sorted(w['date'] for w in recent))
+
+    def test_series_is_date_ordered_and_fitted(self):
+        workouts = self.date_recent(self.make_workouts(6), days_apart=7)
+        for i, workout in enumerate(workouts):
+            workout['vo2max_estimate'] = 40 + i * 0.5
+        # Stored out of order: the fit must not depend on insertion order
+        self.store(workouts[::-1])
+
+        trend = trends.predict_trend(self.collections['workouts'], '1', 'vo2max', weeks=12)
+        self.assertEqual(trend['points'], 6)
+        self.assertEqual(trend['direction'], 'improving')
+        self.assertAlmostEqual(trend['slope_per_week'], 0.5, places=3)
+        self.assertGreater(trend['level'], 41.5)
+
+        declining = trends.fit_trend(np.arange(4) * trends.SECONDS_PER_WEEK, np.array([12.0, 11.0, 10.0, 9.0]), 'speed')
+        self.assertEqual(declining['direction'], 'declining')
+        flat = trends.fit_trend(np.arange(4) * trends.SECONDS_PER_WEEK, np.array([30.0, 30.1, 29.9, 30.0]))
+        self.assertEqual(flat['direction'], 'plateauing')
+
+    def test_metric_series(self):
+        metadatas = [
+            {'timestamp': 2, 'distance': 10, 'duration': 60, 'heart_rate_avg': 150, 'heart_rate_max': 180},
+            {'timestamp': 1, 'distance': 0, 'duration': 30, 'heart_rate_avg': 0, 'heart_rate_max': 175},
+        ]
+        self.assertEqual(trends.metric_series(metadatas, 'speed')[1].tolist(), [10.0])
+        self.assertEqual(trends.metric_series(metadatas, 'endurance')[1].tolist(), [30.0, 60.0])
+        self.assertEqual(trends.metric_series(metadatas, 'heart_rate_recovery')[1].tolist(), [30.0])
+        with self.assertRaises(ValueError):
+            trends.metric_series(metadatas, 'power')
+
+
+class BatchToolTests(ChromaTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = patch('api.chroma_setup.get_collections', return_value=self.collections)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_store_batch_writes_once_and_reports_invalid_items(self):
+        workouts = self.make_workouts(6)
+        items = [{'user_id': str(i % 3), 'workout_data': workout} for i, workout in enumerate(workouts)]
+        items.append({'user_id': '0', 'workout_data': {'id': 'x', 'duration': 10}})
+        items.append({'user_id': '0', 'workout_data': workouts[0]})
+
+        with patch.object(self.collections['workouts'], 'add', wraps=self.collections['workouts'].add) as add:
+            response = mcp_server.run_tool('store_workouts_batch', {'workouts': items})
+
+        self.assertEqual(add.call_count, 1)
+        self.assertIn('Stored 6 workouts', response)
+        self.assertIn('Item 6: missing activity_type', response)
+        self.assertIn('Item 7: duplicate workout id 0', response)
+        self.assertEqual(self.collections['workouts'].count(), 6)
+
+        summaries = chroma_setup.load_pattern_summaries(self.collections['user_patterns'], ['0', '1', '2'])
+        self.assertEqual({user: s['total_workouts'] for user, s in summaries.items()}, {'0': 2, '1': 2, '2': 2})
+
+    def test_batch_analysis_matches_per_user_analysis(self):
+        for user, count in (('a', 2), ('b', 5)):
+            chroma_setup.store_workouts_in_chroma(self.collections['workouts'], self.make_workouts(count), user)
+
+        # Without snapshots every user is read with a single $in query
+        with patch.object(self.collections['workouts'], 'get', wraps=self.collections['workouts'].get) as get:
+            analyses = chroma_setup.analyze_users_patterns(self.collections['workouts'], ['a', 'b', 'c'])
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(analyses['b'], chroma_setup.analyze_user_patterns(
+            self.collections['workouts'], 'b', [{}]))
+        self.assertEqual(analyses['c']['stats']['total_workouts'], 0)
+
+        # Snapshots are built for all users in one pass and then reused
+        with_snapshots = chroma_setup.analyze_users_patterns(
+            self.collections['workouts'], ['a', 'b', 'c'], self.collections['user_patterns'])
+        self.assertEqual(with_snapshots['a']['stats']['total_workouts'], 2)
+        snapshots = self.collections['user_patterns'].get(where={'kind': 'pattern_summary'})
+        self.assertEqual(sorted(snapshots['ids']), ['patterns_a', 'patterns_b'])
+
+        response = mcp_server.run_tool('analyze_users_batch', {'user_ids': ['a', 'b', 'a']})
+        self.assertEqual(response.count('### 👤 User'), 2)
+
+
+class JsonToolOutputTests(ChromaTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = patch('api.chroma_setup.get_collections', return_value=self.collections)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.workouts = self.date_recent(self.make_workouts(12, activity_type='run'))
+        chroma_setup.store_workouts_in_chroma(self.collections['workouts'], self.workouts, 'json-user',
+                                              patterns_collection=self.collections['user_patterns'])
+
+    def call(self, name, **arguments):
+        return json.loads(mcp_server.run_tool(name, {'format': 'json', 'user_id': 'json-user', **arguments}))
+
+    def test_analysis_payload(self):
+        payload = self.call('analyze_workout_patterns', recent_workouts=[{}])
+        self.assertEqual(payload['stats']['total_workouts'], 12)
+        self.assertEqual(payload['stats']['activity_types'], ['run'])
+        self.assertIsInstance(payload['insights'], list)
+
+    def test_similar_workouts_are_paginated(self):
+        first = self.call('find_similar_workouts', workout_data=self.workouts[0], limit=5)
+        self.assertEqual(len(first['results']['items']), 5)
+        self.assertEqual(first['results']['next_offset'], 5)
+
+        last = self.call('find_similar_workouts', workout_data=self.workouts[0], limit=5, offset=10)
+        self.assertEqual(len(last['results']['items']), 2)
+        self.assertIsNone(last['results']['next_offset'])
+        seen = {w['workout_id'] for w in first['results']['items']} | {w['workout_id'] for w in last['results']['items']}
+        self.assertEqual(len(seen), 7)
+
+    def test_trend_series_is_paginated_and_ordered(self):
+        payload = self.call('predict_performance_trends', metric='vo2max', limit=5, offset=10)
+        self.assertEqual(payload['points'], 12)
+        self.assertEqual(payload['series']['offset'], 10)
+        self.assertIsNone(payload['series']['next_offset'])
+        self.assertEqual([value for _, value in payload['series']['items']],
+                         [w['vo2max_estimate'] for w in self.workouts[10:]])
+
+    def test_errors_are_json(self):
+        content = asyncio.run(mcp_server.call_tool('predict_performance_trends',
+                                                   {'user_id': 'json-user', 'metric': 'power', 'format': 'json'}))
+        self.assertIn('Unknown metric', json.loads(content[0].text)['error'])
+
+
+class HttpTransportTests(ChromaTestMixin, TestCase):
+    """The shared HTTP server's tool pool: calls over streamable HTTP, timeouts and shutdown"""
+
+    def setUp(self):
+        super().setUp()
+        from concurrent.futures import ThreadPoolExecutor
+
+        # The lifespan shuts the tool pool down, so each test gets its own
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.executor.shutdown, cancel_futures=True)
+        for patcher in [patch('api.chroma_setup.get_collections', return_value=self.collections),
+                        patch('api.mcp_server._tool_executor', self.executor),
+                        patch('api.mcp_server._tool_semaphore', None),
+                        patch('api.mcp_server.WARMUP_ON_START', False)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        chroma_setup.store_workouts_in_chroma(self.collections['workouts'], self.make_workouts(3), 'http-user',
+                                              patterns_collection=self.collections['user_patterns'])
+
+    async def serve_one_client(self, http_app):
+        import httpx
+        from mcp import ClientSession
+        from mcp.client.streamable_http import streamablehttp_client
+
+        def client_factory(headers=None, timeout=None, auth=None):
+            return httpx.AsyncClient(transport=httpx.ASGITransport(app=http_app), headers=headers,
+                                     timeout=timeout, auth=auth)
+
+        async with http_app.router.lifespan_context(http_app):
+            async with streamablehttp_client('http://testserver/mcp/', httpx_client_factory=client_factory) \
+                    as (read_stream, write_stream, _):
+                async with ClientSession(read_stream, write_stream) as session:
+                    await session.initialize()
+                    tools = await session.list_tools()
+                    result = await session.call_tool('analyze_workout_patterns',
+                                                     {'user_id': 'http-user', 'recent_workouts': [{}],
+                                                      'format': 'json'})
+        return tools, result
+
+    def test_list_and_call_then_shut_down(self):
+        tools, result = asyncio.run(self.serve_one_client(mcp_server.create_http_app(json_response=True)))
+
+        self.assertIn('analyze_workout_patterns', [tool.name for tool in tools.tools])
+        self.assertEqual(json.loads(result.content[0].text)['stats']['total_workouts'], 3)
+        with self.assertRaises(RuntimeError):
+            self.executor.submit(print)
+
+    def test_shutdown_does_not_wait_past_timeout(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.executor.submit(release.wait, 30)
+
+        async def start_and_stop(http_app):
+            heartbeat = asyncio.create_task(asyncio.sleep(0.05))
+            async with http_app.router.lifespan_context(http_app):
+                pass
+            stopped = time.monotonic()
+            # The loop kept running while the stuck tool was waited for
+            self.assertTrue(heartbeat.done())
+            release.set()
+            return stopped
+
+        with patch('api.mcp_server.SHUTDOWN_TIMEOUT', 0.2):
+            started = time.monotonic()
+            stopped = asyncio.run(start_and_stop(mcp_server.create_http_app()))
+        self.assertLess(stopped - started, 1)
+
+    def test_timed_out_call_keeps_its_slot(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        running = []
+
+        def slow_tool(name, arguments):
+            running.append(name)
+            if name == 'slow':
+                release.wait(5)
+            running.remove(name)
+            return name
+
+        async def calls():
+            first = await mcp_server.call_tool('slow', {'format': 'json'})
+            second = asyncio.create_task(mcp_server.call_tool('fast', {}))
+            await asyncio.sleep(0.2)
+            # The slow tool's thread still runs, so the fast one has not started
+            waiting = not second.done() and running == ['slow']
+            release.set()
+            return first, waiting, await second
+
+        with patch('api.mcp_server.run_tool', slow_tool), \
+                patch('api.mcp_server._tool_semaphore', asyncio.Semaphore(1)), \
+                patch.dict('api.mcp_server.TOOL_TIMEOUTS', {'slow': 0.1}):
+            first, waiting, second = asyncio.run(calls())
+
+        self.assertIn('timed out', json.loads(first[0].text)['error'])
+        self.assertTrue(waiting)
+        self.assertEqual(second[0].text, 'fast')
+
+
+class SimilarAthletesTests(ChromaTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = patch('api.chroma_setup.get_collections', return_value=self.collections)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def store(self, workouts, user_id):
+        chroma_setup.store_workouts_in_chroma(self.collections['workouts'], workouts, user_id,
+                                              patterns_collection=self.collections['user_patterns'])
+
+    def test_nearest_profiles_with_activity_filter(self):
+        self.store(self.make_workouts(4, activity_type='run', duration=30, distance=5), 'a')
+        self.store(self.make_workouts(4, activity_type='run', duration=32, distance=5), 'b')
+        self.store(self.make_workouts(4, activity_type='cycle', duration=120, distance=60), 'c')
+        self.store(self.make_workouts(2, start=4, activity_type='cycle', duration=60, distance=25), 'a')
+
+        athletes = chroma_setup.find_similar_athletes(self.collections['user_patterns'], 'a', 5)
+        self.assertEqual([athlete['user_id'] for athlete in athletes], ['b', 'c'])
+        self.assertEqual(athletes[0]['total_workouts'], 4)
+
+        cyclists = chroma_setup.find_similar_athletes(self.collections['user_patterns'], 'a', 5, 'cycle')
+        self.assertEqual([athlete['user_id'] for athlete in cyclists], ['c'])
+        self.assertIsNone(chroma_setup.find_similar_athletes(self.collections['user_patterns'], 'b', 5, 'cycle'))
+
+    def test_profiles_are_updated_incrementally(self):
+        workouts = self.make_workouts(6, activity_type='run')
+        self.store(workouts[:3], 'a')
+        self.store(workouts[3:], 'a')
+
+        profile = self.collections['user_patterns'].get(ids=['patterns_a_run'], include=['embeddings'])
+        expected = chroma_setup.create_workout_embeddings(workouts).mean(axis=0)
+        np.testing.assert_allclose(profile['embeddings'][0], expected, rtol=1e-5)
+
+    def test_snapshots_without_activity_profiles_are_rebuilt(self):
+        self.store(self.make_workouts(3), 'a')
+        summary = chroma_setup.load_pattern_summary(self.collections['user_patterns'], 'a')
+        del summary['activity_embedding_sums']
+        self.collections['user_patterns'].update(ids=['patterns_a'], metadatas=[{'summary': json.dumps(summary)}])
+        self.assertIsNone(chroma_setup.load_pattern_summary(self.collections['user_patterns'], 'a'))
+
+        self.store(self.make_workouts(1, start=3), 'a')
+        summary = chroma_setup.load_pattern_summary(self.collections['user_patterns'], 'a')
+        self.assertEqual(summary['total_workouts'], 4)
+        self.assertEqual(sorted(summary['activity_embedding_sums']), ['cycle', 'run', 'walk'])
+
+    def test_endpoint_and_tool(self):
+        user = User.objects.create_user(username='athlete', password='pass12345')
+        client = APIClient()
+        client.force_authenticate(user)
+        self.assertEqual(client.get('/api/athletes/similar/').status_code, 404)
+
+        self.store(self.make_workouts(3), str(user.id))
+        self.store(self.make_workouts(3), 'other')
+        response = client.get('/api/athletes/similar/', {'activity_type': 'run', 'limit': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([athlete['user_id'] for athlete in response.data['results']], ['other'])
+
+        payload = json.loads(mcp_server.run_tool('find_similar_athletes', {'user_id': 'other', 'format': 'json'}))
+        self.assertEqual(payload['results'][0]['user_id'], str(user.id))
+        self.assertAlmostEqual(payload['results'][0]['similarity_score'], 1.0, places=4)
+
+
+class PrecomputedRecommendationTests(ChromaTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = patch('api.chroma_setup.get_collections', return_value=self.collections)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='planner', password='pass12345')
+        self.user_id = str(self.user.id)
+        self.store(self.make_workouts(4, activity_type='run', intensity='low', distance=10, vo2max_estimate=30))
+
+    def store(self, workouts, user_id=None):
+        chroma_setup.store_workouts_in_chroma(self.collections['workouts'], self.date_recent(workouts),
+                                              user_id or self.user_id,
+                                              patterns_collection=self.collections['user_patterns'])
+
+    def test_command_precomputes_and_tool_serves_them(self):
+        User.objects.create_user(username='idle', password='pass12345')
+        out = StringIO()
+        call_command('precompute_recommendations', '--chunk-size', '1', stdout=out)
+        self.assertIn('for 1 users', out.getvalue())
+
+        result = recommendations.get_recommendations(self.collections, self.user_id, ['improve_vo2max', 'build_endurance'])
+        self.assertEqual(result['source'], 'precomputed')
+        self.assertEqual(result['fitness'], {'vo2max_estimate': 30.0, 'avg_weekly_distance': 10.0})
+        self.assertEqual([rec.split(':')[0] for rec in result['recommendations']],
+                         ['**VO2 Max Focus**', '**Endurance Building**', '**Cross-Training**', '**Progressive Overload**'])
+
+        # Fresh sets are skipped on the next run
+        call_command('precompute_recommendations', stdout=out)
+        self.assertIn('for 0 users', out.getvalue())
+
+    def test_newer_data_version_falls_back_to_live(self):
+        recommendations.precompute_recommendations(self.collections, [self.user_id])
+        self.store(self.make_workouts(1, start=4, activity_type='cycle'))
+
+        live = recommendations.get_recommendations(self.collections, self.user_id, ['lose_weight'])
+        self.assertEqual(live['source'], 'live')
+        self.assertEqual(live['data_version'], 5)
+        self.assertNotIn('**Cross-Training**', ' '.join(live['recommendations']))
+
+        # The live result was written back
+        self.assertEqual(recommendations.get_recommendations(
+            self.collections, self.user_id, ['lose_weight'])['source'], 'precomputed')
+
+    def test_caller_fitness_overrides_and_expiry(self):
+        recommendations.precompute_recommendations(self.collections, [self.user_id])
+
+        result = recommendations.get_recommendations(
+            self.collections, self.user_id, ['improve_vo2max'], {'vo2max_estimate': 50})
+        self.assertEqual(result['source'], 'live')
+        self.assertIn('VO2 Max Maintenance', result['recommendations'][0])
+
+        expired = recommendations.get_recommendations(self.collections, self.user_id, [], max_age=0)
+        self.assertEqual(expired['source'], 'live')
+
+    def test_endpoint_and_tool(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/recommendations/', {'goals': 'lose_weight'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['source'], 'live')
+        self.assertIn('Weight Management', response.data['recommendations'][0])
+
+        payload = json.loads(mcp_server.run_tool('generate_workout_recommendations', {
+            'user_id': self.user_id, 'fitness_goals': ['lose_weight'], 'format': 'json'}))
+        self.assertEqual(payload['source'], 'precomputed')
+        self.assertEqual(payload['recommendations'], response.data['recommendations'])
+        self.assertIn('Weekly Distance**: 10.0 km', mcp_server.run_tool(
+            'generate_workout_recommendations', {'user_id': self.user_id}))
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class StripeEventTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='subscriber', password='pass12345')
+        self.client = APIClient()
+        self.events = list(fake_stripe.generate_events([self.user.id], seed=3, start=1_700_000_000))
+
+    def post(self, event, secret='whsec_test'):
+        body, signature = fake_stripe.signed_request(event, secret)
+        return self.client.post('/api/payments/webhook/', body, content_type='application/json',
+                                HTTP_STRIPE_SIGNATURE=signature)
+
+    def test_webhook_stores_once_and_defers_processing(self):
+        created = self.events[0]
+        response = self.post(created)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['duplicate'])
+        self.assertTrue(self.post(created).data['duplicate'])
+        self.assertEqual(self.post(created, secret='whsec_wrong').status_code, 400)
+
+        self.assertEqual(StripeEvent.objects.filter(status='pending').count(), 1)
+        self.assertFalse(Subscription.objects.exists())
+
+        self.assertEqual(process_events(), (1, 0))
+        subscription = Subscription.objects.get(user=self.user)
+        self.assertEqual(subscription.stripe_subscription_id, created['data']['object']['id'])
+        self.assertEqual(subscription.current_period_end.timestamp(), created['data']['object']['current_period_end'])
+        self.assertEqual(process_events(), (0, 0))
+
+    def test_events_apply_in_stripe_order(self):
+        created = self.events[0]
+        updated = fake_stripe.make_event(
+            'customer.subscription.updated',
+            fake_stripe.subscription_object(created['data']['object']['id'], self.user.id, 'past_due',
+                                            created['created'] + 10),
+            created['created'] + 10, 'evt_update')
+        # Delivered out of order
+        record_events([updated, created])
+
+        self.assertEqual(process_events(), (2, 0))
+        self.assertEqual(Subscription.objects.get(user=self.user).status, 'past_due')
+
+    def test_failed_event_holds_later_events_for_the_same_object(self):
+        created = self.events[0]
+        created['data']['object']['metadata']['user_id'] = '999999'
+        updated = fake_stripe.make_event('customer.subscription.updated', created['data']['object'],
+                                         created['created'] + 10, 'evt_update')
+        record_events([created, updated])
+
+        self.assertEqual(process_events(max_attempts=2), (0, 1))
+        failed = StripeEvent.objects.get(event_id=created['id'])
+        held = StripeEvent.objects.get(event_id='evt_update')
+        self.assertEqual((failed.attempts, held.attempts), (1, 0))
+        self.assertEqual(held.next_attempt_at, failed.next_attempt_at)
+
+        StripeEvent.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(process_events(max_attempts=2), (1, 1))
+        self.assertEqual(StripeEvent.objects.get(event_id=created['id']).status, 'failed')
+
+        # Once the user exists the failed event can be replayed
+        created['data']['object']['metadata']['user_id'] = str(self.user.id)
+        StripeEvent.objects.filter(event_id=created['id']).update(payload=created)
+        call_command('replay_stripe_events', '--failed', stdout=StringIO())
+        self.assertEqual(process_events(), (1, 0))
+        self.assertTrue(Subscription.objects.filter(user=self.user).exists())
+
+    def test_replay_file_skips_known_events(self):
+        path = os.path.join(tempfile.mkdtemp(), 'events.ndjson')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w') as f:
+            for event in self.events + self.events[:1]:
+                f.write(json.dumps(event) + '\n')
+        record_event(self.events[0])
+
+        out = StringIO()
+        call_command('replay_stripe_events', '--file', path, stdout=out)
+        self.assertIn(f"Stored {len(self.events) - 1} new events", out.getvalue())
+        call_command('process_stripe_events', stdout=out)
+        self.assertEqual(StripeEvent.objects.filter(status='processed').count(), len(self.events))
+
+
+class EntitlementCacheTests(TestCase):
+    def setUp(self):
+        entitlements.clear_cache()
+        self.addCleanup(entitlements.clear_cache)
+        self.user = User.objects.create_user(username='subscriber', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def subscribe(self, plan='premium', days=30, **fields):
+        return Subscription.objects.create(
+            user=self.user, plan=plan, status='active', stripe_subscription_id='sub_test',
+            current_period_end=timezone.now() + timedelta(days=days), **fields)
+
+    def test_cached_lookup_skips_the_database(self):
+        self.subscribe()
+        self.assertTrue(entitlements.has_plan(entitlements.get_entitlement(self.user.id), 'premium'))
+        with self.assertNumQueries(0):
+            entitlement = entitlements.get_entitlement(self.user.id)
+        self.assertFalse(entitlements.has_plan(entitlement, 'pro'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/subscription/status/')
+        self.assertTrue(response.data['is_premium'])
+        self.assertFalse(response.data['is_pro'])
+
+    def test_entry_expires_at_period_end(self):
+        subscription = self.subscribe(days=1)
+        end = subscription.current_period_end.timestamp()
+        entitlement = entitlements.get_entitlement(self.user.id)
+        self.assertTrue(entitlements.has_plan(entitlement, 'premium', now=end - 1))
+        self.assertFalse(entitlements.has_plan(entitlement, 'premium', now=end))
+
+        # Cached no longer than the time left in the period
+        self.assertEqual(entitlements._ttl(entitlement, 3600, now=end - 60), 60)
+
+        subscription.current_period_end = timezone.now() - timedelta(seconds=1)
+        self.assertFalse(subscription.is_premium)
+
+    def test_webhook_processing_invalidates(self):
+        self.assertFalse(entitlements.has_plan(entitlements.get_entitlement(self.user.id), 'premium'))
+        events = list(fake_stripe.generate_events([self.user.id], seed=3, start=timezone.now().timestamp()))
+        record_events(events[:1])
+        with self.captureOnCommitCallbacks(execute=True):
+            process_events()
+        self.assertTrue(entitlements.has_plan(entitlements.get_entitlement(self.user.id), 'premium'))
+
+        subscription_object = dict(events[0]['data']['object'], status='canceled')
+        record_events([fake_stripe.make_event('customer.subscription.deleted', subscription_object,
+                                              events[0]['created'] + 10, 'evt_deleted')])
+        with self.captureOnCommitCallbacks(execute=True):
+            process_events()
+        self.assertFalse(entitlements.has_plan(entitlements.get_entitlement(self.user.id), 'premium'))
+
+    @patch('api.payments.PaymentsClient.modify_subscription')
+    def test_cancel_invalidates(self, modify):
+        self.subscribe()
+        self.assertFalse(self.client.get('/api/subscription/status/').data['cancel_at_period_end'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post('/api/subscription/cancel/').status_code, 200)
+        modify.assert_called_once_with('sub_test', cancel_at_period_end=True)
+        self.assertTrue(self.client.get('/api/subscription/status/').data['cancel_at_period_end'])
+
+    @override_settings(ENTITLEMENT_CACHE='default')
+    def test_shared_cache_fills_other_processes(self):
+        from django.core.cache import cache
+        self.addCleanup(cache.clear)
+        self.subscribe(plan='pro')
+        entitlements.get_entitlement(self.user.id)
+        # A fresh process has an empty local cache but finds the shared entry
+        entitlements.clear_cache()
+        with self.assertNumQueries(0):
+            self.assertTrue(entitlements.has_plan(entitlements.get_entitlement(self.user.id), 'pro'))
+        entitlements.invalidate(self.user.id)
+        self.assertIsNone(cache.get(entitlements.cache_key(self.user.id)))
+
+    def test_has_plan_permission(self):
+        from rest_framework.views import APIView
+
+        from .permissions import HasPlan
+
+        class PremiumView(APIView):
+            permission_classes = [IsAuthenticated, HasPlan('premium')]
+
+            def get(self, request):
+                return Response({'ok': True})
+
+        def get():
+            request = APIRequestFactory().get('/premium/')
+            force_authenticate(request, user=self.user)
+            return PremiumView.as_view()(request)
+
+        response = get()
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.data['detail'], "A premium subscription is required")
+
+        self.subscribe(plan='pro')
+        entitlements.invalidate(self.user.id)
+        self.assertEqual(get().status_code, 200)
+        self.assertTrue(HasPlan('free')().has_permission(SimpleNamespace(user=self.user), None))
+        self.assertIs(HasPlan('premium'), HasPlan('premium'))
+
+
+class StripeClientTests(TestCase):
+    """The payments client against the bundled fake Stripe API server"""
+
+    def setUp(self):
+        self.server = server = fake_stripe.make_server(port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        host, port = server.server_address[:2]
+
+        settings_override = override_settings(STRIPE_API_BASE=f"http://{host}:{port}", STRIPE_MAX_RETRIES=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        payments.reset_client()
+        payments.metrics.reset()
+        self.addCleanup(payments.reset_client)
+
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_calls_are_pooled_and_timed(self):
+        client = payments.get_client()
+        customer = client.create_customer(email='a@example.com', metadata={'user_id': 7})
+        self.assertTrue(customer.id.startswith('cus_fake'))
+        self.assertEqual(customer.metadata['user_id'], '7')
+        intent = client.create_payment_intent(amount=999, currency='usd', customer=customer.id)
+        self.assertEqual((intent.amount, intent.customer), (999, customer.id))
+        subscription = client.modify_subscription('sub_123', cancel_at_period_end=True)
+        self.assertTrue(subscription.cancel_at_period_end)
+
+        stats = payments.metrics.stats()
+        self.assertEqual({op: entry['calls'] for op, entry in stats.items()},
+                         {'customers.create': 1, 'payment_intents.create': 1, 'subscriptions.update': 1})
+        self.assertIs(payments.get_client(), client)
+
+    def test_replay_from_stripe_stores_webhook_payloads(self):
+        from .models import StripeEvent
+
+        self.server.events = list(fake_stripe.generate_events(list(range(1, 81)), seed=1, start=1_700_000_000))
+        expected = {event['id']: event for event in self.server.events if event['type'] == 'payment_intent.succeeded'}
+        self.assertGreater(len(expected), 100)  # more than one page
+
+        out = StringIO()
+        call_command('replay_stripe_events', '--from-stripe', '--type', 'payment_intent.succeeded', stdout=out)
+
+        self.assertIn(f"Stored {len(expected)} new events from Stripe", out.getvalue())
+        self.assertEqual(payments.metrics.stats()['events.list']['calls'], 1)
+        # Stored exactly as the webhook view stores them
+        for stored in StripeEvent.objects.all():
+            self.assertEqual(stored.payload, expected[stored.event_id])
+
+    def test_failed_calls_are_counted(self):
+        import stripe
+        with self.assertRaises(stripe.StripeError):
+            payments.get_client().call('charges.missing', payments.get_client().stripe.v1.charges.create, {})
+        self.assertEqual(payments.metrics.stats()['charges.missing']['errors'], 1)
+
+    def test_create_payment_intent_endpoint(self):
+        for _ in range(2):
+            response = self.client.post('/api/payments/create-intent/', {'plan': 'pro'}, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.data['client_secret'].startswith(response.data['payment_intent_id']))
+        self.assertEqual(Payment.objects.filter(user=self.user, amount=1999).count(), 2)
+
+        # The customer is created once and reused
+        stats = payments.metrics.stats()
+        self.assertEqual((stats['customers.create']['calls'], stats['payment_intents.create']['calls']), (1, 2))
+
+        self.assertEqual(self.client.get('/api/payments/stats/').status_code, 403)
+        admin = User.objects.create_user(username='admin', password='pass12345', is_staff=True)
+        self.client.force_authenticate(admin)
+        self.assertEqual(self.client.get('/api/payments/stats/').data['payment_intents.create']['calls'], 2)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        authentication.clear_cache()
+        entitlements.clear_cache()
+        self.addCleanup(authentication.clear_cache)
+        self.addCleanup(entitlements.clear_cache)
+        self.user = User.objects.create_user(username='runner', email='runner@example.com', password='pass12345')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+
+    def test_user_is_loaded_once(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/auth/profile/').data['username'], 'runner')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/auth/profile/').data['email'], 'runner@example.com')
+
+    def test_read_only_view_gets_token_user(self):
+        self.client.get('/api/subscription/status/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/subscription/status/')
+        self.assertEqual((response.status_code, response.data['plan']), (200, 'free'))
+
+    def test_deactivation_applies_on_save(self):
+        self.assertEqual(self.client.get('/api/auth/profile/').status_code, 200)
+
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get('/api/auth/profile/').status_code, 401)
+
+    def test_password_change_revokes_tokens_when_enabled(self):
+        # Off by default, since turning it on rejects every token issued without the claim
+        with patch.object(authentication.api_settings, 'CHECK_REVOKE_TOKEN', True):
+            self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+            self.assertEqual(self.client.get('/api/auth/profile/').status_code, 200)
+
+            self.user.set_password('new-pass12345')
+            with self.captureOnCommitCallbacks(execute=True):
+                self.user.save()
+            self.assertEqual(self.client.get('/api/auth/profile/').status_code, 401)
+            self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+            self.assertEqual(self.client.get('/api/auth/profile/').status_code, 200)
+
+    def test_unknown_user_is_rejected(self):
+        token = AccessToken.for_user(self.user)
+        self.user.delete()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(self.client.get('/api/subscription/status/').status_code, 401)
+
+
+class RefreshTokenBlacklistTests(TestCase):
+    def setUp(self):
+        refresh_tokens.blacklist_filter.clear()
+        self.addCleanup(refresh_tokens.blacklist_filter.clear)
+        self.user = User.objects.create_user(username='rotator', password='pass12345')
+        self.client = APIClient()
+
+    def refresh(self, token):
+        return self.client.post('/api/auth/token/refresh/', {'refresh': str(token)}, format='json')
+
+    def test_rotated_token_cannot_be_reused(self):
+        token = RefreshToken.for_user(self.user)
+        response = self.refresh(token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.refresh(token).status_code, 401)
+        self.assertEqual(self.refresh(response.data['refresh']).status_code, 200)
+
+    def test_filter_replaces_the_blacklist_lookup(self):
+        first, second = RefreshToken.for_user(self.user), RefreshToken.for_user(self.user)
+        refresh_tokens.blacklist_filter.load()
+        with CaptureQueriesContext(connection) as plain:
+            TokenRefreshSerializer(data={'refresh': str(first)}).is_valid(raise_exception=True)
+        with CaptureQueriesContext(connection) as filtered:
+            refresh_tokens.RefreshTokenSerializer(data={'refresh': str(second)}).is_valid(raise_exception=True)
+        self.assertEqual(len(filtered), len(plain) - 1)
+
+    def test_token_blacklisted_by_another_process_is_rejected(self):
+        token = RefreshToken.for_user(self.user)
+        refresh_tokens.blacklist_filter.load()
+        # Rotated by another process, whose filter update this one never sees
+        RefreshToken(str(token)).blacklist()
+        self.assertFalse(refresh_tokens.blacklist_filter.contains(token['jti']))
+
+        self.assertEqual(self.refresh(token).status_code, 401)
+        self.assertTrue(refresh_tokens.blacklist_filter.contains(token['jti']))
+
+    def test_filter_is_rebuilt_from_the_table(self):
+        token = RefreshToken.for_user(self.user)
+        RefreshToken(str(token)).blacklist()
+        self.assertTrue(refresh_tokens.blacklist_filter.contains(token['jti']))
+        refresh_tokens.blacklist_filter.discard_expired(now=token['exp'])
+        self.assertEqual(len(refresh_tokens.blacklist_filter), 0)
+
+    def test_prune_deletes_expired_tokens_in_batches(self):
+        from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+        tokens = [RefreshToken.for_user(self.user) for _ in range(5)]
+        for token in tokens[:3]:
+            token.blacklist()
+        OutstandingToken.objects.filter(jti__in=[token['jti'] for token in tokens[:4]]).update(
+            expires_at=timezone.now() - timedelta(days=1))
+
+        out = StringIO()
+        call_command('prune_token_blacklist', '--batch-size', '3', stdout=out)
+        self.assertIn("Deleted 4 expired outstanding tokens (3 blacklisted)", out.getvalue())
+        self.assertEqual(list(OutstandingToken.objects.values_list('jti', flat=True)), [tokens[4]['jti']])
+        self.assertFalse(BlacklistedToken.objects.exists())
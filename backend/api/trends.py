@@ -0,0 +1,120 @@
+"""
+Performance trends over a time window of a user's stored workouts.
+
+Only workouts inside the window are read: the range filter on the numeric
+'timestamp' metadata runs inside the vector store. The series is ordered
+by date and fitted with NumPy (least-squares slope plus a time-decayed
+EWMA level), so the cost grows with the window rather than the history.
+"""
+
+import time
+
+import numpy as np
+
+SECONDS_PER_WEEK = 7 * 24 * 3600
+EWMA_HALFLIFE_WEEKS = 2.0
+# Relative change over the window below which a trend counts as a plateau
+PLATEAU_THRESHOLD = 0.02
+
+TREND_METRICS = {
+    'vo2max': {'label': 'VO2 Max', 'unit': 'mL/kg/min', 'higher_is_better': True},
+    'endurance': {'label': 'Endurance (workout duration)', 'unit': 'min', 'higher_is_better': True},
+    'speed': {'label': 'Average Speed', 'unit': 'km/h', 'higher_is_better': True},
+    # Proxy from the stored data: how far the average sits below the peak heart rate
+    'heart_rate_recovery': {'label': 'Heart Rate Recovery (max - avg)', 'unit': 'bpm', 'higher_is_better': True},
+}
+
+
+def fetch_trend_window(collection, user_id, weeks, now=None):
+    """Metadata of the user's workouts from the last `weeks` weeks"""
+    since = (time.time() if now is None else now) - weeks * SECONDS_PER_WEEK
+    result = collection.get(
+        where={'$and': [{'user_id': user_id}, {'timestamp': {'$gte': since}}]},
+        include=['metadatas'],
+    )
+    return result['metadatas'] or []
+
+
+def _column(metadatas, key):
+    return np.fromiter(((m.get(key) or 0) for m in metadatas), dtype=np.float64, count=len(metadatas))
+
+
+def metric_series(metadatas, metric):
+    """Return (timestamps, values) for a metric, ordered by date, skipping workouts without the data"""
+    if metric not in TREND_METRICS:
+        raise ValueError(f"Unknown metric: {metric}")
+
+    timestamps = _column(metadatas, 'timestamp')
+    if metric == 'vo2max':
+        values = _column(metadatas, 'vo2max_estimate')
+        valid = values > 0
+    elif metric == 'endurance':
+        values = _column(metadatas, 'duration')
+        valid = values > 0
+    elif metric == 'speed':
+        distance = _column(metadatas, 'distance')
+        duration = _column(metadatas, 'duration')
+        valid = (distance > 0) & (duration > 0)
+        values = np.divide(distance * 60, duration, out=np.zeros_like(distance), where=valid)
+    else:
+        hr_max = _column(metadatas, 'heart_rate_max')
+        hr_avg = _column(metadatas, 'heart_rate_avg')
+        valid = (hr_max > 0) & (hr_avg > 0)
+        values = hr_max - hr_avg
+
+    timestamps = timestamps[valid]
+    values = values[valid]
+    order = np.argsort(timestamps, kind='stable')
+    return timestamps[order], values[order]
+
+
+def fit_trend(timestamps, values, metric='vo2max', halflife_weeks=EWMA_HALFLIFE_WEEKS):
+    """
+    Fit a trend to a date-ordered series.
+
+    Returns the number of points, the least-squares slope per week, the
+    EWMA level (recent workouts weigh more, decaying by elapsed time) and
+    the direction: 'improving', 'declining' or 'plateauing'.
+    """
+    points = len(values)
+    if points == 0:
+        return {'points': 0, 'slope_per_week': 0.0, 'level': None, 'span_weeks': 0.0, 'direction': 'plateauing'}
+
+    weeks = (timestamps - timestamps[0]) / SECONDS_PER_WEEK
+    span = float(weeks[-1])
+    slope = float(np.polyfit(weeks, values, 1)[0]) if points >= 2 and span > 0 else 0.0
+
+    decay = 0.5 ** ((span - weeks) / halflife_weeks)
+    level = float(np.dot(decay, values) / decay.sum())
+
+    scale = max(abs(float(values.mean())), 1e-9)
+    change = slope * span / scale
+    if abs(change) < PLATEAU_THRESHOLD:
+        direction = 'plateauing'
+    elif (change > 0) == TREND_METRICS[metric]['higher_is_better']:
+        direction = 'improving'
+    else:
+        direction = 'declining'
+
+    return {
+        'points': points,
+        'slope_per_week': slope,
+        'level': level,
+        'span_weeks': span,
+        'direction': direction,
+    }
+
+
+def predict_trend(collection, user_id, metric, weeks, now=None):
+    """
+    Read the window and fit the requested metric.
+
+    Returns the fit_trend result plus the number of workouts read and the
+    ordered (timestamps, values) series.
+    """
+    metadatas = fetch_trend_window(collection, user_id, weeks, now)
+    timestamps, values = metric_series(metadatas, metric)
+    trend = fit_trend(timestamps, values, metric)
+    trend['workouts'] = len(metadatas)
+    trend['series'] = (timestamps, values)
+    return trend
@@ -16,11 +16,16 @@ urlpatterns = [
     # Protected endpoints
     path('workouts/', views.WorkoutListView.as_view(), name='workouts-list'),
     path('workouts/submit/', views.WorkoutView.as_view(), name='workouts-submit'),
+    path('workouts/bulk/', views.WorkoutBulkView.as_view(), name='workouts-bulk'),
+    path('workouts/export/', views.WorkoutExportView.as_view(), name='workouts-export'),
+    path('athletes/similar/', views.SimilarAthletesView.as_view(), name='similar-athletes'),
+    path('recommendations/', views.RecommendationsView.as_view(), name='recommendations'),
     path('norse-vo2/', views.NorseVO2View.as_view(), name='norse-vo2'),
 
     # Payment endpoints (protected)
     path('payments/create-intent/', views.CreatePaymentIntentView.as_view(), name='create-payment-intent'),
     path('payments/webhook/', views.StripeWebhookView.as_view(), name='stripe-webhook'),
+    path('payments/stats/', views.StripeClientStatsView.as_view(), name='stripe-client-stats'),
     path('subscription/status/', views.SubscriptionStatusView.as_view(), name='subscription-status'),
     path('subscription/cancel/', views.CancelSubscriptionView.as_view(), name='cancel-subscription'),
 ]
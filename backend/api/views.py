@@ -1,21 +1,31 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.conf import settings
+from django.db import transaction
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
 from rest_framework_simplejwt.tokens import RefreshToken
 import stripe
 import json
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
 from .models import Subscription, Payment, UserProfile, Workout
-from .vo2max_utils import estimate_vo2max_from_workout
+from .vo2max_utils import estimate_vo2max_from_workout, estimate_vo2max_for_workouts
+from .serializers import WorkoutInputSerializer
+from .exports import EXPORT_FORMATS, stream_workouts
+from .outbox import enqueue_workouts
+from .pagination import InvalidCursor, keyset_page, parse_limit
+from .authentication import CachedTokenUserAuthentication
+from .entitlements import get_entitlement, has_plan, invalidate_on_commit
+from .payments import get_client, metrics as stripe_metrics
+from .stripe_events import from_timestamp, record_event
 
 # Initialize Stripe
 stripe.api_key = settings.STRIPE_SECRET_KEY
@@ -135,41 +145,77 @@ class WorkoutListView(APIView):
     def get(self, request):
         try:
             user = request.user
-            workouts = Workout.objects.filter(user=user).order_by('-date')
+            workouts = Workout.objects.filter(user=user)
 
-            # Get or create user profile
-            profile, created = UserProfile.objects.get_or_create(
-                user=user,
-                defaults={
-                    'gender': 'other',
-                    'age': 25,
-                    'weight': '70',
-                    'height': '170'
-                }
-            )
+            # The dashboard charts (and legacy clients) get the whole history in one response
+            if request.query_params.get('all', '').lower() == 'true':
+                page = list(workouts.order_by('-date', '-id'))
+                self.fill_missing_estimates(page, user)
+                return Response([self.serialize_workout(w) for w in page])
 
-            workout_data = []
-            for workout in workouts:
-                # Calculate VO2 max for each workout
-                vo2max = estimate_vo2max_from_workout(workout, profile)
-
-                workout_data.append({
-                    'id': workout.id,
-                    'activity_type': workout.activity_type,
-                    'duration': workout.duration,
-                    'distance': workout.distance,
-                    'heart_rate_avg': workout.heart_rate_avg,
-                    'heart_rate_max': workout.heart_rate_max,
-                    'intensity': workout.intensity,
-                    'date': workout.date.isoformat(),
-                    'vo2max_estimate': round(vo2max, 1) if vo2max else 0,
-                })
+            try:
+                page, next_cursor = keyset_page(
+                    workouts,
+                    cursor=request.query_params.get('cursor'),
+                    limit=parse_limit(request.query_params.get('limit')),
+                )
+            except InvalidCursor:
+                return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
 
-            return Response(workout_data)
+            self.fill_missing_estimates(page, user)
+            return Response({
+                'results': [self.serialize_workout(w) for w in page],
+                'next': next_cursor,
+            })
 
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+    def fill_missing_estimates(self, workouts, user):
+        # Rows saved before vo2max_estimate existed are estimated once and stored
+        missing = [w for w in workouts if w.vo2max_estimate is None]
+        if not missing:
+            return
+
+        profile, created = UserProfile.objects.get_or_create(
+            user=user,
+            defaults={
+                'gender': 'other',
+                'age': 25,
+                'weight': '70',
+                'height': '170'
+            }
+        )
+        estimates = estimate_vo2max_for_workouts(missing, profile).round(1)
+        for workout, estimate in zip(missing, estimates.tolist()):
+            workout.vo2max_estimate = estimate
+        Workout.objects.bulk_update(missing, ['vo2max_estimate'])
+
+    def serialize_workout(self, workout):
+        return {
+            'id': workout.id,
+            'activity_type': workout.activity_type,
+            'duration': workout.duration,
+            'distance': workout.distance,
+            'heart_rate_avg': workout.heart_rate_avg,
+            'heart_rate_max': workout.heart_rate_max,
+            'intensity': workout.intensity,
+            'date': workout.date.isoformat(),
+            'vo2max_estimate': workout.vo2max_estimate or 0,
+        }
+
+def format_heart_rate(value):
+    """Heart rates are stored as encrypted text: '150' for 150, 150.0 or '150', None when missing or zero"""
+    if not value:
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return str(value)
+    if not value:
+        return None
+    return str(int(value)) if value.is_integer() else str(value)
+
 class WorkoutView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -189,43 +235,25 @@ class WorkoutView(APIView):
                 }
             )
 
-            # Create workout in Django
-            workout = Workout.objects.create(
+            workout = Workout(
                 user=user,
                 activity_type=data.get('activity_type', 'run'),
                 duration=data.get('duration', 30),
                 distance=data.get('distance'),
-                heart_rate_avg=str(data.get('heart_rate_avg', '')) if data.get('heart_rate_avg') else None,
-                heart_rate_max=str(data.get('heart_rate_max', '')) if data.get('heart_rate_max') else None,
+                heart_rate_avg=format_heart_rate(data.get('heart_rate_avg')),
+                heart_rate_max=format_heart_rate(data.get('heart_rate_max')),
                 intensity=data.get('intensity', 'moderate')
             )
 
-            # Calculate VO2 max
+            # Calculate VO2 max once and store it with the workout
             vo2max = estimate_vo2max_from_workout(workout, profile)
+            workout.vo2max_estimate = round(vo2max, 1) if vo2max else None
 
-            # Prepare workout data for ChromaDB storage
-            workout_data_for_ai = {
-                'id': str(workout.id),
-                'activity_type': workout.activity_type,
-                'duration': workout.duration,
-                'distance': workout.distance or 0,
-                'heart_rate_avg': data.get('heart_rate_avg', 0),
-                'heart_rate_max': data.get('heart_rate_max', 0),
-                'intensity': workout.intensity,
-                'date': workout.date.isoformat(),
-                'vo2max_estimate': round(vo2max, 1) if vo2max else 0,
-            }
-
-            # Store workout in ChromaDB for AI analysis (async/background task would be ideal)
-            try:
-                from .chroma_setup import store_workout_in_chroma, get_chroma_client, create_collections
-                chroma_client = get_chroma_client()
-                collections = create_collections(chroma_client)
-                workouts_collection = collections['workouts']
-                store_workout_in_chroma(workouts_collection, workout_data_for_ai, str(user.id))
-            except Exception as chroma_error:
-                # Don't fail the workout save if ChromaDB storage fails
-                print(f"Warning: Failed to store workout in ChromaDB: {chroma_error}")
+            # Create workout in Django and queue it for ChromaDB in the same
+            # transaction; drain_chroma_outbox writes it to the vector store
+            with transaction.atomic():
+                workout.save()
+                enqueue_workouts([workout])
 
             # Get benefits
             from .vo2max_utils import get_vo2max_benefits
@@ -242,15 +270,171 @@ class WorkoutView(APIView):
                 },
                 'vo2max_estimate': round(vo2max, 1) if vo2max else None,
                 'benefits': benefits,
-                'ai_stored': True  # Indicate workout was stored for AI analysis
+                'ai_stored': False,  # Stored asynchronously by the outbox worker
+                'ai_queued': True
             })
 
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+class WorkoutBulkView(APIView):
+    """Ingest a batch of workouts (e.g. a wearable sync) in one request"""
+    permission_classes = [IsAuthenticated]
+    max_batch_size = 500
+
+    def post(self, request):
+        items = request.data.get('workouts') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list):
+            return Response({'error': 'Expected a list of workouts'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.max_batch_size:
+            return Response({'error': f'At most {self.max_batch_size} workouts per request'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Validate every item up front; invalid ones are reported, not fatal
+        valid = []
+        errors = []
+        for index, item in enumerate(items):
+            serializer = WorkoutInputSerializer(data=item)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                errors.append({'index': index, 'errors': serializer.errors})
+
+        if not valid:
+            return Response({'created': [], 'errors': errors, 'ai_stored': False, 'ai_queued': False})
+
+        try:
+            user = request.user
+            profile, created = UserProfile.objects.get_or_create(
+                user=user,
+                defaults={
+                    'gender': 'other',
+                    'age': 25,
+                    'weight': '70',
+                    'height': '170'
+                }
+            )
+
+            workouts = [
+                Workout(
+                    user=user,
+                    activity_type=item['activity_type'],
+                    duration=item['duration'],
+                    distance=item['distance'],
+                    heart_rate_avg=format_heart_rate(item['heart_rate_avg']),
+                    heart_rate_max=format_heart_rate(item['heart_rate_max']),
+                    intensity=item['intensity'],
+                )
+                for index, item in valid
+            ]
+
+            # Estimate VO2 max for the whole batch in one pass
+            estimates = estimate_vo2max_for_workouts(workouts, profile).round(1)
+            for workout, estimate in zip(workouts, estimates.tolist()):
+                workout.vo2max_estimate = estimate
+
+            # Queue the batch for ChromaDB in the same transaction as the insert
+            with transaction.atomic():
+                workouts = Workout.objects.bulk_create(workouts)
+                enqueue_workouts(workouts)
+
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'created': [
+                {
+                    'index': index,
+                    'id': workout.id,
+                    'date': workout.date,
+                    'vo2max_estimate': workout.vo2max_estimate,
+                }
+                for workout, (index, item) in zip(workouts, valid)
+            ],
+            'errors': errors,
+            'ai_stored': False,
+            'ai_queued': True,
+        })
+
+class WorkoutExportView(APIView):
+    """Stream a user's full workout history as NDJSON or CSV"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        # DRF reserves ?format= for renderer selection, so the export format is ?output=
+        output = request.query_params.get('output', 'ndjson').lower()
+        if output not in EXPORT_FORMATS:
+            return Response({'error': f"Unsupported output format: {output}"}, status=status.HTTP_400_BAD_REQUEST)
+        compress = request.query_params.get('gzip', '').lower() == 'true'
+
+        workouts = Workout.objects.filter(user=request.user).order_by('date', 'id')
+        filename = f"workouts.{output}"
+        if compress:
+            filename += '.gz'
+
+        response = StreamingHttpResponse(
+            stream_workouts(workouts, output=output, compress=compress),
+            content_type='application/gzip' if compress else EXPORT_FORMATS[output],
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+class SimilarAthletesView(APIView):
+    """Users whose training profile is closest to the requesting user's"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        from .chroma_setup import find_similar_athletes, get_collections
+
+        limit = parse_limit(request.query_params.get('limit'), default=10, maximum=50)
+        activity_type = request.query_params.get('activity_type') or None
+
+        try:
+            athletes = find_similar_athletes(
+                get_collections()['user_patterns'], str(request.user.id), limit, activity_type
+            )
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        if athletes is None:
+            return Response({'error': 'Log some workouts before comparing with other athletes'}, status=404)
+
+        return Response({
+            'activity_type': activity_type,
+            'results': athletes,
+        })
+
+class RecommendationsView(APIView):
+    """Workout recommendations for the requesting user's goals"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        from .chroma_setup import get_collections
+        from .recommendations import get_recommendations
+
+        goals = [goal for goal in request.query_params.get('goals', '').split(',') if goal]
+
+        try:
+            result = get_recommendations(get_collections(), request.user.id, goals)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        return Response({
+            'goals': goals,
+            'recommendations': result['recommendations'],
+            'fitness': result['fitness'],
+            'data_version': result['data_version'],
+            'source': result['source'],
+        })
+
 # Stripe Payment Views
 @method_decorator(csrf_exempt, name='dispatch')
 class StripeWebhookView(APIView):
+    # The Stripe signature authenticates the request; throttling deliveries
+    # only makes Stripe retry them later
+    authentication_classes = []
+    throttle_classes = []
+
     def post(self, request):
         payload = request.body
         sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
@@ -264,66 +448,11 @@ class StripeWebhookView(APIView):
         except stripe.error.SignatureVerificationError as e:
             return Response({'error': 'Invalid signature'}, status=400)
 
-        # Handle the event
-        if event.type == 'customer.subscription.created':
-            self.handle_subscription_created(event.data.object)
-        elif event.type == 'customer.subscription.updated':
-            self.handle_subscription_updated(event.data.object)
-        elif event.type == 'customer.subscription.deleted':
-            self.handle_subscription_deleted(event.data.object)
-        elif event.type == 'payment_intent.succeeded':
-            self.handle_payment_succeeded(event.data.object)
-
-        return Response({'status': 'success'})
-
-    def handle_subscription_created(self, subscription):
-        # Create or update subscription in database
-        user_id = subscription.metadata.get('user_id')
-        if user_id:
-            user = User.objects.get(id=user_id)
-            Subscription.objects.update_or_create(
-                user=user,
-                defaults={
-                    'stripe_subscription_id': subscription.id,
-                    'stripe_customer_id': subscription.customer,
-                    'plan': subscription.metadata.get('plan', 'premium'),
-                    'status': subscription.status,
-                    'current_period_start': subscription.current_period_start,
-                    'current_period_end': subscription.current_period_end,
-                }
-            )
-
-    def handle_subscription_updated(self, subscription):
-        # Update subscription status
-        try:
-            sub = Subscription.objects.get(stripe_subscription_id=subscription.id)
-            sub.status = subscription.status
-            sub.current_period_start = subscription.current_period_start
-            sub.current_period_end = subscription.current_period_end
-            sub.cancel_at_period_end = subscription.cancel_at_period_end
-            sub.save()
-        except Subscription.DoesNotExist:
-            pass
-
-    def handle_subscription_deleted(self, subscription):
-        # Mark subscription as canceled
-        try:
-            sub = Subscription.objects.get(stripe_subscription_id=subscription.id)
-            sub.status = 'canceled'
-            sub.save()
-        except Subscription.DoesNotExist:
-            pass
+        # Store the event and acknowledge right away; process_stripe_events
+        # applies it. Stripe's retries of an already stored event are no-ops.
+        created = record_event(event.to_dict())
 
-    def handle_payment_succeeded(self, payment_intent):
-        # Record successful payment
-        try:
-            payment = Payment.objects.get(stripe_payment_intent_id=payment_intent.id)
-            payment.status = 'succeeded'
-            payment.stripe_charge_id = payment_intent.charges.data[0].id if payment_intent.charges.data else None
-            payment.receipt_url = payment_intent.charges.data[0].receipt_url if payment_intent.charges.data else None
-            payment.save()
-        except Payment.DoesNotExist:
-            pass
+        return Response({'status': 'success', 'duplicate': not created})
 
 class CreatePaymentIntentView(APIView):
     permission_classes = [IsAuthenticated]
@@ -346,7 +475,7 @@ class CreatePaymentIntentView(APIView):
             )
 
             if not subscription.stripe_customer_id:
-                customer = stripe.Customer.create(
+                customer = get_client().create_customer(
                     email=user.email,
                     name=user.username,
                     metadata={'user_id': user.id}
@@ -355,7 +484,7 @@ class CreatePaymentIntentView(APIView):
                 subscription.save()
 
             # Create payment intent
-            intent = stripe.PaymentIntent.create(
+            intent = get_client().create_payment_intent(
                 amount=plan_config['price'],
                 currency='usd',
                 customer=subscription.stripe_customer_id,
@@ -388,27 +517,30 @@ class CreatePaymentIntentView(APIView):
         except Exception as e:
             return Response({'error': str(e)}, status=400)
 
+class StripeClientStatsView(APIView):
+    """Per-operation Stripe call counts and latencies for this process"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(stripe_metrics.stats())
+
 class SubscriptionStatusView(APIView):
+    # Only needs the user's id, so JWT requests get a TokenUser
+    authentication_classes = [CachedTokenUserAuthentication, SessionAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        try:
-            subscription = Subscription.objects.get(user=request.user)
-            return Response({
-                'plan': subscription.plan,
-                'status': subscription.status,
-                'is_premium': subscription.is_premium,
-                'is_pro': subscription.is_pro,
-                'current_period_end': subscription.current_period_end,
-                'cancel_at_period_end': subscription.cancel_at_period_end
-            })
-        except Subscription.DoesNotExist:
-            return Response({
-                'plan': 'free',
-                'status': 'active',
-                'is_premium': False,
-                'is_pro': False
-            })
+        # Served from the entitlement cache rather than the Subscription table
+        entitlement = get_entitlement(request.user.id)
+        period_end = entitlement['current_period_end']
+        return Response({
+            'plan': entitlement['plan'],
+            'status': entitlement['status'],
+            'is_premium': has_plan(entitlement, 'premium'),
+            'is_pro': has_plan(entitlement, 'pro'),
+            'current_period_end': from_timestamp(period_end) if period_end is not None else None,
+            'cancel_at_period_end': entitlement['cancel_at_period_end']
+        })
 
 class SubscriptionPlansView(APIView):
     def get(self, request):
@@ -423,12 +555,13 @@ class CancelSubscriptionView(APIView):
 
             if subscription.stripe_subscription_id:
                 # Cancel in Stripe
-                stripe.Subscription.modify(
+                get_client().modify_subscription(
                     subscription.stripe_subscription_id,
                     cancel_at_period_end=True
                 )
                 subscription.cancel_at_period_end = True
                 subscription.save()
+                invalidate_on_commit(request.user.id)
 
             return Response({'message': 'Subscription will be canceled at period end'})
 
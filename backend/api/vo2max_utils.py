@@ -1,5 +1,7 @@
 import math
 
+import numpy as np
+
 def estimate_vo2max_cooper(distance_meters, time_minutes, gender):
     """
     Estimate VO2 max using Cooper test formula.
@@ -57,6 +59,71 @@ def estimate_vo2max_from_workout(workout, profile):
         # Fallback to industry average on any calculation error
         return 35.0
 
+def _as_float_column(values):
+    """Convert a column to float64, treating None as missing (NaN)"""
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+
+def estimate_vo2max_batch(distance_km, duration_min, activity_type, max_hr, age, gender):
+    """
+    Estimate VO2 max for many workouts at once from columnar inputs.
+
+    Applies the same rules as estimate_vo2max_from_workout: Cooper formula for
+    runs with a distance, heart rate ratio when a max HR is known, age-predicted
+    max HR otherwise, 35.0 when nothing is available, clamped to 15-80.
+    Missing values are passed as None or NaN. age and gender may be scalars
+    when every workout belongs to the same profile.
+    """
+    distance = _as_float_column(distance_km)
+    n = distance.shape[0]
+    duration = np.broadcast_to(_as_float_column(duration_min), (n,))
+    max_hr = np.broadcast_to(_as_float_column(max_hr), (n,))
+    age = np.broadcast_to(_as_float_column(age), (n,))
+    activity_type = np.broadcast_to(np.asarray(activity_type, dtype=object), (n,))
+    gender = np.broadcast_to(np.asarray(gender, dtype=object), (n,))
+
+    # Zero and missing values are "not available", like the falsy checks in the scalar path
+    has_distance = np.nan_to_num(distance) != 0
+    has_hr = np.nan_to_num(max_hr) != 0
+    has_age = np.nan_to_num(age) != 0
+
+    cooper = has_distance & (activity_type == 'run')
+    heart_rate = ~cooper & has_hr & has_age
+    age_based = ~cooper & ~heart_rate & has_age
+
+    vo2max = np.full(n, 35.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distance_m = distance * 1000
+        distance_m = np.where(duration != 12, distance_m * (12 / duration), distance_m)
+    offset = np.where(gender == 'male', 504.9, np.where(gender == 'female', 504.1, 504.5))
+    vo2max = np.where(cooper, np.maximum(0, (distance_m - offset) / 44.73), vo2max)
+    vo2max = np.where(heart_rate, 15.3 * (max_hr / 70), vo2max)
+    vo2max = np.where(age_based, 15.3 * ((208 - 0.7 * age) / 70), vo2max)
+
+    vo2max = np.clip(vo2max, 15.0, 80.0)
+
+    # The scalar path falls back to the industry average when the Cooper
+    # adjustment divides by a zero or missing duration
+    failed = cooper & ((duration == 0) | np.isnan(duration))
+    vo2max[failed] = 35.0
+
+    return vo2max
+
+def estimate_vo2max_for_workouts(workouts, profile):
+    """Batch-estimate VO2 max for a sequence of Workout rows of one profile"""
+    workouts = list(workouts)
+    return estimate_vo2max_batch(
+        [w.distance for w in workouts],
+        [w.duration for w in workouts],
+        [w.activity_type for w in workouts],
+        [w.max_heart_rate for w in workouts],
+        profile.age,
+        profile.gender,
+    )
+
 def get_vo2max_benefits(vo2max):
     """
     Provide benefits based on VO2 max.
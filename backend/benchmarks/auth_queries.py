@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Database queries per JWT-authenticated request, with and without the user cache.
+
+Creates a throwaway test database and a user with an access token, then
+calls a few authenticated endpoints repeatedly in two modes:
+
+  jwt     simplejwt's JWTAuthentication (a User query on every request)
+  cached  api.authentication.CachedJWTAuthentication, and the TokenUser
+          variant on the views configured for it
+
+For each endpoint it reports queries and mean latency per request, and
+the queries the cache saves. Throttling is disabled for the run.
+
+Usage (from backend/):
+    python -m benchmarks.auth_queries --requests 200
+"""
+
+import argparse
+import os
+import time
+
+ENDPOINTS = ['/api/auth/profile/', '/api/subscription/status/', '/api/workouts/']
+
+
+def measure(client, path, requests):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    client.get(path)  # warm up (fills the caches in cached mode)
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        for _ in range(requests):
+            response = client.get(path)
+            assert response.status_code == 200, (path, response.status_code)
+        elapsed = time.perf_counter() - started
+    return len(queries) / requests, elapsed / requests * 1000
+
+
+def run(requests):
+    from unittest.mock import patch
+
+    from django.contrib.auth.models import User
+    from rest_framework.authentication import SessionAuthentication
+    from rest_framework.test import APIClient
+    from rest_framework.views import APIView
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from api import views
+    from api.authentication import CachedJWTAuthentication
+
+    user = User.objects.create_user(username='bench', email='bench@example.com', password='bench-pass-123')
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+
+    # (default classes, SubscriptionStatusView's classes); views copy the
+    # REST_FRAMEWORK defaults at import, so they are patched on APIView
+    modes = {
+        'jwt': ([JWTAuthentication, SessionAuthentication], [JWTAuthentication, SessionAuthentication]),
+        'cached': ([CachedJWTAuthentication, SessionAuthentication],
+                   views.SubscriptionStatusView.authentication_classes),
+    }
+    results = {}
+    for mode, (default_classes, status_view_classes) in modes.items():
+        with patch.object(APIView, 'authentication_classes', default_classes), \
+                patch.object(APIView, 'throttle_classes', []), \
+                patch.object(views.SubscriptionStatusView, 'authentication_classes', status_view_classes):
+            for path in ENDPOINTS:
+                results[mode, path] = measure(client, path, requests)
+
+    print(f"{'endpoint':28} {'jwt q/req':>10} {'cached q/req':>13} {'saved':>6} {'jwt ms':>8} {'cached ms':>10}")
+    for path in ENDPOINTS:
+        (jwt_queries, jwt_ms), (cached_queries, cached_ms) = results['jwt', path], results['cached', path]
+        print(f"{path:28} {jwt_queries:10.2f} {cached_queries:13.2f} {jwt_queries - cached_queries:6.2f} "
+              f"{jwt_ms:8.2f} {cached_ms:10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint and mode')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fitness_backend.settings')
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        run(args.requests)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Concurrent throughput benchmark for the MCP server's tool handlers.
+
+Seeds a throwaway ChromaDB store, then fires a mixed load of
+analyze_workout_patterns and find_similar_workouts calls in two modes:
+
+  inline    run_tool called directly inside the async handler (the old behaviour)
+  executor  call_tool, which runs each tool on the bounded thread pool
+
+For each mode it reports throughput, p50/p95 latency and the longest
+event-loop stall seen by a heartbeat task.
+
+Usage (from backend/):
+    python -m benchmarks.mcp_concurrency --users 50 --workouts 200 --calls 400 --concurrency 32
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+
+def seed(users, workouts_per_user):
+    from api.chroma_setup import get_collections, store_workouts_in_chroma
+
+    collections = get_collections()
+    rng = random.Random(1)
+    for user in range(users):
+        workouts = [
+            {
+                'id': str(i),
+                'activity_type': rng.choice(['run', 'cycle', 'walk', 'swim']),
+                'duration': rng.uniform(15, 120),
+                'distance': rng.uniform(1, 40),
+                'heart_rate_avg': rng.uniform(110, 170),
+                'heart_rate_max': rng.uniform(150, 200),
+                'intensity': rng.choice(['low', 'moderate', 'high']),
+                'date': f'2026-01-{i % 28 + 1:02d}T07:00:00',
+                'vo2max_estimate': rng.uniform(25, 60),
+            }
+            for i in range(workouts_per_user)
+        ]
+        store_workouts_in_chroma(
+            collections['workouts'], workouts, str(user),
+            patterns_collection=collections['user_patterns'],
+        )
+
+
+def make_calls(users, count):
+    rng = random.Random(2)
+    calls = []
+    for _ in range(count):
+        user_id = str(rng.randrange(users))
+        if rng.random() < 0.5:
+            calls.append(('analyze_workout_patterns', {'user_id': user_id, 'recent_workouts': [{'id': 'x'}]}))
+        else:
+            calls.append(('find_similar_workouts', {
+                'user_id': user_id,
+                'workout_data': {'activity_type': 'run', 'duration': 40, 'distance': 8,
+                                 'heart_rate_avg': 150, 'heart_rate_max': 180,
+                                 'intensity': 'moderate', 'vo2max_estimate': 45},
+                'limit': 5,
+            }))
+    return calls
+
+
+async def run_mode(mcp_server, calls, concurrency, inline):
+    gate = asyncio.Semaphore(concurrency)
+    latencies = []
+    max_stall = 0.0
+    done = asyncio.Event()
+
+    async def heartbeat():
+        nonlocal max_stall
+        interval = 0.005
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            max_stall = max(max_stall, time.perf_counter() - started - interval)
+
+    async def one(name, arguments):
+        async with gate:
+            started = time.perf_counter()
+            if inline:
+                mcp_server.run_tool(name, arguments)
+            else:
+                await mcp_server.call_tool(name, arguments)
+            latencies.append(time.perf_counter() - started)
+
+    beat = asyncio.create_task(heartbeat())
+    started = time.perf_counter()
+    await asyncio.gather(*(one(name, arguments) for name, arguments in calls))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await beat
+
+    latencies.sort()
+    return {
+        'throughput': len(calls) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        'max_loop_stall_ms': max_stall * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--workouts', type=int, default=200, help='Workouts per user')
+    parser.add_argument('--calls', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=32, help='Concurrent client requests')
+    parser.add_argument('--workers', type=int, default=8, help='MCP_MAX_CONCURRENT_TOOLS')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['CHROMA_DB_PATH'] = tmp
+        os.environ['MCP_MAX_CONCURRENT_TOOLS'] = str(args.workers)
+        from api import mcp_server
+
+        print(f"Seeding {args.users} users x {args.workouts} workouts...")
+        seed(args.users, args.workouts)
+        calls = make_calls(args.users, args.calls)
+
+        print(f"{args.calls} mixed calls, {args.concurrency} concurrent, {args.workers} tool workers\n")
+        print(f"{'mode':<10}{'calls/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'max loop stall ms':>20}")
+        for label, inline in (('inline', True), ('executor', False)):
+            result = asyncio.run(run_mode(mcp_server, calls, args.concurrency, inline))
+            print(f"{label:<10}{result['throughput']:>10.1f}{result['p50_ms']:>10.1f}"
+                  f"{result['p95_ms']:>10.1f}{result['max_loop_stall_ms']:>20.1f}")
+
+
+if __name__ == '__main__':
+    main()
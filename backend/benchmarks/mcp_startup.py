@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark for the MCP server.
+
+Spawns `python -m api.mcp_server` over stdio against a throwaway ChromaDB
+store and measures, from process launch:
+
+  initialize   time until the MCP initialize handshake completes
+  list_tools   time until the first list_tools response
+  first tool   time until the first real tool (analyze_workout_patterns) responds
+
+Each scenario runs with the background warm-up on and off (MCP_WARMUP).
+
+Usage (from backend/):
+    python -m benchmarks.mcp_startup --runs 5 --idle 0.5
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from mcp import ClientSession
+from mcp.client.stdio import StdioServerParameters, stdio_client
+
+
+async def measure(chroma_path, warmup, idle):
+    env = dict(os.environ, CHROMA_DB_PATH=chroma_path, MCP_WARMUP='true' if warmup else 'false')
+    params = StdioServerParameters(command=sys.executable, args=['-m', 'api.mcp_server'], env=env)
+
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull:
+        async with stdio_client(params, errlog=devnull) as (read_stream, write_stream):
+            async with ClientSession(read_stream, write_stream) as session:
+                await session.initialize()
+                initialized = time.perf_counter() - started
+
+                await session.list_tools()
+                listed = time.perf_counter() - started
+
+                # An agent usually spends some time between listing and calling tools
+                await asyncio.sleep(idle)
+                await session.call_tool('analyze_workout_patterns',
+                                        {'user_id': 'bench', 'recent_workouts': [{'id': 'x'}]})
+                first_tool = time.perf_counter() - started - idle
+
+    return initialized, listed, first_tool
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--idle', type=float, default=0.5,
+                        help='Seconds between list_tools and the first tool call (excluded from timings)')
+    args = parser.parse_args()
+
+    print(f"{'warm-up':<10}{'initialize ms':>15}{'list_tools ms':>15}{'first tool ms':>15}   (median of {args.runs})")
+    for warmup in (False, True):
+        samples = []
+        for _ in range(args.runs):
+            with tempfile.TemporaryDirectory() as tmp:
+                samples.append(asyncio.run(measure(tmp, warmup, args.idle)))
+        initialized, listed, first_tool = (statistics.median(column) * 1000 for column in zip(*samples))
+        print(f"{'on' if warmup else 'off':<10}{initialized:>15.0f}{listed:>15.0f}{first_tool:>15.0f}")
+
+
+if __name__ == '__main__':
+    main()
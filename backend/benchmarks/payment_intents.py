@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Load test for the payment endpoints against the bundled fake Stripe API.
+
+Registers a number of throwaway users, then has them create payment
+intents concurrently (the first intent per user also creates the Stripe
+customer) and reports throughput and p50/p95 latency. With --admin-token
+it also prints the server's per-operation Stripe call latencies from
+/api/payments/stats/.
+
+Usage (from backend/):
+    python manage.py run_fake_stripe --latency 0.05
+    STRIPE_API_BASE=http://127.0.0.1:12111 python manage.py runserver
+    python -m benchmarks.payment_intents --users 50 --intents 400 --concurrency 16
+"""
+
+import argparse
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+def request_json(url, payload=None, token=None):
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f"Bearer {token}"
+    data = json.dumps(payload).encode() if payload is not None else None
+    request = urllib.request.Request(url, data=data, headers=headers, method='POST' if data else 'GET')
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            status, body = response.status, json.loads(response.read() or b'{}')
+    except urllib.error.HTTPError as e:
+        status, body = e.code, {}
+    return status, body, time.perf_counter() - started
+
+
+def register(base_url, prefix, index):
+    username = f"{prefix}_{index}"
+    status, body, _ = request_json(f"{base_url}/auth/register/", {
+        'username': username, 'email': f"{username}@example.com", 'password': uuid.uuid4().hex,
+    })
+    if status != 200:
+        raise SystemExit(f"Registering {username} failed with HTTP {status}")
+    return body['tokens']['access']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--intents', type=int, default=200, help='Payment intents to create in total')
+    parser.add_argument('--plan', default='premium')
+    parser.add_argument('--url', default='http://127.0.0.1:8000/api')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--admin-token', help='Access token of a staff user, to print server-side Stripe stats')
+    args = parser.parse_args()
+
+    prefix = f"bench_{uuid.uuid4().hex[:8]}"
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        tokens = list(pool.map(lambda i: register(args.url, prefix, i), range(args.users)))
+
+    def create_intent(i):
+        return request_json(f"{args.url}/payments/create-intent/", {'plan': args.plan}, tokens[i % len(tokens)])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(create_intent, range(args.intents)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for _, _, latency in results)
+    statuses = {}
+    for status, _, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+
+    print(f"intents     {len(results)} for {len(tokens)} users")
+    print(f"statuses    {statuses}")
+    print(f"throughput  {len(results) / elapsed:.1f} intents/s")
+    print(f"latency     p50 {statistics.median(latencies) * 1000:.1f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms")
+
+    if args.admin_token:
+        status, stats, _ = request_json(f"{args.url}/payments/stats/", token=args.admin_token)
+        for operation, entry in sorted(stats.items()):
+            print(f"stripe      {operation}: {entry['calls']} calls, {entry['errors']} errors, "
+                  f"p50 {entry['p50_ms']} ms, p95 {entry['p95_ms']} ms")
+
+
+if __name__ == '__main__':
+    main()
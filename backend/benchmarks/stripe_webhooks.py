@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Load test for the Stripe webhook endpoint with locally generated events.
+
+Generates subscription lifecycles (created, renewals with payments,
+some cancellations) for a number of fake users. A share of the events
+is re-sent as duplicates, the way Stripe retries slow deliveries. Each
+event is signed with the webhook secret and POSTed concurrently, and the
+script reports throughput, p50/p95 latency and how many duplicates the
+endpoint acknowledged. With --output the events are written as NDJSON
+instead, for `manage.py replay_stripe_events --file`.
+
+Usage (from backend/, with the dev server running):
+    python -m benchmarks.stripe_webhooks --users 500 --duplicates 0.1 --concurrency 32
+    python manage.py process_stripe_events
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from api.fake_stripe import generate_events, signed_request
+
+
+def post_event(url, event, secret):
+    body, signature = signed_request(event, secret)
+    request = urllib.request.Request(url, data=body, method='POST', headers={
+        'Content-Type': 'application/json',
+        'Stripe-Signature': signature,
+    })
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            status = response.status
+            duplicate = json.loads(response.read() or b'{}').get('duplicate', False)
+    except urllib.error.HTTPError as e:
+        status, duplicate = e.code, False
+    return status, duplicate, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--first-user-id', type=int, default=1,
+                        help='Events reference users from this id upwards')
+    parser.add_argument('--duplicates', type=float, default=0.1, help='Share of events sent twice')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', default='http://127.0.0.1:8000/api/payments/webhook/')
+    parser.add_argument('--secret', default=os.getenv('STRIPE_WEBHOOK_SECRET', 'whsec_your_webhook_secret'))
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--output', help='Write events as NDJSON to this path instead of posting them')
+    args = parser.parse_args()
+
+    user_ids = range(args.first_user_id, args.first_user_id + args.users)
+    events = list(generate_events(user_ids, seed=args.seed, duplicate_rate=args.duplicates))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            for event in events:
+                f.write(json.dumps(event) + '\n')
+        print(f"Wrote {len(events)} events to {args.output}")
+        return
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda event: post_event(args.url, event, args.secret), events))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for _, _, latency in results)
+    statuses = {}
+    for status, _, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    duplicates = sum(1 for _, duplicate, _ in results if duplicate)
+
+    print(f"events      {len(events)} ({duplicates} acknowledged as duplicates)")
+    print(f"statuses    {statuses}")
+    print(f"throughput  {len(events) / elapsed:.1f} events/s")
+    print(f"latency     p50 {statistics.median(latencies) * 1000:.1f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
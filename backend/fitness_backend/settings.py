@@ -38,6 +38,33 @@ STRIPE_PUBLIC_KEY = os.getenv('STRIPE_PUBLIC_KEY', 'pk_test_your_stripe_public_k
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', 'sk_test_your_stripe_secret_key')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', 'whsec_your_webhook_secret')
 
+# Stripe API client (api/payments.py). STRIPE_API_BASE overrides the API
+# host, e.g. http://127.0.0.1:12111 for `manage.py run_fake_stripe`
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE') or None
+STRIPE_CONNECT_TIMEOUT = float(os.getenv('STRIPE_CONNECT_TIMEOUT', 5))
+STRIPE_READ_TIMEOUT = float(os.getenv('STRIPE_READ_TIMEOUT', 30))
+STRIPE_MAX_RETRIES = int(os.getenv('STRIPE_MAX_RETRIES', 2))
+STRIPE_POOL_SIZE = int(os.getenv('STRIPE_POOL_SIZE', 10))
+
+# CHROMA SETTINGS
+CHROMA_DB_PATH = os.getenv('CHROMA_DB_PATH', str(BASE_DIR / 'chroma_db'))
+
+# Similar-workout search backend: 'chroma', or 'numpy' for the local
+# memory-mapped index (exact search, metric 'cosine' or 'l2')
+SIMILARITY_BACKEND = os.getenv('SIMILARITY_BACKEND', 'chroma')
+SIMILARITY_INDEX_PATH = os.getenv('SIMILARITY_INDEX_PATH', str(BASE_DIR / 'similarity_index'))
+SIMILARITY_METRIC = os.getenv('SIMILARITY_METRIC', 'cosine')
+
+# Precomputed recommendation sets older than this (seconds) are recomputed live
+RECOMMENDATION_MAX_AGE = int(os.getenv('RECOMMENDATION_MAX_AGE', 24 * 3600))
+
+# Subscription entitlement cache: a per-process LRU (entries live at most
+# ENTITLEMENT_LOCAL_TTL seconds) in front of an optional shared Django cache
+# alias, e.g. a Redis cache configured in CACHES
+ENTITLEMENT_CACHE = os.getenv('ENTITLEMENT_CACHE') or None
+ENTITLEMENT_LOCAL_TTL = int(os.getenv('ENTITLEMENT_LOCAL_TTL', 30))
+ENTITLEMENT_CACHE_SIZE = int(os.getenv('ENTITLEMENT_CACHE_SIZE', 10000))
+
 # Subscription plans (in cents)
 SUBSCRIPTION_PLANS = {
     'premium': {
@@ -75,6 +102,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    'rest_framework_simplejwt.token_blacklist',
     'corsheaders',
     'api',
 ]
@@ -230,12 +258,18 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_EXP_CLAIM': 'refresh_exp',
     'SLIDING_TOKEN_LIFETIME': timedelta(minutes=5),
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
+    # Checks refresh tokens against an in-process blacklist filter (api/refresh_tokens.py)
+    'TOKEN_REFRESH_SERIALIZER': 'api.refresh_tokens.RefreshTokenSerializer',
 }
 
+# Per-process cache of users for api.authentication.CachedJWTAuthentication
+AUTH_USER_CACHE_TTL = int(os.getenv('AUTH_USER_CACHE_TTL', 60))
+AUTH_USER_CACHE_SIZE = int(os.getenv('AUTH_USER_CACHE_SIZE', 10000))
+
 # Rate limiting (basic)
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_THROTTLE_CLASSES': [
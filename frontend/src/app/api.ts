@@ -157,9 +157,23 @@ export class Api {
     });
   }
 
+  // One page of workouts, newest first; pass the returned `next` cursor to get the following page
+  getWorkoutsPage(limit: number = 100, cursor?: string): Observable<{ results: any[]; next: string | null }> {
+    const params: Record<string, string | number> = { limit };
+    if (cursor) {
+      params['cursor'] = cursor;
+    }
+    return this.http.get<{ results: any[]; next: string | null }>(this.baseUrl + 'workouts/', {
+      headers: this.getAuthHeaders(),
+      params,
+    });
+  }
+
+  // The user's full workout history, newest first, in one request (for the dashboard charts)
   getWorkouts(): Observable<any[]> {
     return this.http.get<any[]>(this.baseUrl + 'workouts/', {
       headers: this.getAuthHeaders(),
+      params: { all: 'true' },
     });
   }
 